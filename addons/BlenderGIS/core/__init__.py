@@ -1,7 +1,7 @@
 import logging
 logging.basicConfig(level=logging.getLevelName('INFO'))
 
-from .checkdeps import HAS_GDAL, HAS_PYPROJ, HAS_IMGIO, HAS_PIL
+from .checkdeps import HAS_GDAL, HAS_PYPROJ, HAS_IMGIO, HAS_PIL, HAS_SCIPY
 from .settings import settings
 from .errors import OverlapError
 
@@ -9,8 +9,10 @@ from .utils import XY, BBOX
 
 from .proj import SRS, Reproj, reprojPt, reprojPts, reprojBbox, reprojImg
 
-from .georaster import GeoRef, GeoRaster, NpImage
+from .georaster import GeoRef, GeoRaster, NpImage, HeightField, HeightFieldStack
 
-from .basemaps import GRIDS, SOURCES, MapService, GeoPackage, TileMatrix
+from .vector import ShpArrayReader, PackedRTree
+
+from .basemaps import GRIDS, SOURCES, MapService, GeoPackage, TileMatrix, DemService
 
 from .lib import shapefile
@@ -1,3 +1,4 @@
 from .servicesDefs import GRIDS, SOURCES
 from .mapservice import MapService, TileMatrix, BBoxRequest, BBoxRequestMZ
 from .gpkg import GeoPackage
+from .demservice import DemService, HttpDemServer, LocalDemServer
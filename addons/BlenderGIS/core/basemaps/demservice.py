@@ -0,0 +1,216 @@
+# -*- coding:utf-8 -*-
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+#built-in imports
+import logging
+log = logging.getLogger(__name__)
+
+import os
+import math
+import hashlib
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+#core imports
+from ..georaster import GeoRaster, GeoRef, NpImage
+from ..georaster.img_utils import isValidStream
+from ..utils import BBOX
+from ..errors import OverlapError
+
+from .. import settings
+USER_AGENT = settings.user_agent
+
+TIMEOUT = 120
+
+# Size in degrees of the cells of the grid used to split and cache DEM requests
+DEM_TILE_SIZE = 0.25
+
+# Web services does not always respect the entire requested bbox, so request for a little more
+DEM_TILE_MARGIN = 0.002
+
+
+def _atomicSave(img, path):
+	'''
+	Save a NpImage in a temporary file then rename it, so an interrupted write never leaves
+	a partial file in the cache. The worldfile is renamed first because the tif flags a cache hit
+	'''
+	base = os.path.splitext(path)[0]
+	tmpBase = '{}.{}.tmp'.format(base, os.getpid())
+	img.save(tmpBase + '.tif')
+	if os.path.isfile(tmpBase + '.wld'):
+		os.replace(tmpBase + '.wld', base + '.wld')
+	os.replace(tmpBase + '.tif', path)
+
+
+class HttpDemServer():
+	'''DEM web service, the url template must contains {W}, {E}, {S} and {N} placeholders for a bbox in EPSG:4326'''
+
+	def __init__(self, urlTemplate):
+		self.urlTemplate = urlTemplate
+
+	@property
+	def key(self):
+		return self.urlTemplate
+
+	def fetch(self, bbox, path):
+		'''Download a geotiff covering the bbox and write it to path'''
+		url = self.urlTemplate.format(W=bbox.xmin, E=bbox.xmax, S=bbox.ymin, N=bbox.ymax)
+		log.debug(url)
+		rq = Request(url, headers={'User-Agent': USER_AGENT})
+		with urlopen(rq, timeout=TIMEOUT) as response:
+			data = response.read()
+		if not isValidStream(data):
+			raise IOError("DEM server does not return a valid raster for url {}".format(url))
+		tmpPath = '{}.{}.tmp'.format(path, os.getpid())
+		with open(tmpPath, 'wb') as outFile:
+			outFile.write(data)
+		os.replace(tmpPath, path)
+
+
+class LocalDemServer():
+	'''
+	Stand-in for a DEM web service that serves windows of a local georeferenced raster in EPSG:4326,
+	useful to build scenes offline or to test the cache without network access
+	'''
+
+	def __init__(self, path):
+		self.path = path
+
+	@property
+	def key(self):
+		st = os.stat(self.path)
+		return 'file://{}?size={}&mtime={}'.format(os.path.abspath(self.path), st.st_size, st.st_mtime_ns)
+
+	def fetch(self, bbox, path):
+		rast = GeoRaster(self.path, subBoxGeo=bbox)
+		img = rast.readAsNpArray(subset=True)
+		_atomicSave(img, path)
+
+
+class DemService():
+	'''
+	Get a DEM for any bbox in EPSG:4326 without any user interface.
+	The requested bbox is split along a regular grid of tileSize degrees, each tile is downloaded once
+	and then cached on disk, keyed by the source, the tile size and the tile numbers.
+	The tiles are finally merged and clipped to the bbox in a mosaic, also cached.
+
+	>>> dem = DemService(urlTemplate, cacheFolder)
+	>>> path = dem.getDem(bbox)
+	'''
+
+	def __init__(self, server, cacheFolder, tileSize=DEM_TILE_SIZE):
+		'''
+		server : url template of a web service, path to a local raster or any object with a key property
+			and a fetch(bbox, path) method
+		cacheFolder : root folder of the cache, tiles are stored in a subfolder by source and tile size
+		'''
+		if isinstance(server, str):
+			if os.path.isfile(server):
+				server = LocalDemServer(server)
+			else:
+				server = HttpDemServer(server)
+		self.server = server
+		self.tileSize = tileSize
+		srcKey = hashlib.md5(server.key.encode()).hexdigest()[:16]
+		self.folder = os.path.join(cacheFolder, 'dem', srcKey, str(tileSize))
+		os.makedirs(self.folder, exist_ok=True)
+
+	def tiles(self, bbox):
+		'''(col, row) numbers of the grid cells intersecting the bbox, rows counting from south'''
+		cols = range(math.floor(bbox.xmin / self.tileSize), math.ceil(bbox.xmax / self.tileSize))
+		rows = range(math.floor(bbox.ymin / self.tileSize), math.ceil(bbox.ymax / self.tileSize))
+		return [(col, row) for row in rows for col in cols]
+
+	def getTileBbox(self, col, row):
+		s = self.tileSize
+		return BBOX(col * s, row * s, (col + 1) * s, (row + 1) * s)
+
+	def getTilePath(self, col, row):
+		return os.path.join(self.folder, '{}_{}.tif'.format(col, row))
+
+	def getTile(self, col, row):
+		'''Return the path of a cached tile, the tile is requested to the server if it's not in cache'''
+		path = self.getTilePath(col, row)
+		if os.path.isfile(path):
+			return path
+		bbox = self.getTileBbox(col, row)
+		e = DEM_TILE_MARGIN
+		bbox = BBOX(bbox.xmin - e, bbox.ymin - e, bbox.xmax + e, bbox.ymax + e)
+		try:
+			self.server.fetch(bbox, path)
+		except OverlapError:
+			#local raster does not cover this tile
+			return None
+		return path
+
+	def getDem(self, bbox):
+		'''Return the path of a geotiff in EPSG:4326 covering the bbox'''
+		e = DEM_TILE_MARGIN
+		bbox = BBOX(bbox.xmin - e, bbox.ymin - e, bbox.xmax + e, bbox.ymax + e)
+		tiles = self.tiles(bbox)
+		key = '{:.6f}_{:.6f}_{:.6f}_{:.6f}'.format(bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax)
+		path = os.path.join(self.folder, 'mosaic_' + hashlib.md5(key.encode()).hexdigest()[:16] + '.tif')
+		if os.path.isfile(path):
+			return path
+		paths = [p for p in (self.getTile(col, row) for col, row in tiles) if p is not None]
+		if not paths:
+			raise OverlapError()
+		log.info('Build DEM mosaic from {} tiles'.format(len(paths)))
+		img = self.mosaic(paths, bbox)
+		_atomicSave(img, path)
+		return path
+
+	@staticmethod
+	def mosaic(paths, bbox):
+		'''Merge rasters sharing the same pixel grid into a NpImage clipped to the bbox'''
+		rasts = [GeoRaster(p) for p in paths]
+		ref = rasts[0]
+		if any(rast.hasRotation for rast in rasts):
+			raise ValueError("Cannot mosaic rasters with rotation parameters")
+		pxSize = ref.pxSize
+		if not all(np.allclose(rast.pxSize, pxSize) for rast in rasts):
+			raise ValueError("Cannot mosaic rasters with different resolutions")
+		#output grid is aligned on the pixels of the first raster, y pixels counting from top
+		x0, y0 = ref.origin
+		c1 = math.floor((bbox.xmin - x0) / pxSize.x)
+		c2 = math.ceil((bbox.xmax - x0) / pxSize.x)
+		r1 = math.floor((bbox.ymax - y0) / pxSize.y)
+		r2 = math.ceil((bbox.ymin - y0) / pxSize.y)
+		w, h = c2 - c1 + 1, r2 - r1 + 1
+
+		noData = ref.noData if ref.noData is not None else -32768
+		data = None
+		for rast in rasts:
+			img = rast.readAsNpArray(subset=False)
+			tile = np.ma.filled(img.data, noData) if np.ma.isMaskedArray(img.data) else img.data
+			if data is None:
+				data = np.full((h, w), noData, dtype=tile.dtype)
+			#tile offset in the output grid
+			dx = int(round((rast.origin.x - x0) / pxSize.x)) - c1
+			dy = int(round((rast.origin.y - y0) / pxSize.y)) - r1
+			th, tw = tile.shape[0:2]
+			xa, xb = max(dx, 0), min(dx + tw, w)
+			ya, yb = max(dy, 0), min(dy + th, h)
+			if xa >= xb or ya >= yb:
+				continue
+			data[ya:yb, xa:xb] = tile[ya-dy:yb-dy, xa-dx:xb-dx]
+
+		georef = GeoRef((w, h), pxSize, (x0 + c1 * pxSize.x, y0 + r1 * pxSize.y), pxCenter=True, crs=ref.crs)
+		return NpImage(data, noData=noData, georef=georef)
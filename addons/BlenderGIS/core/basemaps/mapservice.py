@@ -24,6 +24,7 @@ log = logging.getLogger(__name__)
 import math
 import threading
 import queue
+import collections
 import time
 import urllib.request
 import imghdr
@@ -50,6 +51,46 @@ MOSAIC_BKG_COLOR = (128,128,128,255)
 EMPTY_TILE_COLOR = (255,192,203,255) #color for cached tile with empty data
 CORRUPTED_TILE_COLOR = (255,0,0,255) #color for cached tile which is non valid image data
 
+# Number of decoded tiles keeped in memory, shared by all the mosaics built by a MapService instance
+TILES_LRU_SIZE = 512
+
+# Destination tiles are reprojected by blocks of DST_BLOCK_SIZE x DST_BLOCK_SIZE tiles
+DST_BLOCK_SIZE = 4
+
+
+class TilesLRU():
+	'''
+	A thread safe, size limited, in memory cache of decoded tiles (NpImage objects)
+	Least recently used tiles are dropped first when the cache is full
+	'''
+
+	def __init__(self, maxSize=TILES_LRU_SIZE):
+		self.maxSize = maxSize
+		self.tiles = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			img = self.tiles.get(key)
+			if img is not None:
+				self.tiles.move_to_end(key)
+			return img
+
+	def put(self, key, img):
+		with self.lock:
+			self.tiles[key] = img
+			self.tiles.move_to_end(key)
+			while len(self.tiles) > self.maxSize:
+				self.tiles.popitem(last=False)
+
+	def clear(self):
+		with self.lock:
+			self.tiles.clear()
+
+	def __len__(self):
+		return len(self.tiles)
+
+
 class TileMatrix():
 	"""
 	Will inherit attributes from grid source definition
@@ -392,6 +433,9 @@ class MapService():
 		self.cacheFolder = cacheFolder
 		self.caches = {}
 
+		#In memory cache of decoded tiles
+		self.decodedTiles = TilesLRU()
+
 		#Fake browser header
 		self.headers = {
 			'Accept' : 'image/png,image/*;q=0.8,*/*;q=0.5' ,
@@ -607,28 +651,68 @@ class MapService():
 		Return bytes data of the requested tile or None if unable to get valid data
 		Tile is downloaded from map service and, if needed, reprojected to fit the destination grid
 		"""
+		col, row, zoom, data = self.tilesRequest(laykey, [(col, row, zoom)], toDstGrid)[0]
+		return data
+
+
+	def tilesRequest(self, laykey, tiles, toDstGrid=True):
+		"""
+		Return bytes data of the requested tiles [(x,y,z)] >> [(x,y,z,data)], data is None if unable to get valid data
+		When reprojection is needed, all the tiles are built at once from a shared source mosaic
+		so the tiles must be neighbours and share the same zoom level (see groupTilesByBlock())
+		"""
 
 		#Select tile matrix set
 		tm = self.getTM(toDstGrid)
 
 		#don't try to get tiles out of map bounds
-		if not self.isTileInMapsBounds(col, row, zoom, tm):
-			return None
+		inBounds = [(col, row, zoom) for col, row, zoom in tiles if self.isTileInMapsBounds(col, row, zoom, tm)]
 
 		if not toDstGrid:
-			data = self.downloadTile(laykey, col, row, zoom)
+			data = {(col, row, zoom): self.downloadTile(laykey, col, row, zoom) for col, row, zoom in inBounds}
+		elif len(inBounds) > 0:
+			data = self.buildDstTiles(laykey, inBounds)
 		else:
-			data = self.buildDstTile(laykey, col, row, zoom)
+			data = {}
+
+		return [(col, row, zoom, data.get((col, row, zoom))) for col, row, zoom in tiles]
 
-		return data
+
+	def groupTilesByBlock(self, tiles, blockSize=DST_BLOCK_SIZE):
+		"""
+		Split a list of tiles [(x,y,z)] into blocks of neighbours tiles sharing the same zoom level
+		Return a list of tiles list
+		"""
+		blocks = collections.OrderedDict()
+		for col, row, zoom in tiles:
+			k = (zoom, col // blockSize, row // blockSize)
+			blocks.setdefault(k, []).append((col, row, zoom))
+		return list(blocks.values())
 
 
 	def buildDstTile(self, laykey, col, row, zoom):
 		'''build a tile that fit the destination tile matrix'''
+		return self.buildDstTiles(laykey, [(col, row, zoom)]).get((col, row, zoom))
 
-		#get tile bbox
-		bbox = self.dstTms.getTileBbox(col, row, zoom)
-		xmin, ymin, xmax, ymax = bbox
+
+	def buildDstTiles(self, laykey, tiles):
+		'''
+		build a block of tiles that fit the destination tile matrix
+		tiles must share the same zoom level, the whole block is reprojected at once
+		from one source mosaic, return a dict {(x,y,z):data}
+		'''
+
+		zoom = tiles[0][2]
+		if any(z != zoom for _, _, z in tiles):
+			raise ValueError('Cannot build a block of tiles from different zoom levels')
+
+		#get block bbox
+		bboxs = [self.dstTms.getTileBbox(col, row, zoom) for col, row, _ in tiles]
+		xmin = min(bbox[0] for bbox in bboxs)
+		ymin = min(bbox[1] for bbox in bboxs)
+		xmax = max(bbox[2] for bbox in bboxs)
+		ymax = max(bbox[3] for bbox in bboxs)
+		bbox = BBOX(xmin, ymin, xmax, ymax)
 
 		#get closest zoom level
 		res = self.dstTms.getRes(zoom)
@@ -647,20 +731,42 @@ class MapService():
 			_bbox = reprojBbox(crs2, crs1, bbox)
 		except Exception as e:
 			log.warning('Cannot reproj tile bbox - ' + str(e))
-			return None
+			return {}
 
-		#list, download and merge the tiles required to build this one (recursive call)
+		#list, download and merge the tiles required to build this block (recursive call)
 		mosaic = self.getImage(laykey, _bbox, _zoom, toDstGrid=False, nbThread=4, cpt=False)
 
 		if mosaic is None:
-			return None
+			return {}
 
-		#Reprojection
+		#Reprojection of the whole block
 		tileSize = self.dstTms.tileSize
-		img = NpImage(reprojImg(crs1, crs2, mosaic.toGDAL(), out_ul=(xmin,ymax), out_size=(tileSize,tileSize), out_res=res, sqPx=True, resamplAlg=self.RESAMP_ALG))
+		img_w = int(round((xmax - xmin) / res))
+		img_h = int(round((ymax - ymin) / res))
+		img = NpImage(reprojImg(crs1, crs2, mosaic.toGDAL(), out_ul=(xmin,ymax), out_size=(img_w,img_h), out_res=res, sqPx=True, resamplAlg=self.RESAMP_ALG))
+
+		#Split the block into tiles (numpy views)
+		data = {}
+		for (col, row, z), (txmin, tymin, txmax, tymax) in zip(tiles, bboxs):
+			posx = int(round((txmin - xmin) / res))
+			posy = int(round((ymax - tymax) / res))
+			tile = NpImage(img.data[posy:posy+tileSize, posx:posx+tileSize])
+			data[(col, row, z)] = tile.toBLOB()
+
+		return data
 
-		return img.toBLOB()
 
+	def getDecodedTile(self, cacheKey, col, row, zoom, data):
+		"""
+		Return the NpImage object of a tile, decoded tiles are keeped in a LRU cache
+		so that overlapping mosaics (ie neighbours destination tiles) don't decode them again
+		"""
+		key = (cacheKey, col, row, zoom)
+		img = self.decodedTiles.get(key)
+		if img is None:
+			img = NpImage(data)
+			self.decodedTiles.put(key, img)
+		return img
 
 
 
@@ -679,14 +785,14 @@ class MapService():
 				#cancel thread if requested
 				if not self.running:
 					break
-				#Get a job into the queue
-				col, row, zoom = tilesQueue.get() #get() pop the item from queue
+				#Get a job into the queue (a list of tiles)
+				job = tilesQueue.get() #get() pop the item from queue
 				#do the job
-				data = self.tileRequest(laykey, col, row, zoom, toDstGrid)
-				if data is not None:
-					tilesData.put( (col, row, zoom, data) ) #will block if the queue is full
+				for col, row, zoom, data in self.tilesRequest(laykey, job, toDstGrid):
+					if data is not None:
+						tilesData.put( (col, row, zoom, data) ) #will block if the queue is full
 				if cpt:
-					self.cptTiles += 1
+					self.cptTiles += len(job)
 				#self.nTaskDone += 1
 				#flag it's done
 				tilesQueue.task_done() #it's just a count of finished tasks used by join() to know if the work is finished
@@ -736,9 +842,14 @@ class MapService():
 			tilesData = queue.Queue(maxsize=buffSize)
 
 			#Seed the queue
+			#destination tiles are grouped by blocks that will be reprojected at once
 			jobs = queue.Queue()
-			for tile in missing:
-				jobs.put(tile)
+			if toDstGrid:
+				for block in self.groupTilesByBlock(missing):
+					jobs.put(block)
+			else:
+				for tile in missing:
+					jobs.put([tile])
 
 			#Launch threads
 			threads = []
@@ -818,6 +929,7 @@ class MapService():
 
 		#Select tile matrix set
 		tm = self.getTM(toDstGrid)
+		cacheKey = self.getCache(laykey, toDstGrid).dbPath
 
 		#Get request
 		rq = BBoxRequest(tm, bbox, zoom)
@@ -880,7 +992,7 @@ class MapService():
 					img = NpImage.new(tileSize, tileSize, bkgColor=EMPTY_TILE_COLOR)
 				else:
 					try:
-						img = NpImage(data)
+						img = self.getDecodedTile(cacheKey, col, row, z, data)
 					except Exception as e:
 						log.error('Corrupted tile on cache', exc_info=True)
 						#create an empty tile if we are unable to get a valid stream
@@ -23,6 +23,17 @@ else:
 	log.debug('PyProj available')
 
 
+#SciPy
+try:
+	import scipy
+except:
+	HAS_SCIPY = False
+	log.debug('SciPy unavailable')
+else:
+	HAS_SCIPY = True
+	log.debug('SciPy available')
+
+
 #PIL/Pillow
 try:
 	from PIL import Image
@@ -1,5 +1,7 @@
 from .georef import GeoRef
 from .georaster import GeoRaster
 from .npimg import NpImage
+from .tiffreader import TiffWindowReader
 from .bigtiffwriter import BigTiffWriter
 from .img_utils import getImgFormat, getImgDim, isValidStream
+from .heightfield import HeightField, HeightFieldStack
@@ -246,7 +246,11 @@ class GeoRaster():
 		return gdal.Open(self.path, gdal.GA_ReadOnly)
 
 	def readAsNpArray(self, subset=True):
-		'''Read raster pixels values as Numpy Array'''
+		'''
+		Read raster pixels values as Numpy Array
+		With subset, only the pixels of the subbox are read, for TIFF files without GDAL the strips
+		or tiles outside the subbox are not even decoded
+		'''
 
 		if subset and self.subBoxGeo is not None:
 			#georef = GeoRef(self.size, self.pxSize, self.subBoxGeoOrigin, rot=self.rotation, pxCenter=True)
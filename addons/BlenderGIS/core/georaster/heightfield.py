@@ -0,0 +1,317 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of BlenderGIS
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+import numpy as np
+
+from .georef import GeoRef
+from .npimg import NpImage
+from ..utils import BBOX
+from ..maths.interpolation import sampleGrid, resampleGrid
+
+
+class HeightField():
+	'''
+	A regular grid of elevations with its georeferencing, used to query heights with numpy
+	instead of ray casting or shrinkwrapping a terrain mesh
+
+	All query methods accept scalars or numpy arrays of x and y map coordinates
+	and return arrays of the same shape, points outside the grid or over nodata get nan
+	'''
+
+	METHODS = ['NEAREST', 'BILINEAR', 'BICUBIC']
+
+	def __init__(self, data, georef, noData=None, pxCenter=False):
+		'''
+		data : 2D array of elevations, first row is the top of the raster
+		georef : a GeoRef object
+		noData : value used to represent nodata, masked values of a numpy masked array are also considered as nodata
+		pxCenter : if True the valid domain is limited to the extent of pixels centers (ie the vertices of a grid mesh)
+			else it covers the full pixels footprint
+		'''
+		if not isinstance(georef, GeoRef):
+			raise IOError("Georef must be GeoRef() class object not " + str(type(georef)))
+		if np.ma.isMaskedArray(data):
+			data = data.astype(np.float32).filled(np.nan)
+		else:
+			data = np.array(data, dtype=np.float32)
+		if data.ndim != 2:
+			raise ValueError("Height field data must be a 2D array")
+		if noData is not None:
+			data[data == noData] = np.nan
+		self.data = data
+		self.georef = georef
+		self.pxCenter = pxCenter
+
+		#inverse of the affine transformation (geo >> px), origin at upper left pixel center
+		pxSizex, pxSizey = georef.pxSize
+		rotx, roty = georef.rotation
+		m = np.array([[pxSizex, roty], [rotx, pxSizey]], dtype=np.float64)
+		self._mi = np.linalg.inv(m)
+		self._origin = np.array(georef.origin, dtype=np.float64)
+		#step used to compute gradients by finite differences
+		self._h = georef.orthoPxSize.x / 2, georef.orthoPxSize.y / 2
+
+	############################################
+	# Alternative constructors
+	############################################
+
+	@classmethod
+	def fromNpImage(cls, img, bandIdx=0, pxCenter=False):
+		'''init from a georeferenced NpImage instance'''
+		if not img.isGeoref:
+			raise IOError("Image must be georeferenced")
+		data = img.data
+		if data.ndim == 3:
+			data = data[:,:,bandIdx]
+		return cls(data, img.georef, noData=img.noData, pxCenter=pxCenter)
+
+	@classmethod
+	def fromGeoRaster(cls, rast, bandIdx=0, subset=True, pxCenter=False):
+		'''init from a GeoRaster instance, the subbox is applied if any'''
+		return cls.fromNpImage(rast.readAsNpArray(subset), bandIdx, pxCenter)
+
+	@classmethod
+	def fromGrid(cls, x0, y0, dx, dy, z, crs=None):
+		'''
+		init from a grid of points, like a dem mesh
+		x0, y0 : coords of the lower left point
+		dx, dy : grid spacing (positives values)
+		z : 2D array of heights [row, col] with rows ordered from bottom to top
+		'''
+		z = np.asarray(z)
+		ny, nx = z.shape
+		georef = GeoRef((nx, ny), (dx, -dy), (x0, y0 + (ny - 1) * dy), pxCenter=True, crs=crs)
+		return cls(z[::-1], georef, pxCenter=True)
+
+	############################################
+	# Properties
+	############################################
+
+	@property
+	def size(self):
+		return self.georef.rSize
+
+	@property
+	def resolution(self):
+		'''largest pixel dimension in map units'''
+		return max(self.georef.orthoPxSize)
+
+	@property
+	def bbox(self):
+		if not self.pxCenter:
+			return self.georef.bbox
+		pts = self.georef.cornersCenter
+		xs, ys = [pt.x for pt in pts], [pt.y for pt in pts]
+		return BBOX(xmin=min(xs), ymin=min(ys), xmax=max(xs), ymax=max(ys))
+
+	def getMin(self):
+		return float(np.nanmin(self.data))
+
+	def getMax(self):
+		return float(np.nanmax(self.data))
+
+	def __repr__(self):
+		return 'HeightField {}x{} px, resolution {}'.format(self.size.x, self.size.y, self.resolution)
+
+	############################################
+	# Helpers
+	############################################
+
+	def _pxFromGeo(self, x, y):
+		'''vectorized geo >> px, return float columns and rows indices where integer values are pixels centers'''
+		dx, dy = x - self._origin[0], y - self._origin[1]
+		col = self._mi[0, 0] * dx + self._mi[0, 1] * dy
+		row = self._mi[1, 0] * dx + self._mi[1, 1] * dy
+		return col, row
+
+	def _inDomain(self, col, row):
+		w, h = self.data.shape[1], self.data.shape[0]
+		m = 0 if self.pxCenter else 0.5
+		return (col >= -m) & (col <= w - 1 + m) & (row >= -m) & (row <= h - 1 + m)
+
+	def _interp(self, col, row, method):
+		'''interpolate heights at px coords, coords are clamped to the grid'''
+		z = sampleGrid(self.data, col, row, method)
+		if method == 'BICUBIC':
+			#fall back to bilinear where the larger neighbourhood touch a nodata pixel
+			holes = np.isnan(z)
+			if holes.any():
+				z[holes] = sampleGrid(self.data, col[holes], row[holes], 'BILINEAR')
+		return z
+
+	def resample(self, factor, method='BILINEAR'):
+		'''
+		Return a new height field covering the same extent with a pixel size divided by factor,
+		used to upsample a coarse dem to the resolution of a finer level
+		method : NEAREST, BILINEAR, BICUBIC or AKIMA
+		'''
+		h, w = self.data.shape
+		if self.pxCenter:
+			shape = (round((h - 1) * factor) + 1, round((w - 1) * factor) + 1)
+			scale = ((w - 1) / max(shape[1] - 1, 1), (h - 1) / max(shape[0] - 1, 1))
+			offset = (0, 0)
+		else:
+			shape = (max(round(h * factor), 1), max(round(w * factor), 1))
+			scale = (w / shape[1], h / shape[0])
+			offset = (scale[0] / 2 - 0.5, scale[1] / 2 - 0.5)
+		data = resampleGrid(self.data, shape, method, self.pxCenter)
+		#new affine transformation, origin is the center of the upper left pixel
+		pxSizex, pxSizey = self.georef.pxSize
+		rotx, roty = self.georef.rotation
+		ox = self._origin[0] + pxSizex * offset[0] + roty * offset[1]
+		oy = self._origin[1] + rotx * offset[0] + pxSizey * offset[1]
+		georef = GeoRef((shape[1], shape[0]), (pxSizex * scale[0], pxSizey * scale[1]), (ox, oy),
+			rot=(rotx * scale[0], roty * scale[1]), pxCenter=True, crs=self.georef.crs)
+		return HeightField(data, georef, pxCenter=self.pxCenter)
+
+	############################################
+	# Queries
+	############################################
+
+	def contains(self, x, y):
+		'''boolean array flagging the points inside the grid domain'''
+		col, row = self._pxFromGeo(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		return self._inDomain(col, row)
+
+	def sample(self, x, y, method='BILINEAR'):
+		'''interpolated heights at x, y map coordinates'''
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		shape = x.shape
+		col, row = self._pxFromGeo(x.ravel(), y.ravel())
+		inside = self._inDomain(col, row)
+		z = np.full(col.shape, np.nan)
+		if inside.any():
+			z[inside] = self._interp(col[inside], row[inside], method)
+		return z.reshape(shape)
+
+	def gradient(self, x, y, method='BILINEAR'):
+		'''slopes (dz/dx, dz/dy) along map axes computed by central differences'''
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		shape = x.shape
+		x, y = x.ravel(), y.ravel()
+		hx, hy = self._h
+		inside = self._inDomain(*self._pxFromGeo(x, y))
+		dzdx = (self._interp(*self._pxFromGeo(x + hx, y), method) - self._interp(*self._pxFromGeo(x - hx, y), method)) / (2 * hx)
+		dzdy = (self._interp(*self._pxFromGeo(x, y + hy), method) - self._interp(*self._pxFromGeo(x, y - hy), method)) / (2 * hy)
+		dzdx[~inside] = np.nan
+		dzdy[~inside] = np.nan
+		return dzdx.reshape(shape), dzdy.reshape(shape)
+
+	def normals(self, x, y, method='BILINEAR'):
+		'''unit normal vectors as an array of shape (..., 3)'''
+		dzdx, dzdy = self.gradient(x, y, method)
+		n = np.stack((-dzdx, -dzdy, np.ones_like(dzdx)), axis=-1)
+		return n / np.linalg.norm(n, axis=-1)[..., np.newaxis]
+
+	def drape(self, pts, method='BILINEAR', offset=0):
+		'''
+		Return a copy of a (n,3) array of points with z replaced by the terrain height plus an offset
+		Points outside the grid or over nodata keep their original z
+		'''
+		pts = np.array(pts, dtype=np.float64)
+		z = self.sample(pts[:, 0], pts[:, 1], method)
+		hits = ~np.isnan(z)
+		pts[hits, 2] = z[hits] + offset
+		return pts
+
+
+class HeightFieldStack():
+	'''
+	A set of overlapping height fields of different resolutions, like nested zoom levels.
+	Each query is answered by the finest level that covers the point and has data
+	'''
+
+	def __init__(self, fields=None):
+		self.fields = []
+		if fields is not None:
+			for field in fields:
+				self.add(field)
+
+	def add(self, field):
+		if not isinstance(field, HeightField):
+			field = HeightField.fromNpImage(field) if isinstance(field, NpImage) else HeightField.fromGeoRaster(field)
+		self.fields.append(field)
+		#finest first
+		self.fields.sort(key=lambda f: f.resolution)
+
+	def __len__(self):
+		return len(self.fields)
+
+	def __iter__(self):
+		return iter(self.fields)
+
+	def __repr__(self):
+		return 'HeightFieldStack of {} levels :\n'.format(len(self)) + '\n'.join(repr(f) for f in self.fields)
+
+	@property
+	def bbox(self):
+		bbox = None
+		for field in self.fields:
+			bbox = field.bbox if bbox is None else bbox + field.bbox
+		return bbox
+
+	def levels(self, x, y, method='BILINEAR'):
+		'''
+		Return the index of the level that answers each point (-1 if none) and the sampled heights
+		'''
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		shape = x.shape
+		x, y = x.ravel(), y.ravel()
+		idx = np.full(x.shape, -1, dtype=np.intp)
+		z = np.full(x.shape, np.nan)
+		todo = np.arange(len(x))
+		for k, field in enumerate(self.fields):
+			if len(todo) == 0:
+				break
+			zk = field.sample(x[todo], y[todo], method)
+			found = ~np.isnan(zk)
+			idx[todo[found]] = k
+			z[todo[found]] = zk[found]
+			todo = todo[~found]
+		return idx.reshape(shape), z.reshape(shape)
+
+	def sample(self, x, y, method='BILINEAR'):
+		return self.levels(x, y, method)[1]
+
+	def contains(self, x, y):
+		return self.levels(x, y, 'NEAREST')[0] >= 0
+
+	def gradient(self, x, y, method='BILINEAR'):
+		x, y = np.broadcast_arrays(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+		idx, _ = self.levels(x, y, method)
+		dzdx, dzdy = np.full(x.shape, np.nan), np.full(x.shape, np.nan)
+		for k, field in enumerate(self.fields):
+			sel = idx == k
+			if sel.any():
+				dzdx[sel], dzdy[sel] = field.gradient(x[sel], y[sel], method)
+		return dzdx, dzdy
+
+	def normals(self, x, y, method='BILINEAR'):
+		dzdx, dzdy = self.gradient(x, y, method)
+		n = np.stack((-dzdx, -dzdy, np.ones_like(dzdx)), axis=-1)
+		return n / np.linalg.norm(n, axis=-1)[..., np.newaxis]
+
+	def drape(self, pts, method='BILINEAR', offset=0):
+		pts = np.array(pts, dtype=np.float64)
+		z = self.sample(pts[:, 0], pts[:, 1], method)
+		hits = ~np.isnan(z)
+		pts[hits, 2] = z[hits] + offset
+		return pts
@@ -23,11 +23,16 @@ import os
 import io
 import random
 
+import logging
+log = logging.getLogger(__name__)
+
 import numpy as np
 
 from .georef import GeoRef
+from .tiffreader import TiffWindowReader
+from .img_utils import getImgFormat
 from ..proj.reproj import reprojImg
-from ..maths.fillnodata import replace_nans #inpainting function (ie fill nodata)
+from ..maths.fillnodata import replace_nans, replace_nans_pyramid #inpainting functions (ie fill nodata)
 from ..utils import XY as xy
 from ..checkdeps import HAS_GDAL, HAS_PIL, HAS_IMGIO
 from .. import settings
@@ -88,6 +93,8 @@ class NpImage():
 		* With GDAL the subbox filter can be applyed at reading level whereas with others imaging
 		library, all the data must be extracted before we can extract the subset (using numpy slice).
 		In this case, the dataset must fit entirely in memory otherwise it will raise an overflow error
+		* Without GDAL, TIFF files are an exception : only the strips or tiles intersecting the subbox
+		are decoded by TiffWindowReader
 		* If no georef was submited and when the class is init using gdal support or from another npImage instance,
 		existing georef of input data will be automatically extracted and adjusted against the subbox
 		'''
@@ -220,6 +227,10 @@ class NpImage():
 
 	def _npFromPath(self, path):
 		'''Get Numpy array from a file path'''
+		if self.subBoxPx is not None and self.IFACE != 'GDAL':
+			data = self._npFromTiffWindow(path)
+			if data is not None:
+				return data
 		if self.IFACE == 'PIL':
 			img = Image.open(path)
 			return self._npFromPIL(img)
@@ -229,6 +240,25 @@ class NpImage():
 			ds = gdal.Open(path)
 			return self._npFromGDAL(ds)
 
+	def _npFromTiffWindow(self, path):
+		'''Read only the subbox of a TIFF file, return None if the file cannot be read this way'''
+		if getImgFormat(path) != 'TIFF':
+			return None
+		try:
+			reader = TiffWindowReader(path)
+		except NotImplementedError as e:
+			log.debug('Windowed reading unavailable, the full image will be decoded : {}'.format(e))
+			return None
+		except Exception as e:
+			log.warning('Unable to parse tiff file {} : {}'.format(path, e))
+			return None
+		x1, y1 = self.subBoxPx.xmin, self.subBoxPx.ymin
+		width = (self.subBoxPx.xmax - self.subBoxPx.xmin) + 1
+		height = (self.subBoxPx.ymax - self.subBoxPx.ymin) + 1
+		data = reader.read(x1, y1, width, height)
+		self.subBoxPx = None
+		return data
+
 	def _npFromBLOB(self, data):
 		'''Get Numpy array from Bytes data'''
 
@@ -434,7 +464,11 @@ class NpImage():
 		if not self.isFloat:
 			self.data = self.data.astype('float32')
 
-	def fillNodata(self):
+	def fillNodata(self, pyramid=False):
+		'''
+		Replace nodata values with interpolated ones, with GDAL if available or with an inpainting function
+		pyramid=True uses the multi resolution inpainting, which follows the slopes around large voids
+		'''
 		#if not self.noData in self.data:
 		if not np.ma.is_masked(self.data):
 			#do not process it if its not necessary
@@ -457,7 +491,10 @@ class NpImage():
 			# Fill mask with NaN (warning NaN is a special value for float arrays only)
 			self.data =  np.ma.filled(self.data, np.NaN)
 			# Inpainting
-			self.data = replace_nans(self.data, max_iter=5, tolerance=0.5, kernel_size=2, method='localmean')
+			if pyramid:
+				self.data = replace_nans_pyramid(self.data)
+			else:
+				self.data = replace_nans(self.data, max_iter=5, tolerance=0.5, kernel_size=2, method='localmean')
 
 	def reproj(self, crs1, crs2, out_ul=None, out_size=None, out_res=None, sqPx=False, resamplAlg='BL'):
 		ds1 = self.toGDAL()
@@ -0,0 +1,252 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of BlenderGIS
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+import math
+import zlib
+
+import numpy as np
+
+from ..lib import Tyf
+
+
+#Compression tag values supported by the reader
+NONE, LZW, DEFLATE, PACKBITS, ADOBE_DEFLATE = 1, 5, 8, 32773, 32946
+COMPRESSIONS = [NONE, LZW, DEFLATE, PACKBITS, ADOBE_DEFLATE]
+
+
+def _lzwDecode(data):
+	'''Decode a TIFF LZW stream (codes are packed msb first and their length grows one code early)'''
+	CLEAR, EOI = 256, 257
+	data = bytes(data) + b'\x00\x00\x00'
+	nbBits = (len(data) - 3) * 8
+	out = bytearray()
+	table = [bytes([i]) for i in range(256)] + [b'', b'']
+	codeLen = 9
+	prev = None
+	pos = 0
+	while pos + codeLen <= nbBits:
+		#a code is at most 12 bits long and may start anywhere in a byte, 3 bytes always contain it
+		i = pos >> 3
+		word = (data[i] << 16) | (data[i+1] << 8) | data[i+2]
+		code = (word >> (24 - (pos & 7) - codeLen)) & ((1 << codeLen) - 1)
+		pos += codeLen
+		if code == CLEAR:
+			del table[258:]
+			codeLen = 9
+			prev = None
+			continue
+		if code == EOI:
+			break
+		if prev is None:
+			entry = table[code]
+		elif code < len(table):
+			entry = table[code]
+			table.append(prev + entry[:1])
+		else:
+			entry = prev + prev[:1]
+			table.append(entry)
+		out += entry
+		prev = entry
+		if len(table) >= (1 << codeLen) - 1 and codeLen < 12:
+			codeLen += 1
+	return bytes(out)
+
+def _packbitsDecode(data):
+	'''Decode a PackBits run length encoded stream'''
+	out = bytearray()
+	i, n = 0, len(data)
+	while i < n:
+		header = data[i]
+		i += 1
+		if header < 128:
+			#literal run of header+1 bytes
+			out += data[i:i+header+1]
+			i += header + 1
+		elif header > 128:
+			#next byte repeated 257-header times
+			out += data[i:i+1] * (257 - header)
+			i += 1
+	return bytes(out)
+
+
+class TiffWindowReader():
+	'''
+	Read a rectangular window of a baseline TIFF file without decoding the whole image.
+	The IFD is parsed with Tyf, then only the strips or tiles intersecting the window are read :
+	uncompressed blocks are sliced from a memory mapped view of the file and compressed
+	blocks (Deflate, LZW or PackBits) are decoded one by one.
+
+	>>> reader = TiffWindowReader(path)
+	>>> data = reader.read(xoff, yoff, width, height)
+
+	Palette, YCbCr, JPEG compressed and sub byte depth images are not supported,
+	NotImplementedError is raised so the caller can fall back to another imaging library
+	'''
+
+	def __init__(self, path, ifdIdx=0):
+		self.path = path
+
+		with open(path, 'rb') as f:
+			header = f.read(2)
+		if header not in [b'II', b'MM']:
+			raise IOError("Not a valid TIFF file")
+		self.byteorder = '<' if header == b'II' else '>'
+
+		#Tyf does not load raster data when opening a file path, only the tags
+		tif = Tyf.open(path)[ifdIdx]
+		#Warning : Tyf object does not support k in dict test syntax nor get() method with tags names, use tags numbers
+		values = lambda tag, default=None: tif.get(tag).value if tif.get(tag) is not None else default
+
+		self.width = values(256)[0]
+		self.height = values(257)[0]
+		self.nbBands = values(277, (1,))[0]
+		self.compression = values(259, (NONE,))[0]
+		self.predictor = values(317, (1,))[0]
+		self.planar = values(284, (1,))[0]
+		photometric = values(262, (1,))[0]
+
+		if self.compression not in COMPRESSIONS:
+			raise NotImplementedError("Unsupported TIFF compression {}".format(self.compression))
+		if photometric not in [0, 1, 2]:
+			#palette, transparency mask, CMYK, YCbCr, CIELab ...
+			raise NotImplementedError("Unsupported TIFF photometric interpretation {}".format(photometric))
+
+		depths = set(values(258, (1,)))
+		sampleFormats = set(values(339, (1,)))
+		if len(depths) > 1 or len(sampleFormats) > 1:
+			raise NotImplementedError("TIFF bands with different data types are not supported")
+		depth, sampleFormat = depths.pop(), sampleFormats.pop()
+		kind = {1:'u', 2:'i', 3:'f'}.get(sampleFormat)
+		if depth not in [8, 16, 32, 64] or kind is None or (kind == 'f' and depth == 8):
+			raise NotImplementedError("Unsupported TIFF data type, sample format {} with {} bits".format(sampleFormat, depth))
+		self.dtype = np.dtype(self.byteorder + kind + str(depth // 8))
+
+		if self.predictor not in [1, 2, 3] or (self.predictor == 3 and kind != 'f'):
+			raise NotImplementedError("Unsupported TIFF predictor {}".format(self.predictor))
+
+		if 324 in tif:
+			self.isTiled = True
+			self.blockWidth = values(322)[0]
+			self.blockHeight = values(323)[0]
+			self.offsets = values(324)
+			self.byteCounts = values(325)
+		elif 273 in tif:
+			self.isTiled = False
+			self.blockWidth = self.width
+			self.blockHeight = min(values(278, (self.height,))[0], self.height)
+			self.offsets = values(273)
+			self.byteCounts = values(279)
+		else:
+			raise IOError("TIFF file has no raster data")
+
+		self.blocksAcross = math.ceil(self.width / self.blockWidth)
+		self.blocksDown = math.ceil(self.height / self.blockHeight)
+
+	@property
+	def size(self):
+		return (self.width, self.height)
+
+	@property
+	def samplesPerBlock(self):
+		'''number of bands stored in each strip or tile'''
+		return 1 if self.planar == 2 else self.nbBands
+
+	def _blockRows(self, blockRow):
+		'''number of rows actually stored in a block, the last strip can be shorter but tiles are always padded'''
+		if self.isTiled:
+			return self.blockHeight
+		return min(self.blockHeight, self.height - blockRow * self.blockHeight)
+
+	def _unpredict(self, data, rows):
+		'''Revert the horizontal differencing applied before compression'''
+		spb = self.samplesPerBlock
+		if self.predictor == 2:
+			data = data.reshape(rows, self.blockWidth, spb)
+			#integers cumulative sum wraps around like the encoder subtraction did
+			return np.cumsum(data, axis=1, dtype=data.dtype)
+		#floating point predictor : bytes were shuffled by significance then differenced
+		nbBytes = self.dtype.itemsize
+		raw = np.frombuffer(data.tobytes(), dtype=np.uint8).reshape(rows, -1)
+		raw = np.cumsum(raw, axis=1, dtype=np.uint8)
+		raw = raw.reshape(rows, nbBytes, self.blockWidth * spb).transpose(0, 2, 1)
+		return np.ascontiguousarray(raw).view(self.dtype.newbyteorder('>')).reshape(rows, self.blockWidth, spb)
+
+	def _readBlock(self, buf, idx, rows):
+		'''Decode a strip or tile as a (rows, blockWidth, samples) array'''
+		offset, count = self.offsets[idx], self.byteCounts[idx]
+		shape = (rows, self.blockWidth, self.samplesPerBlock)
+		nbValues = rows * self.blockWidth * self.samplesPerBlock
+
+		if self.compression == NONE:
+			#just a view on the memory mapped file, pages are only read when sliced data is copied
+			return buf[offset:offset + nbValues * self.dtype.itemsize].view(self.dtype).reshape(shape)
+
+		raw = bytes(buf[offset:offset + count])
+		if self.compression in [DEFLATE, ADOBE_DEFLATE]:
+			raw = zlib.decompress(raw)
+		elif self.compression == LZW:
+			raw = _lzwDecode(raw)
+		elif self.compression == PACKBITS:
+			raw = _packbitsDecode(raw)
+
+		data = np.frombuffer(raw, dtype=self.dtype, count=nbValues)
+		if self.predictor in [2, 3]:
+			return self._unpredict(data, rows)
+		return data.reshape(shape)
+
+	def read(self, xoff=0, yoff=0, width=None, height=None):
+		'''
+		Read a window of the image, offsets and size are in pixels with y counting from top
+		return a (height, width) array for one band images else a (height, width, bands) array
+		'''
+		width = self.width - xoff if width is None else width
+		height = self.height - yoff if height is None else height
+		if xoff < 0 or yoff < 0 or width <= 0 or height <= 0 or xoff + width > self.width or yoff + height > self.height:
+			raise ValueError("Window ({}, {}, {}, {}) is outside the image".format(xoff, yoff, width, height))
+
+		out = np.empty((height, width, self.nbBands), dtype=self.dtype.newbyteorder('='))
+		planes = range(self.nbBands) if self.planar == 2 else [None]
+		blocksPerPlane = self.blocksAcross * self.blocksDown
+
+		buf = np.memmap(self.path, dtype=np.uint8, mode='r')
+		try:
+			for blockRow in range(yoff // self.blockHeight, (yoff + height - 1) // self.blockHeight + 1):
+				rows = self._blockRows(blockRow)
+				y0 = blockRow * self.blockHeight
+				#rows of the block inside the window
+				r1, r2 = max(yoff, y0) - y0, min(yoff + height, y0 + rows) - y0
+				for blockCol in range(xoff // self.blockWidth, (xoff + width - 1) // self.blockWidth + 1):
+					x0 = blockCol * self.blockWidth
+					c1, c2 = max(xoff, x0) - x0, min(xoff + width, x0 + self.blockWidth, self.width) - x0
+					dst = out[y0 + r1 - yoff:y0 + r2 - yoff, x0 + c1 - xoff:x0 + c2 - xoff]
+					for plane in planes:
+						idx = blockRow * self.blocksAcross + blockCol
+						if plane is None:
+							dst[...] = self._readBlock(buf, idx, rows)[r1:r2, c1:c2]
+						else:
+							idx += plane * blocksPerPlane
+							dst[..., plane] = self._readBlock(buf, idx, rows)[r1:r2, c1:c2, 0]
+		finally:
+			del buf
+
+		if self.nbBands == 1:
+			return out[:, :, 0]
+		return out
@@ -1,4 +1,5 @@
 from .interpo import scale, linearInterpo
+from .interpolation import interp1D, linear1D, akima1D, resampleGrid, sampleGrid
 '''
 from .maths.kmeans1D import kmeans1d, getBreaks
 from . import akima
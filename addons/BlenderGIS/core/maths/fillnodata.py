@@ -28,15 +28,225 @@
 # https://github.com/gasagna/openpiv-python/blob/master/openpiv/src/lib.pyx
 
 
+import time
+
 import numpy as np
 
+from ..checkdeps import HAS_SCIPY
+from .interpolation import sampleGrid
+
+if HAS_SCIPY:
+	from scipy import ndimage
+
 DTYPEf = np.float32
 #DTYPEi = np.int32
 
 
+def _getKernel(kernel_size, method):
+	'''Build the weights kernel used by the inpainting functions'''
+	if method == 'localmean':
+		kernel = np.ones( (2*kernel_size+1, 2*kernel_size+1), dtype=DTYPEf )
+	elif method == 'idw':
+		kernel = np.array([[0, 0.5, 0.5, 0.5,0],
+				  [0.5,0.75,0.75,0.75,0.5],
+				  [0.5,0.75,1,0.75,0.5],
+				  [0.5,0.75,0.75,0.5,1],
+				  [0, 0.5, 0.5 ,0.5 ,0]], dtype=DTYPEf)
+	else:
+		raise ValueError("method not valid. Should be one of 'localmean', 'idw'.")
+	# do not sum itself
+	k = kernel.shape[0] // 2
+	kernel[k, k] = 0
+	return kernel
+
+
+def _correlate(data, kernel):
+	'''
+	2D correlation of data with kernel, values outside the array are considered as zeros
+	Use scipy if available, otherwise sum shifted views of the padded array
+	'''
+	if HAS_SCIPY:
+		return ndimage.correlate(data, kernel, mode='constant', cval=0)
+	k = kernel.shape[0] // 2
+	h, w = data.shape
+	padded = np.pad(data, k, mode='constant')
+	out = np.zeros_like(data)
+	for i in range(kernel.shape[0]):
+		for j in range(kernel.shape[1]):
+			if kernel[i, j] != 0:
+				out += kernel[i, j] * padded[i:i+h, j:j+w]
+	return out
+
+
+def _inpaint(filled, holes, kernel, max_iter, tolerance):
+	'''
+	Iterative normalized convolution, update in place the values of filled array where holes mask is True
+	Each hole is replaced by the weighted average of its non NaN neighbours
+	Holes without any valid neighbour are set to NaN
+
+	Values only spread over kernel radius pixels at each iteration, so the iterations continue
+	beyond max_iter as long as some NaN elements are being filled : all the holes connected
+	to a valid value are filled.
+	'''
+	replaced_old = np.zeros(np.count_nonzero(holes), dtype=DTYPEf)
+	nbNan = np.count_nonzero(np.isnan(filled[holes]))
+	it = 0
+	while True:
+		known = ~np.isnan(filled)
+		num = _correlate(np.where(known, filled, 0).astype(DTYPEf), kernel)
+		den = _correlate(known.astype(DTYPEf), kernel)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			values = np.where(den > 0, num / den, np.nan)
+		filled[holes] = values[holes]
+		it += 1
+		replaced_new = np.nan_to_num(filled[holes])
+		# the known area only grows, so the number of NaN decreases until the remaining ones are unreachable
+		nbNanOld, nbNan = nbNan, np.count_nonzero(np.isnan(filled[holes]))
+		if nbNan < nbNanOld:
+			replaced_old = replaced_new
+			continue
+		# check if mean square difference between values of replaced
+		# elements is below a certain tolerance
+		if np.mean( (replaced_new-replaced_old)**2 ) < tolerance:
+			break
+		if it >= max_iter:
+			break
+		replaced_old = replaced_new
+	return filled
+
+
 def replace_nans(array, max_iter, tolerance, kernel_size=1, method='localmean'):
 	"""
 	Replace NaN elements in an array using an iterative image inpainting algorithm.
+	Vectorized version of replace_nans_py() : at each iteration all the NaN elements are
+	replaced at once by a normalized convolution of the array with the kernel.
+	Only the part of the array surrounding the NaN elements is processed.
+
+	Parameters and returns are the same as replace_nans_py(). Unlike the in place updates of
+	the pure python version, the values only spread over kernel_size pixels at each iteration,
+	so iterations go on beyond max_iter until all the NaN elements connected to a valid value
+	are filled, then until the tolerance or max_iter is reached.
+	Only an array without any valid value is returned with NaN elements.
+
+	Both versions converge to nearly the same values (the pure python kernel also skips the center
+	row and column, this one only the center element), but the in place updates of replace_nans_py()
+	carry the first values met by its raster order sweep across the whole void at each pass, so
+	after a few iterations its result still depends on max_iter and on the sweep direction.
+	On large voids the result is different from the early stopped pure python version and
+	closer to its converged result, use replace_nans_pyramid() to follow the slopes around the voids.
+	"""
+	kernel = _getKernel(kernel_size, method)
+	filled = np.array(array, dtype=DTYPEf)
+
+	holes = np.isnan(filled)
+	if not holes.any():
+		return filled
+
+	# work on the bounding box of the NaN elements extended by the kernel radius
+	k = kernel.shape[0] // 2
+	rows = np.nonzero(holes.any(axis=1))[0]
+	cols = np.nonzero(holes.any(axis=0))[0]
+	i1, i2 = max(rows[0] - k, 0), rows[-1] + k + 1
+	j1, j2 = max(cols[0] - k, 0), cols[-1] + k + 1
+
+	# slices are views, the work area is updated in place
+	_inpaint(filled[i1:i2, j1:j2], holes[i1:i2, j1:j2], kernel, max_iter, tolerance)
+
+	return filled
+
+
+def _laplacian(u):
+	'''5 points laplacian of the inner pixels of an array'''
+	return u[:-2, 1:-1] + u[2:, 1:-1] + u[1:-1, :-2] + u[1:-1, 2:] - 4 * u[1:-1, 1:-1]
+
+
+def _laplacianT(r, shape):
+	'''transpose of _laplacian(), scatter the inner pixels values back to an array of the given shape'''
+	out = np.zeros(shape)
+	out[:-2, 1:-1] += r
+	out[2:, 1:-1] += r
+	out[1:-1, :-2] += r
+	out[1:-1, 2:] += r
+	out[1:-1, 1:-1] -= 4 * r
+	return out
+
+
+def _smooth(filled, holes, max_iter, residualReduction=1e-3):
+	'''
+	Update in place the values of filled array where holes mask is True so they minimize the sum of
+	the squared laplacians (a thin plate surface, which unlike the local mean continues the slopes
+	around the holes), with at most max_iter conjugate gradient iterations from the current values
+	or until the norm of the residual is reduced by residualReduction
+	'''
+	u = filled.astype(np.float64)
+	r = -_laplacianT(_laplacian(u), u.shape)[holes]
+	p = r.copy()
+	rs = rs0 = r @ r
+	z = np.zeros(u.shape)
+	for _ in range(min(max_iter, len(r))):
+		if rs <= residualReduction**2 * rs0:
+			break
+		z[holes] = p
+		Ap = _laplacianT(_laplacian(z), u.shape)[holes]
+		alpha = rs / (p @ Ap)
+		u[holes] += alpha * p
+		r -= alpha * Ap
+		rsNew = r @ r
+		p = r + (rsNew / rs) * p
+		rs = rsNew
+	filled[holes] = u[holes]
+	return filled
+
+
+def replace_nans_pyramid(array, smooth_iter=20):
+	"""
+	Replace all NaN elements of an array, even inside large voids, using a multi resolution approach.
+	NaN elements are initialized by a bilinear upsampling of a half resolution version of the array
+	(filled recursively), then smoothed as a thin plate surface with smooth_iter iterations.
+	Like a multigrid cycle, each level only has to correct the details the coarser level can't
+	represent, so the work per level is bounded and the whole fill is linear in the holes area.
+	The array is returned unchanged if it contains only NaN elements.
+	"""
+	filled = np.array(array, dtype=DTYPEf)
+	holes = np.isnan(filled)
+	if not holes.any() or holes.all():
+		return filled
+
+	h, w = filled.shape
+	if h < 3 or w < 3:
+		filled[holes] = np.nanmean(filled)
+		return filled
+
+	# half resolution array, each cell is the mean of the non NaN values of a 2x2 block
+	padded = np.pad(filled, ((0, h % 2), (0, w % 2)), mode='constant', constant_values=np.nan)
+	blocks = padded.reshape(padded.shape[0] // 2, 2, padded.shape[1] // 2, 2)
+	counts = np.count_nonzero(~np.isnan(blocks), axis=(1, 3))
+	sums = np.nansum(blocks, axis=(1, 3))
+	with np.errstate(divide='ignore', invalid='ignore'):
+		coarse = np.where(counts > 0, sums / counts, np.nan).astype(DTYPEf)
+
+	coarse = replace_nans_pyramid(coarse, smooth_iter)
+
+	# init the remaining holes from the coarser level, the center of a coarse cell is
+	# between the 2 fine pixels it averages
+	rows, cols = np.nonzero(holes)
+	filled[holes] = sampleGrid(coarse, (cols - 0.5) / 2, (rows - 0.5) / 2, 'BILINEAR')
+
+	# smooth the holes on their bounding box extended by the 2 pixels
+	# the laplacian of the border pixels depends on
+	rows = np.nonzero(holes.any(axis=1))[0]
+	cols = np.nonzero(holes.any(axis=0))[0]
+	i1, i2 = max(rows[0] - 2, 0), rows[-1] + 3
+	j1, j2 = max(cols[0] - 2, 0), cols[-1] + 3
+	_smooth(filled[i1:i2, j1:j2], holes[i1:i2, j1:j2], smooth_iter)
+
+	return filled
+
+
+def replace_nans_py(array, max_iter, tolerance, kernel_size=1, method='localmean'):
+	"""
+	Pure python version of the inpainting algorithm, very slow, keeped as reference for benchmark.
+	Replace NaN elements in an array using an iterative image inpainting algorithm.
 	The algorithm is the following:
 	1) For each element in the input array, replace it by a weighted average
 	of the neighbouring elements which are not NaN themselves. The weights depends
@@ -149,6 +359,34 @@ def replace_nans(array, max_iter, tolerance, kernel_size=1, method='localmean'):
 	return filled
 
 
+def benchmark(size=200, voidSize=40, max_iter=5, tolerance=0.5, kernel_size=2, method='localmean'):
+	"""
+	Compare the pure python and the vectorized inpainting functions on a synthetic DEM
+	with a square void in its center. Print and return, for each function, the timing in seconds,
+	the number of remaining NaN and the mean error against the true surface inside the void
+	"""
+	y, x = np.mgrid[0:size, 0:size]
+	truth = (np.sin(x / 20) * np.cos(y / 30) * 100).astype(DTYPEf)
+	dem = truth.copy()
+	c = (size - voidSize) // 2
+	dem[c:c+voidSize, c:c+voidSize] = np.nan
+	void = np.isnan(dem)
+
+	results = {}
+	for func in (replace_nans_py, replace_nans, replace_nans_pyramid):
+		t0 = time.perf_counter()
+		if func is replace_nans_pyramid:
+			filled = func(dem)
+		else:
+			filled = func(dem, max_iter, tolerance, kernel_size, method)
+		timing = time.perf_counter() - t0
+		nbNan = np.count_nonzero(np.isnan(filled))
+		error = float(np.nanmean(np.abs(filled[void] - truth[void])))
+		results[func.__name__] = {'time': timing, 'nan': nbNan, 'error': error}
+		print('{} : {:.3f} s, {} remaining NaN, mean error {:.2f}'.format(func.__name__, timing, nbNan, error))
+	return results
+
+
 def sincinterp(image, x,  y, kernel_size=3 ):
 	"""
 	Re-sample an image at intermediate positions between pixels.
@@ -207,3 +445,14 @@ def sincinterp(image, x,  y, kernel_size=3 ):
 						else:
 							r[I,J] = r[I,J] + image[i,j] * np.sin( pi*(i-x[I,J]) )*np.sin( pi*(j-y[I,J]) )/( pi*pi*(i-x[I,J])*(j-y[I,J]))
 	return r
+
+
+if __name__ == '__main__':
+	#regression checks, the pyramid must fill everything and not be less accurate than the pure python version
+	results = benchmark()
+	for name, result in results.items():
+		if result['nan']:
+			raise SystemExit('{} left {} NaN elements'.format(name, result['nan']))
+	if results['replace_nans_pyramid']['error'] > results['replace_nans_py']['error']:
+		raise SystemExit('replace_nans_pyramid is less accurate than replace_nans_py')
+	print('OK')
@@ -0,0 +1,226 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of BlenderGIS
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+
+########################################
+# Vectorized interpolation
+#
+# 1D functions interpolate many series sharing the same x values at once : y can be a
+# (..., n) array, each row being a series, and the result is a (..., m) array.
+# Values outside the x range are clamped to the first and last values (no extrapolation).
+#
+# Cubic methods are evaluated as cubic Hermite splines, they only differ by the slopes
+# estimated at each data point :
+#	- CUBIC : Catmull-Rom (finite differences of the neighbours)
+#	- AKIMA : Akima's weighted slopes (see akima.py), less prone to overshoot
+#
+# 2D functions work on rasters, grids are resampled by applying the 1D functions
+# along each axis (tensor product), which is much faster than evaluating points one by one
+
+
+import numpy as np
+
+METHODS_1D = ['NEAREST', 'LINEAR', 'CUBIC', 'AKIMA']
+METHODS_2D = {'NEAREST':'NEAREST', 'BILINEAR':'LINEAR', 'BICUBIC':'CUBIC', 'AKIMA':'AKIMA'}
+
+
+def _checkX(x, y):
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	if x.ndim != 1:
+		raise ValueError("x must be one dimensional")
+	n = len(x)
+	if n < 2:
+		raise ValueError("array too small")
+	if y.shape[-1] != n:
+		raise ValueError("size of x-array must match data shape")
+	if np.any(np.diff(x) <= 0):
+		raise ValueError("x-axis not valid, values must be strictly increasing")
+	return x, y
+
+def _locate(x, xNew):
+	'''index of the interval containing each new value and the normalized position inside it'''
+	idx = np.clip(np.searchsorted(x, xNew, side='right') - 1, 0, len(x) - 2)
+	h = x[idx + 1] - x[idx]
+	t = np.clip((xNew - x[idx]) / h, 0, 1)
+	return idx, t, h
+
+def _hermite(y, slopes, idx, t, h):
+	'''evaluate cubic Hermite splines given the slopes at data points'''
+	t2 = t * t
+	t3 = t2 * t
+	h00 = 2 * t3 - 3 * t2 + 1
+	h10 = t3 - 2 * t2 + t
+	h01 = -2 * t3 + 3 * t2
+	h11 = t3 - t2
+	return h00 * y[..., idx] + h10 * h * slopes[..., idx] + h01 * y[..., idx + 1] + h11 * h * slopes[..., idx + 1]
+
+def cubicSlopes(x, y):
+	'''Catmull-Rom slopes, one sided differences at both ends'''
+	slopes = np.empty_like(y)
+	slopes[..., 1:-1] = (y[..., 2:] - y[..., :-2]) / (x[2:] - x[:-2])
+	slopes[..., 0] = (y[..., 1] - y[..., 0]) / (x[1] - x[0])
+	slopes[..., -1] = (y[..., -1] - y[..., -2]) / (x[-1] - x[-2])
+	return slopes
+
+def akimaSlopes(x, y):
+	'''Akima's slopes for each series, same formulation as akima.interpolate'''
+	n = len(x)
+	m = np.diff(y, axis=-1) / np.diff(x)
+	mm = 2.0 * m[..., 0] - m[..., 1]
+	mmm = 2.0 * mm - m[..., 0]
+	mp = 2.0 * m[..., n - 2] - m[..., n - 3]
+	mpp = 2.0 * mp - m[..., n - 2]
+	m1 = np.concatenate((mmm[..., None], mm[..., None], m, mp[..., None], mpp[..., None]), axis=-1)
+	dm = np.abs(np.diff(m1, axis=-1))
+	f1 = dm[..., 2:n + 2]
+	f2 = dm[..., 0:n]
+	f12 = f1 + f2
+	b = m1[..., 1:n + 1].copy()
+	ids = f12 > 1e-9 * np.max(f12, axis=-1, keepdims=True)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		weighted = (f1 * m1[..., 1:n + 1] + f2 * m1[..., 2:n + 2]) / f12
+	b[ids] = weighted[ids]
+	return b
+
+def interp1D(x, y, xNew, method='LINEAR'):
+	'''
+	Interpolate one or many series at new positions
+	x : (n,) strictly increasing values
+	y : (..., n) values of each series
+	xNew : (m,) new positions, or a scalar
+	method : NEAREST, LINEAR, CUBIC or AKIMA. Akima needs at least 3 points, a linear
+		interpolation is computed for shorter series
+	return a (..., m) array
+	'''
+	if method not in METHODS_1D:
+		raise ValueError("Unknown interpolation method {}".format(method))
+	x, y = _checkX(x, y)
+	xNew = np.asarray(xNew, dtype=np.float64)
+	idx, t, h = _locate(x, xNew)
+
+	if method == 'NEAREST':
+		return np.where(t < 0.5, y[..., idx], y[..., idx + 1])
+	if method == 'LINEAR' or (method == 'AKIMA' and len(x) < 3):
+		y0 = y[..., idx]
+		return y0 + t * (y[..., idx + 1] - y0)
+	if method == 'CUBIC':
+		slopes = cubicSlopes(x, y)
+	else:
+		slopes = akimaSlopes(x, y)
+	return _hermite(y, slopes, idx, t, h)
+
+def linear1D(x, y, xNew):
+	return interp1D(x, y, xNew, 'LINEAR')
+
+def akima1D(x, y, xNew):
+	return interp1D(x, y, xNew, 'AKIMA')
+
+
+def _resampleAxis(data, n, newCoords, method, axis):
+	'''interpolate data along one axis at new fractional pixels coordinates'''
+	data = np.moveaxis(data, axis, -1)
+	out = interp1D(np.arange(n, dtype=np.float64), data, newCoords, method)
+	return np.moveaxis(out, -1, axis)
+
+def _newCoords(n, newN, pxCenter):
+	if pxCenter:
+		#first and last pixels centers are kept, like the vertices of a grid mesh
+		if newN == 1:
+			return np.zeros(1)
+		return np.linspace(0, n - 1, newN)
+	#pixels footprints cover the same extent
+	return np.clip((np.arange(newN) + 0.5) * n / newN - 0.5, 0, n - 1)
+
+def resampleGrid(data, shape, method='BILINEAR', pxCenter=False):
+	'''
+	Resample a raster to a new size
+	data : (rows, cols) or (rows, cols, bands) array, nan values propagate to their neighbours
+	shape : new (rows, cols) size
+	method : NEAREST, BILINEAR, BICUBIC or AKIMA
+	pxCenter : if True the centers of the corner pixels are kept in place, else the pixels
+		footprints of both arrays cover the same extent
+	'''
+	if method not in METHODS_2D:
+		raise ValueError("Unknown resampling method {}".format(method))
+	method = METHODS_2D[method]
+	data = np.asarray(data)
+	dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+	h, w = data.shape[0:2]
+	newH, newW = shape
+	#degenerate axis of a single pixel cannot be interpolated
+	if w > 1:
+		data = _resampleAxis(data, w, _newCoords(w, newW, pxCenter), method, axis=1)
+	else:
+		data = np.repeat(data, newW, axis=1)
+	if h > 1:
+		data = _resampleAxis(data, h, _newCoords(h, newH, pxCenter), method, axis=0)
+	else:
+		data = np.repeat(data, newH, axis=0)
+	return data.astype(dtype, copy=False)
+
+def _cubicWeights(t):
+	t2, t3 = t * t, t * t * t
+	return (
+		-0.5 * t3 + t2 - 0.5 * t,
+		1.5 * t3 - 2.5 * t2 + 1,
+		-1.5 * t3 + 2 * t2 + 0.5 * t,
+		0.5 * t3 - 0.5 * t2
+	)
+
+def sampleGrid(data, col, row, method='BILINEAR'):
+	'''
+	Interpolate a 2D array at arbitrary fractional pixels coordinates, where integer values
+	are pixels centers. Coordinates are clamped to the grid and borders are replicated.
+	method : NEAREST, BILINEAR or BICUBIC (Catmull-Rom)
+	'''
+	h, w = data.shape
+	col = np.clip(col, 0, w - 1)
+	row = np.clip(row, 0, h - 1)
+
+	if method == 'NEAREST':
+		return data[np.rint(row).astype(np.intp), np.rint(col).astype(np.intp)].astype(np.float64)
+
+	i = np.minimum(np.floor(col).astype(np.intp), max(w - 2, 0))
+	j = np.minimum(np.floor(row).astype(np.intp), max(h - 2, 0))
+	tx, ty = col - i, row - j
+
+	if method == 'BILINEAR':
+		i1, j1 = np.minimum(i + 1, w - 1), np.minimum(j + 1, h - 1)
+		z00, z10 = data[j, i], data[j, i1]
+		z01, z11 = data[j1, i], data[j1, i1]
+		return (z00 * (1 - tx) + z10 * tx) * (1 - ty) + (z01 * (1 - tx) + z11 * tx) * ty
+
+	elif method == 'BICUBIC':
+		#Catmull-Rom spline over the 4x4 neighbourhood
+		wx, wy = _cubicWeights(tx), _cubicWeights(ty)
+		z = np.zeros(np.shape(col))
+		for a in range(4):
+			jj = np.clip(j + a - 1, 0, h - 1)
+			zRow = np.zeros(np.shape(col))
+			for b in range(4):
+				ii = np.clip(i + b - 1, 0, w - 1)
+				zRow += wx[b] * data[jj, ii]
+			z += wy[a] * zRow
+		return z
+
+	else:
+		raise ValueError("Unknown interpolation method {}".format(method))
@@ -26,8 +26,15 @@ There are Python implementations of these alg. based on javascript code from sim
 But both are terribly slow because there is a lot of exponential-time looping. These algorithms makes this somewhat inevitable.
 In contrast, this script works in a reasonable time, but keep in mind it's not Jenks. We just use cluster's centroids (mean) as
 reference to distribute the values while Jenks try to minimize within-class variance, and maximizes between group variance.
+
+For large datasets (DEM values), use the numpy versions :
+* kmeans1dArray : same algorithm on a sorted numpy array, centroids are computed in O(1) from a prefix sums array
+and all the borders are moved at once with a binary search
+* jenksHisto : exact Jenks/Fisher optimization through dynamic programming over histogram bins
 """
 
+import numpy as np
+
 from ..utils.timing import perf_clock
 
 
@@ -149,6 +156,164 @@ def kmeans1d(data, k, cutoff=False, maxIter=False):
 	return clusters
 
 
+def kmeans1dArray(data, k, cutoff=False, maxIter=False):
+	'''
+	Numpy version of kmeans1d(), inputs and output are the same
+	* data = input numpy array, must be sorted beforehand
+	Centroids are computed from a prefix sums array and, at each iteration, each border is
+	directly moved to the midpoint of the neighbours centroids with a binary search.
+	Like kmeans1d(), values at equal distance of both centroids stay in their cluster and borders
+	are moved in order, each one bounded by the already moved previous border and the not yet moved
+	next one, so clusters are the same except when a prefix sum centroid is rounded differently
+	than the sum of the cluster values
+	'''
+	data = np.asarray(data, dtype=np.float64)
+
+	n = len(data)
+	if k >= n:
+		raise ValueError('Too many expected classes')
+	if k == 1:
+		return [ [0, n-1] ]
+
+	# prefix sums, the sum of data[i:j] is csum[j] - csum[i]
+	csum = np.concatenate(([0], np.cumsum(data)))
+
+	def getCentroids(borders):
+		starts = np.concatenate(([0], borders))
+		ends = np.concatenate((borders, [n]))
+		return (csum[ends] - csum[starts]) / (ends - starts)
+
+	def searchFirst(test):
+		# binary search of the first index of each border where test(value) is True,
+		# the distances are compared like in kmeans1d() so equal distances are handled the same way
+		lo, hi = np.zeros(k-1, dtype=int), np.full(k-1, n)
+		while np.any(lo < hi):
+			mid = (lo + hi) // 2
+			found = test(data[np.minimum(mid, n-1)]) & (lo < hi)
+			hi = np.where(found, mid, hi)
+			lo = np.where(found | (lo >= hi), lo, mid + 1)
+		return lo
+
+	# Step 1: Create k clusters with quantile classification
+	# a border is the first index of the next cluster
+	q = int(n // k)
+	if q == 1:
+		raise ValueError('Too many expected classes')
+	borders = np.arange(q, q*k, q)
+	centroids = getCentroids(borders)
+
+	# offsets used to keep borders strictly increasing (no empty cluster)
+	offsets = np.arange(k-1)
+
+	loopCounter = 0
+	while True:
+		loopCounter += 1
+
+		# Step 2 : values closer to the next centroid move to the next cluster and values closer
+		# to the current centroid to the current cluster, the ones at equal distance don't move
+		c1, c2 = centroids[:-1], centroids[1:]
+		lower = searchFirst(lambda v: ~(np.abs(v - c2) > np.abs(v - c1)))
+		upper = searchFirst(lambda v: np.abs(v - c1) > np.abs(v - c2))
+		# moving a border up can't empty the next cluster, taken before its own border moves
+		nextBorders = np.append(borders[1:], n)
+		newBorders = np.where(borders > upper, upper, np.minimum(np.maximum(borders, lower), nextBorders - 1))
+		# moving a border down can't empty the current cluster, taken after its first border moved
+		newBorders = np.maximum.accumulate(np.maximum(newBorders - offsets, 1)) + offsets
+
+		if np.array_equal(newBorders, borders):
+			break
+		borders = newBorders
+
+		# Update centroids and compute the bigger shift
+		newCentroids = getCentroids(borders)
+		biggest_shift = np.max(np.abs(newCentroids - centroids))
+		centroids = newCentroids
+
+		if (cutoff and biggest_shift < cutoff) or (maxIter and loopCounter == maxIter):
+			break
+
+	starts = [0] + borders.tolist()
+	ends = borders.tolist() + [n]
+	return [ [i, j-1] for i, j in zip(starts, ends) ]
+
+
+def jenksHisto(data, k, nbBins=512):
+	'''
+	Compute Jenks natural breaks with the exact Fisher dynamic programming algorithm.
+	To be fast on large datasets, values are first grouped in histogram bins and the optimization
+	is done over the bins (a bin can't be splitted between two classes)
+	Inputs:
+	* data = input numpy array, no need to be sorted
+	* k = number of expected classes
+	* nbBins = number of histogram bins, a greater value gives more precise breaks
+	Output:
+	* A list of k-1 breaks values (upper bound of each class except the last)
+	'''
+	data = np.asarray(data, dtype=np.float64).ravel()
+
+	counts, edges = np.histogram(data, bins=nbBins)
+	idx = np.clip(np.searchsorted(edges, data, side='right') - 1, 0, nbBins-1)
+	sums = np.bincount(idx, weights=data, minlength=nbBins)
+	sqSums = np.bincount(idx, weights=data*data, minlength=nbBins)
+
+	# drop empty bins
+	keep = counts > 0
+	counts, sums, sqSums = counts[keep], sums[keep], sqSums[keep]
+	upperEdges = edges[1:][keep]
+
+	b = len(counts)
+	if k > b:
+		raise ValueError('Too many expected classes')
+	if k == 1:
+		return []
+
+	# prefix sums with leading zero
+	W = np.concatenate(([0], np.cumsum(counts)))
+	S = np.concatenate(([0], np.cumsum(sums)))
+	SS = np.concatenate(([0], np.cumsum(sqSums)))
+
+	# cost[i, j] = sum of squared deviations of bins i to j (inclusive)
+	i, j = np.triu_indices(b)
+	cost = np.full((b, b), np.inf)
+	w = W[j+1] - W[i]
+	s = S[j+1] - S[i]
+	cost[i, j] = (SS[j+1] - SS[i]) - s * s / w
+
+	# D[j] = minimal cost of the first bins 0 to j splitted in m+1 classes
+	D = cost[0].copy()
+	starts = np.zeros((k, b), dtype=int) #first bin of the last class
+	for m in range(1, k):
+		# last class goes from bin i (1 <= i <= j) to bin j
+		M = D[:-1, np.newaxis] + cost[1:, :]
+		starts[m] = np.argmin(M, axis=0) + 1
+		D = M[starts[m] - 1, np.arange(b)]
+
+	# backtrack
+	breaks = []
+	j = b - 1
+	for m in range(k-1, 0, -1):
+		i = starts[m, j]
+		breaks.append(float(upperEdges[i-1]))
+		j = i - 1
+
+	return breaks[::-1]
+
+
+def getNaturalBreaks(data, k, method='KMEANS', nbBins=512):
+	'''
+	Return k-1 breaks values of a numpy array
+	method = 'KMEANS' (kmeans1dArray) or 'JENKS' (jenksHisto)
+	'''
+	if method == 'KMEANS':
+		data = np.sort(np.asarray(data, dtype=np.float64).ravel())
+		clusters = kmeans1dArray(data, k)
+		return getBreaks(data, clusters)
+	elif method == 'JENKS':
+		return jenksHisto(data, k, nbBins)
+	else:
+		raise ValueError('Unknown classification method')
+
+
 #-----------------
 #Helpers to get values from clusters's indices list returning by kmeans1d function
 
@@ -186,3 +351,20 @@ if __name__ == '__main__':
 	print('Clusters details (nb values, min, max) :')
 	for clusterValues in getClustersValues(data, clusters):
 		print( len(clusterValues), clusterValues[0], clusterValues[-1] )
+
+	print('---------------')
+	data = np.array(data)
+	t1 = perf_clock()
+	clusters = kmeans1dArray(data, k)
+	t2 = perf_clock()
+	print('Numpy version completed in %f seconds' %(t2-t1))
+	print('Breaks :')
+	print(getBreaks(data, clusters))
+
+	print('---------------')
+	t1 = perf_clock()
+	breaks = jenksHisto(data, k)
+	t2 = perf_clock()
+	print('Jenks (histogram) completed in %f seconds' %(t2-t1))
+	print('Breaks :')
+	print(breaks)
@@ -19,8 +19,12 @@
 
 
 import math
+import functools
+import threading
 
-from .srs import SRS
+import numpy as np
+
+from .srs import SRS, getSRS
 from .utm import UTM, UTM_EPSG_CODES
 from .ellps import GRS80
 from .srv import EPSGIO
@@ -54,6 +58,22 @@ def lonLatToWebMerc(lon, lat):
 	y = lat * k
 	return x, y
 
+def webMercToLonLatArray(xs, ys):
+	'''Vectorized version of webMercToLonLat(), return (lons, lats) numpy arrays'''
+	k = GRS80.perimeter/360
+	lon = np.asarray(xs, dtype=np.float64) / k
+	lat = np.asarray(ys, dtype=np.float64) / k
+	lat = 180 / math.pi * (2 * np.arctan( np.exp( lat * math.pi / 180.0)) - math.pi / 2.0)
+	return lon, lat
+
+def lonLatToWebMercArray(lons, lats):
+	'''Vectorized version of lonLatToWebMerc(), return (xs, ys) numpy arrays'''
+	k = GRS80.perimeter/360
+	x = np.asarray(lons, dtype=np.float64) * k
+	lat = np.log( np.tan((90 + np.asarray(lats, dtype=np.float64)) * math.pi / 360.0 )) / (math.pi / 180.0)
+	y = lat * k
+	return x, y
+
 
 ######################################
 # Raster reproj using GDAL
@@ -96,7 +116,7 @@ def reprojImg(crs1, crs2, ds1, out_ul=None, out_size=None, out_res=None, sqPx=Fa
 		#TODO reuse the GeoRef class to extract bbox even if there are rotation parameters
 
 	#Assign input CRS to input datasource
-	prj1 = SRS(crs1).getOgrSpatialRef()
+	prj1 = getSRS(crs1).getOgrSpatialRef()
 	wkt1 = prj1.ExportToWkt()
 	ds1.SetProjection(wkt1)
 
@@ -154,7 +174,7 @@ def reprojImg(crs1, crs2, ds1, out_ul=None, out_size=None, out_res=None, sqPx=Fa
 			ds2.GetRasterBand(1).GetMaskBand().Fill(255) #WARNING, it seems gdal.ReprojectImage does not honor internal mask !
 	geoTrans = (xmin, resx, 0, ymax, 0, resy)
 	ds2.SetGeoTransform(geoTrans)
-	prj2 = SRS(crs2).getOgrSpatialRef()
+	prj2 = getSRS(crs2).getOgrSpatialRef()
 	wkt2 = prj2.ExportToWkt()
 	ds2.SetProjection(wkt2)
 
@@ -190,10 +210,14 @@ class Reproj():
 
 		#init CRS class
 		try:
-			crs1, crs2 = SRS(crs1), SRS(crs2)
+			crs1, crs2 = getSRS(crs1), getSRS(crs2)
 		except Exception as e:
 			raise ReprojError(str(e))
 
+		#GDAL and pyproj transformation objects are not thread safe
+		#and a Reproj instance can be shared through getReproj()
+		self.lock = threading.Lock()
+
 		if crs1 == crs2:
 			self.iproj = 'NO_REPROJ'
 			return
@@ -211,7 +235,7 @@ class Reproj():
 				 self.iproj = 'PYPROJ'
 			elif ((crs1.isWM or crs1.isUTM) and crs2.isWGS84) or (crs1.isWGS84 and (crs2.isWM or crs2.isUTM)):
 				self.iproj = 'BUILTIN'
-			elif EPSGIO.ping():
+			elif pingEPSGIO():
 				#this is the slower solution, not suitable for reproject lot of points
 				self.iproj = 'EPSGIO'
 			else:
@@ -223,7 +247,7 @@ class Reproj():
 				if not ( ((crs1.isWM or crs1.isUTM) and crs2.isWGS84) or (crs1.isWGS84 and (crs2.isWM or crs2.isUTM)) ):
 					raise ReprojError('Too limited built in reprojection capabilities')
 			if self.iproj == 'EPSGIO':
-				if not  EPSGIO.ping():
+				if not pingEPSGIO():
 					raise ReprojError('Cannot access epsg.io service')
 
 
@@ -235,6 +259,8 @@ class Reproj():
 		elif self.iproj == 'PYPROJ':
 			self.crs1 = crs1.getPyProj()
 			self.crs2 = crs2.getPyProj()
+			#build the transformer once, it's slow to init
+			self.transformer = pyproj.Transformer.from_proj(self.crs1, self.crs2)
 
 		elif self.iproj == 'EPSGIO':
 			if crs1.isEPSG and crs2.isEPSG:
@@ -273,10 +299,12 @@ class Reproj():
 				projVersion = 4
 			if projVersion >= 6 and self.crs1.IsGeographic():
 				pts = [ (pt[1], pt[0]) for pt in pts]
+			with self.lock:
+				_pts = self.osrTransfo.TransformPoints(pts)
 			if self.crs2.IsGeographic():
-				ys, xs, _zs = zip(*self.osrTransfo.TransformPoints(pts))
+				ys, xs, _zs = zip(*_pts)
 			else:
-				xs, ys, _zs = zip(*self.osrTransfo.TransformPoints(pts))
+				xs, ys, _zs = zip(*_pts)
 			return list(zip(xs, ys))
 
 		elif self.iproj == 'PYPROJ':
@@ -284,27 +312,62 @@ class Reproj():
 				ys, xs = zip(*pts)
 			else:
 				xs, ys = zip(*pts)
-			transformer = pyproj.Transformer.from_proj(self.crs1, self.crs2)
+			with self.lock:
+				xs, ys = self.transformer.transform(xs, ys)
 			if self.crs2.crs.is_geographic:
-				ys, xs = transformer.transform(xs, ys)
-			else:
-				xs, ys = transformer.transform(xs, ys)
+				xs, ys = ys, xs
 			return list(zip(xs, ys))
 
 		elif self.iproj == 'EPSGIO':
 			return EPSGIO.reprojPts(self.crs1, self.crs2, pts)
 
+		elif self.iproj == 'BUILTIN':
+			return list(map(tuple, self.pts_array(pts).tolist()))
+
+	def pts_array(self, pts):
+		'''
+		Reproject a numpy array of points
+		pts >> array like of shape (n, 2) or more columns (z values are keeped unchanged)
+		return a new (n, 2+) float64 numpy array
+		Built in and pyproj engines are fully vectorized, others engines fallback to pts()
+		'''
+		pts = np.array(pts, dtype=np.float64, ndmin=2)
+		if pts.size == 0:
+			return pts.reshape(0, 2)
+
+		if pts.shape[1] < 2:
+			raise ReprojError('Points must be [ (x,y) ]')
+
+		xs, ys = pts[:,0], pts[:,1]
+
+		if self.iproj == 'NO_REPROJ':
+			return pts
+
+		if self.iproj == 'PYPROJ':
+			if self.crs1.crs.is_geographic:
+				xs, ys = ys, xs
+			with self.lock:
+				xs, ys = self.transformer.transform(xs, ys)
+			if self.crs2.crs.is_geographic:
+				xs, ys = ys, xs
+
 		elif self.iproj == 'BUILTIN':
 			#Web Mercator
 			if self.crs1 == 4326 and self.crs2 == 3857:
-				return [lonLatToWebMerc(*pt) for pt in pts]
+				xs, ys = lonLatToWebMercArray(xs, ys)
 			elif self.crs1 == 3857 and self.crs2 == 4326:
-				return [webMercToLonLat(*pt) for pt in pts]
+				xs, ys = webMercToLonLatArray(xs, ys)
 			#UTM
-			if self.crs1 == 4326 and self.crs2 in UTM_EPSG_CODES:
-				return [self.utm.lonlat_to_utm(*pt) for pt in pts]
+			elif self.crs1 == 4326 and self.crs2 in UTM_EPSG_CODES:
+				xs, ys = self.utm.lonlat_to_utm_array(xs, ys)
 			elif self.crs1 in UTM_EPSG_CODES and self.crs2 == 4326:
-				return [self.utm.utm_to_lonlat(*pt) for pt in pts]
+				xs, ys = self.utm.utm_to_lonlat_array(xs, ys)
+
+		else:
+			xs, ys = np.array(self.pts(pts[:,0:2].tolist()), dtype=np.float64).T
+
+		pts[:,0], pts[:,1] = xs, ys
+		return pts
 
 	def pt(self, x, y):
 		if x is None or y is None:
@@ -328,13 +391,35 @@ class Reproj():
 
 
 
+@functools.lru_cache(maxsize=None)
+def pingEPSGIO():
+	'''Probe epsg.io web service only once per process'''
+	return EPSGIO.ping()
+
+
+@functools.lru_cache(maxsize=64)
+def _getReproj(crs1, crs2, engine):
+	return Reproj(crs1, crs2)
+
+def getReproj(crs1, crs2):
+	"""
+	Return a Reproj instance from crs1 to crs2
+	Instances are keeped in a process wide LRU cache keyed by the normalized crs pair
+	and the current proj engine so it's safe to call this function in a loop
+	"""
+	try:
+		crs1, crs2 = getSRS(crs1), getSRS(crs2)
+	except Exception as e:
+		raise ReprojError(str(e))
+	return _getReproj(str(crs1), str(crs2), settings.proj_engine)
+
+
 def reprojPt(crs1, crs2, x, y):
 	"""
 	Reproject x1,y1 coords from crs1 to crs2
 	crs can be an EPSG code (interger or string) or a proj4 string
-	WARN : do not use this function in a loop because Reproj() init is slow
 	"""
-	rprj = Reproj(crs1, crs2)
+	rprj = getReproj(crs1, crs2)
 	return rprj.pt(x, y)
 
 
@@ -343,11 +428,10 @@ def reprojPts(crs1, crs2, pts):
 	Reproject [pts] from crs1 to crs2
 	crs can be an EPSG code (integer or srid string) or a proj4 string
 	pts must be [(x,y)]
-	WARN : do not use this function in a loop because Reproj() init is slow
 	"""
-	rprj = Reproj(crs1, crs2)
+	rprj = getReproj(crs1, crs2)
 	return rprj.pts(pts)
 
 def reprojBbox(crs1, crs2, bbox):
-	rprj = Reproj(crs1, crs2)
+	rprj = getReproj(crs1, crs2)
 	return rprj.bbox(bbox)
@@ -19,6 +19,8 @@
 import logging
 log = logging.getLogger(__name__)
 
+import functools
+
 from .utm import UTM, UTM_EPSG_CODES
 from .srv import EPSGIO
 
@@ -212,3 +214,18 @@ class SRS():
 			return EPSGIO.getEsriWkt(self.code)
 		else:
 			raise NotImplementedError
+
+
+@functools.lru_cache(maxsize=256)
+def _getSRS(crs):
+	return SRS(crs)
+
+def getSRS(crs):
+	'''
+	Return a SRS object for the given crs input (epsg code, SRID or proj4 string)
+	Parsed SRS objects are keeped in a process wide LRU cache keyed by the crs string
+	Warning : returned objects are shared, do not modify them
+	'''
+	if isinstance(crs, SRS):
+		return crs
+	return _getSRS(str(crs))
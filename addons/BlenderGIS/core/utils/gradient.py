@@ -5,8 +5,40 @@ import os
 import colorsys
 from xml.dom.minidom import parse, parseString
 from xml.etree import ElementTree as etree
-from ..maths.interpo import scale, linearInterpo
-from ..maths import akima
+import numpy as np
+from ..maths.interpo import scale
+from ..maths.interpolation import akima1D
+
+
+#Vectorized equivalents of colorsys functions, work on (..., 3) arrays of values ranging from 0 to 1
+
+def rgb_to_hsv_array(rgb):
+	rgb = np.asarray(rgb, dtype=np.float64)
+	r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+	maxc = rgb.max(axis=-1)
+	minc = rgb.min(axis=-1)
+	delta = maxc - minc
+	grey = delta == 0
+	with np.errstate(invalid='ignore', divide='ignore'):
+		s = np.where(maxc > 0, delta / maxc, 0)
+		rc, gc, bc = [(maxc - c) / delta for c in (r, g, b)]
+	h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+	h = np.where(grey, 0, (h / 6.0) % 1.0)
+	return np.stack((h, np.where(grey, 0, s), maxc), axis=-1)
+
+def hsv_to_rgb_array(hsv):
+	hsv = np.asarray(hsv, dtype=np.float64)
+	h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+	i = np.floor(h * 6.0)
+	f = h * 6.0 - i
+	p = v * (1.0 - s)
+	q = v * (1.0 - s * f)
+	t = v * (1.0 - s * (1.0 - f))
+	i = i.astype(np.intp) % 6
+	r = np.choose(i, (v, q, p, p, t, v))
+	g = np.choose(i, (t, v, v, q, p, p))
+	b = np.choose(i, (p, p, t, v, v, q))
+	return np.stack((r, g, b), axis=-1)
 
 
 class Color(object):
@@ -350,17 +382,7 @@ class Gradient():
 			stop.position = scale(stop.position, fromMin, fromMax, toMin, toMax)
 
 	def evaluate(self, pos, colorSpace = 'RGB', method='LINEAR'):
-		#check interpo method
-		if method not in ['DISCRETE', 'NEAREST', 'LINEAR', 'SPLINE']:
-			method = 'LINEAR'
-		#check color space
-		if colorSpace in ['RGB', 'RGBA', 'rgb', 'rgba']:
-			colorSpace = 'rgba' #we will work with normalized values
-		elif colorSpace in ['HSV', 'HSVA', 'hsv', 'hsva']:
-			colorSpace = 'hsva'
-		else:
-			colorSpace = 'rgba' #default
-		#check position
+		'''Return the Color at a given position, see evaluate_array'''
 		self.sortStops()
 		positions = self.positions
 		#if pos already exist return it's color
@@ -372,71 +394,86 @@ class Gradient():
 			return self.stops[0].color
 		elif pos > positions[-1]:
 			return self.stops[-1].color
-		#find previous and next stops
-		for i, p in enumerate(positions):
-			if p<pos<positions[i+1]:
-				prevStop = self.stops[i]
-				nextStop = self.stops[i+1]
-				break
-
-		if method == 'DISCRETE':
-			return prevStop.color
-
-		elif method == 'NEAREST':
-			if (pos - prevStop.position) < (nextStop.position - pos):
-				return prevStop.color
+		rgba = self.evaluate_array(np.array([pos]), colorSpace, method)[0]
+		return Color(rgba.tolist(), 'rgba')
+
+	def evaluate_array(self, positions, colorSpace='RGB', method='LINEAR'):
+		'''
+		Evaluate the gradient at many positions at once, for example all the values of a raster
+		positions : array of any shape
+		colorSpace : RGB or HSV, the space in which colors are interpolated
+		method : DISCRETE, NEAREST, LINEAR or SPLINE
+		return an array of the positions shape + (4,) of rgba values ranging from 0 to 1.
+		Positions outside the gradient get the color of the first or last stop, nan positions get a transparent black
+		'''
+		#check interpo method
+		if method not in ['DISCRETE', 'NEAREST', 'LINEAR', 'SPLINE']:
+			method = 'LINEAR'
+		#check color space
+		if colorSpace in ['HSV', 'HSVA', 'hsv', 'hsva']:
+			colorSpace = 'hsva'
+		else:
+			colorSpace = 'rgba' #default, we will work with normalized values
+		self.sortStops()
+		xData = np.array(self.positions, dtype=np.float64)
+		rgba = np.array([color.rgba for color in self.colors], dtype=np.float64)
+		n = len(xData)
+
+		pos = np.asarray(positions, dtype=np.float64)
+		shape = pos.shape
+		pos = pos.ravel()
+		nan = np.isnan(pos)
+		pos = np.clip(np.where(nan, xData[0], pos), xData[0], xData[-1])
+
+		if n == 1:
+			out = np.repeat(rgba, len(pos), axis=0)
+		else:
+			#previous stop index and normalized position in the interval
+			idx = np.clip(np.searchsorted(xData, pos, side='right') - 1, 0, n - 2)
+			dx = xData[idx + 1] - xData[idx]
+			with np.errstate(invalid='ignore', divide='ignore'):
+				t = np.where(dx > 0, (pos - xData[idx]) / dx, 0)
+			#stops positions get their own color, the first one if a position is duplicate
+			first = np.minimum(np.searchsorted(xData, pos, side='left'), n - 1)
+			hit = xData[first] == pos
+
+			if method == 'DISCRETE':
+				out = rgba[idx]
+			elif method == 'NEAREST':
+				out = rgba[np.where(t < 0.5, idx, idx + 1)]
 			else:
-				return nextStop.color
-
-		elif method == 'LINEAR':
-			x1, x2 = prevStop.position, nextStop.position
-			interpolateValues = []
-			for i in range(4): #4 channels (rgba or hsva)
-				y1, y2 = prevStop.color.getColor(colorSpace)[i], nextStop.color.getColor(colorSpace)[i]
-				dy = y2-y1
-				if colorSpace == 'hsva' and i == 0 and abs(dy) > 0.5: # hue values with delta > 180°
-					# Hue is cyclic
-					# > interpolation must be done through the shortest path (clockwise or counterclockwise)
-					# > to interpolate CCW, add 180° to all hue values, then compute modulo 360° on interpolate result
-					y1, y2 = [hue+0.5 if hue<0 else hue-0.5 for hue in (y1, y2)]
-					y = linearInterpo(x1, x2, y1, y2, pos) % 1
-				else:
-					y = linearInterpo(x1, x2, y1, y2, pos)
-				interpolateValues.append(round(y,2))
-			return Color(interpolateValues, colorSpace)
-
-		elif method == 'SPLINE':
-			xData = self.positions
-			if len(xData) < 3: #spline interpo needs at least 3 pts, otherwise compute a linear interpolation
-				return self.evaluate(pos, colorSpace, method='LINEAR')
-			interpolateValues = []
-			for i in range(4): #4 channels (rgba or hsva)
-				yData = [color.getColor(colorSpace)[i] for color in self.colors]
-				dy = (nextStop.color.getColor(colorSpace)[i] - prevStop.color.getColor(colorSpace)[i])
-				if colorSpace == 'hsva' and i == 0 and abs(dy) > 0.5: # hue values with delta > 180°
+				if colorSpace == 'hsva':
+					yData = np.column_stack((rgb_to_hsv_array(rgba[:, 0:3]), rgba[:, 3]))
 					# Hue is cyclic
 					# > interpolation must be done through the shortest path (clockwise or counterclockwise)
-					# > to interpolate CCW, add 180° to all hue values, then compute modulo 360° on interpolate result
-					yData = [hue+0.5 if hue<0 else hue-0.5 for hue in yData]
-					y = akima.interpolate(xData, yData, [pos])[0] % 1
+					# > unwrap hue values so that deltas between following stops never exceed 180°, then compute modulo 360°
+					dh = np.diff(yData[:, 0])
+					yData[1:, 0] = yData[0, 0] + np.cumsum(dh - np.round(dh))
 				else:
-					y = akima.interpolate(xData, yData, [pos])[0]
+					yData = rgba
+				if method == 'SPLINE' and n >= 3 and np.all(dx > 0):
+					y = akima1D(xData, yData.T, pos).T
+				else: #spline interpo needs at least 3 pts, otherwise compute a linear interpolation
+					y = yData[idx] + t[:, None] * (yData[idx + 1] - yData[idx])
+				if colorSpace == 'hsva':
+					y[:, 0] %= 1
 				#Constrain result between 0-1
-				y = 1 if y>1 else 0 if y<0 else y
-				#append
-				interpolateValues.append(round(y,2))
-			return Color(interpolateValues, colorSpace)
+				y = np.clip(y, 0, 1)
+				if colorSpace == 'hsva':
+					y = np.column_stack((hsv_to_rgb_array(y[:, 0:3]), y[:, 3]))
+				out = y
+			out[hit] = rgba[first[hit]]
 
+		out[nan] = 0
+		return out.reshape(shape + (4,))
 
 	def getRangeColor(self, n, interpoSpace='RGB', interpoMethod='LINEAR'):
 		'''return a new gradient'''
 		ramp = Gradient(permissive=True)#permissive needed because discrete interpo can return same color for 2 or more following stops
-		offset = 1/(n-1)
-		position = 0
-		for i in range(n):
-			color = self.evaluate(position, interpoSpace, interpoMethod)
-			ramp.addStop(position, color, reorder=False)
-			position += offset
+		positions = np.linspace(0, 1, n)
+		colors = self.evaluate_array(positions, interpoSpace, interpoMethod)
+		for position, rgba in zip(positions.tolist(), colors.tolist()):
+			ramp.addStop(position, Color(rgba, 'rgba'), reorder=False)
 		return ramp
 
 
@@ -0,0 +1,2 @@
+from .shpreader import ShpArrayReader, ShpGeometries
+from .spatialindex import PackedRTree, getShpIndex, getCachedIndex
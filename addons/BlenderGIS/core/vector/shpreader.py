@@ -0,0 +1,404 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of BlenderGIS
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+import os
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+
+
+SHAPETYPES = {
+	0: 'Null',
+	1: 'Point',
+	3: 'PolyLine',
+	5: 'Polygon',
+	8: 'MultiPoint',
+	11: 'PointZ',
+	13: 'PolyLineZ',
+	15: 'PolygonZ',
+	18: 'MultiPointZ',
+	21: 'PointM',
+	23: 'PolyLineM',
+	25: 'PolygonM',
+	28: 'MultiPointM',
+	31: 'MultiPatch'
+}
+
+POINT_TYPES = (1, 11, 21)
+MULTIPOINT_TYPES = (8, 18, 28)
+PARTS_TYPES = (3, 5, 13, 15, 23, 25, 31)
+Z_TYPES = (11, 13, 15, 18, 31)
+
+
+def _findFile(base, ext):
+	for e in (ext, ext.upper()):
+		path = base + '.' + e
+		if os.path.exists(path):
+			return path
+	return None
+
+def _memmap(path):
+	if path is None or os.path.getsize(path) == 0:
+		return None
+	return np.memmap(path, dtype=np.uint8, mode='r')
+
+def _unalignedView(buf, dtype):
+	'''
+	View of a bytes buffer where the element i is the value that starts at byte i,
+	used to gather numbers stored at any byte offset with a single fancy indexing
+	'''
+	dtype = np.dtype(dtype)
+	return np.ndarray(shape=(len(buf) - dtype.itemsize + 1,), dtype=dtype, buffer=buf, strides=(1,))
+
+def _ranges(starts, counts, step=1):
+	'''concatenated ranges [start, start + count * step[ with the given step'''
+	counts = np.asarray(counts, dtype=np.int64)
+	total = int(counts.sum())
+	if total == 0:
+		return np.zeros(0, dtype=np.int64)
+	first = np.cumsum(counts) - counts
+	local = np.arange(total, dtype=np.int64) - np.repeat(first, counts)
+	return np.repeat(np.asarray(starts, dtype=np.int64), counts) + local * step
+
+
+class ShpGeometries():
+	'''
+	Geometries of a set of shapefile records decoded into contiguous arrays
+	coords : (n,2) array of x,y coordinates of all points
+	z : (n,) array of z values or None
+	parts : index in coords of the first point of each part
+	featParts : index in parts of the first part of each feature, with an extra end value
+	recIdx : record number of each feature
+	'''
+
+	def __init__(self, coords, z, parts, featParts, recIdx):
+		self.coords = coords
+		self.z = z
+		self.parts = parts
+		self.featParts = featParts
+		self.recIdx = recIdx
+
+	def __len__(self):
+		return len(self.recIdx)
+
+	@property
+	def nbPoints(self):
+		return len(self.coords)
+
+	@property
+	def partsEnd(self):
+		return np.append(self.parts[1:], len(self.coords)).astype(np.int64)
+
+	def featRange(self, i):
+		'''return (first point index, last point index + 1, parts first point indices) of a feature'''
+		p1, p2 = self.featParts[i], self.featParts[i+1]
+		if p1 == p2:
+			return 0, 0, []
+		start = self.parts[p1]
+		end = self.parts[p2] if p2 < len(self.parts) else len(self.coords)
+		return start, end, self.parts[p1:p2] - start
+
+
+class ShpArrayReader():
+	'''
+	Memory mapped shapefile reader, geometries and attributes are decoded in bulk into numpy arrays
+
+	>>> shp = ShpArrayReader('roads.shp')
+	>>> idx = shp.filterBbox(bbox)
+	>>> geoms = shp.readGeoms(idx)
+	>>> columns = shp.readFields(['name', 'width'], idx)
+	'''
+
+	def __init__(self, path, encoding='utf-8', encodingErrors='replace'):
+		base = os.path.splitext(path)[0]
+		self.shapeName = os.path.basename(base)
+		self.encoding = encoding
+		self.encodingErrors = encodingErrors
+
+		self.shpPath = _findFile(base, 'shp')
+		self.shxPath = _findFile(base, 'shx')
+		self.dbfPath = _findFile(base, 'dbf')
+		if self.shpPath is None and self.dbfPath is None:
+			raise IOError("Unable to open {0}.shp or {0}.dbf".format(base))
+
+		self.shp = _memmap(self.shpPath)
+		self.shx = _memmap(self.shxPath)
+		self.dbf = _memmap(self.dbfPath)
+
+		self._offsets = None
+		self.fields = []
+		self.numRecords = None
+		if self.shp is not None:
+			self._shpHeader()
+		if self.dbf is not None:
+			self._dbfHeader()
+		if self.numRecords is None:
+			self.numRecords = len(self.offsets)
+
+	def __len__(self):
+		return self.numRecords
+
+	def __repr__(self):
+		return 'ShpArrayReader {} : {} records of type {}, {} fields'.format(self.shapeName, self.numRecords, self.shapeTypeName, len(self.fields))
+
+	def close(self):
+		#memmap are closed when all references are released
+		self.shp = self.shx = self.dbf = None
+		self._offsets = None
+
+	############################################
+	# Geometries
+	############################################
+
+	def _shpHeader(self):
+		header = self.shp[:100]
+		self.shapeType = int(header[32:36].view('<i4')[0])
+		self.bbox = tuple(header[36:68].view('<f8').tolist())
+		self.zbox = tuple(header[68:84].view('<f8').tolist())
+		self._f8 = _unalignedView(self.shp, '<f8')
+		self._i4 = _unalignedView(self.shp, '<i4')
+
+	@property
+	def shapeTypeName(self):
+		return SHAPETYPES.get(self.shapeType, 'Null')
+
+	@property
+	def hasZ(self):
+		return self.shapeType in Z_TYPES
+
+	@property
+	def offsets(self):
+		'''byte offsets of the records in the shp file (start of the record header)'''
+		if self._offsets is None:
+			if self.shx is not None:
+				#shx records are pairs of big endian int32 (offset, content length) in 16 bits words
+				self._offsets = self.shx[100:].view('>i4')[::2].astype(np.int64) * 2
+			elif self.shp is not None:
+				#no index, walk through records headers
+				offsets = []
+				pos, size = 100, len(self.shp)
+				while pos + 8 <= size:
+					offsets.append(pos)
+					pos += 8 + 2 * int(self.shp[pos+4:pos+8].view('>i4')[0])
+				self._offsets = np.array(offsets, dtype=np.int64)
+			else:
+				self._offsets = np.zeros(0, dtype=np.int64)
+		return self._offsets
+
+	def _getIdx(self, idx):
+		if idx is None:
+			return np.arange(len(self.offsets))
+		return np.asarray(idx, dtype=np.int64)
+
+	def recordsBounds(self, idx=None):
+		'''
+		(n,4) array of records bounds (xmin, ymin, xmax, ymax) read from the records headers
+		null shapes get nan bounds
+		'''
+		idx = self._getIdx(idx)
+		off = self.offsets[idx] + 8 #skip record header
+		types = self._i4[off]
+		bounds = np.full((len(idx), 4), np.nan)
+		isPt = np.isin(types, POINT_TYPES)
+		if isPt.any():
+			o = off[isPt] + 4
+			x, y = self._f8[o], self._f8[o+8]
+			bounds[isPt] = np.column_stack((x, y, x, y))
+		hasBox = (types != 0) & ~isPt
+		if hasBox.any():
+			o = off[hasBox] + 4
+			bounds[hasBox] = np.column_stack([self._f8[o + 8*k] for k in range(4)])
+		return bounds
+
+	def filterBbox(self, bbox, idx=None):
+		'''Return the records numbers whose bounds intersect the given BBOX, shapes are not decoded'''
+		idx = self._getIdx(idx)
+		b = self.recordsBounds(idx)
+		with np.errstate(invalid='ignore'):
+			mask = (b[:,0] <= bbox.xmax) & (b[:,2] >= bbox.xmin) & (b[:,1] <= bbox.ymax) & (b[:,3] >= bbox.ymin)
+		return idx[mask]
+
+	def readGeoms(self, idx=None):
+		'''Decode the geometries of the given records (all by default) into a ShpGeometries object'''
+		idx = self._getIdx(idx)
+		off = self.offsets[idx] + 8
+		types = self._i4[off]
+		n = len(idx)
+		nbParts = np.zeros(n, dtype=np.int64)
+		nbPoints = np.zeros(n, dtype=np.int64)
+		ptsOff = np.zeros(n, dtype=np.int64)
+		zOff = np.zeros(n, dtype=np.int64)
+
+		isPt = np.isin(types, POINT_TYPES)
+		nbParts[isPt] = 1
+		nbPoints[isPt] = 1
+		ptsOff[isPt] = off[isPt] + 4
+		zOff[isPt] = off[isPt] + 20
+
+		isMPt = np.isin(types, MULTIPOINT_TYPES)
+		nbPoints[isMPt] = self._i4[off[isMPt] + 36]
+		nbParts[isMPt] = np.minimum(nbPoints[isMPt], 1)
+		ptsOff[isMPt] = off[isMPt] + 40
+
+		isParts = np.isin(types, PARTS_TYPES)
+		o = off[isParts]
+		nbParts[isParts] = self._i4[o + 36]
+		nbPoints[isParts] = self._i4[o + 40]
+		ptsOff[isParts] = o + 44 + 4 * nbParts[isParts] * np.where(types[isParts] == 31, 2, 1) #multipatch has part types
+
+		hasZ = np.isin(types, Z_TYPES)
+		zOff[hasZ & ~isPt] = (ptsOff + 16 * nbPoints + 16)[hasZ & ~isPt] #skip z range
+
+		#parts first point index
+		parts = np.zeros(int(nbParts.sum()), dtype=np.int64)
+		featParts = np.concatenate(([0], np.cumsum(nbParts))).astype(np.int64)
+		featPoints = np.concatenate(([0], np.cumsum(nbPoints))).astype(np.int64)
+		if isParts.any():
+			sel = np.repeat(isParts, nbParts)
+			parts[sel] = self._i4[_ranges(off[isParts] + 44, nbParts[isParts], 4)]
+		#make parts indices absolute
+		parts += np.repeat(featPoints[:-1], nbParts)
+
+		#points
+		xy = self._f8[_ranges(ptsOff, nbPoints * 2, 8)].reshape(-1, 2)
+		if self.hasZ:
+			z = np.zeros(len(xy))
+			zMask = np.repeat(hasZ, nbPoints)
+			z[zMask] = self._f8[_ranges(zOff[hasZ], nbPoints[hasZ], 8)]
+		else:
+			z = None
+
+		return ShpGeometries(xy, z, parts, featParts, idx)
+
+	############################################
+	# Attributes
+	############################################
+
+	def _dbfHeader(self):
+		header = self.dbf[:32]
+		self.numRecords = int(header[4:8].view('<u4')[0])
+		self._dbfHdrLength = int(header[8:10].view('<u2')[0])
+		self._recordLength = int(header[10:12].view('<u2')[0])
+		self.fields = []
+		self._fieldsPos = {}
+		pos = 1 #deletion flag
+		for i in range((self._dbfHdrLength - 33) // 32):
+			desc = bytes(self.dbf[32 + 32*i: 64 + 32*i])
+			if desc[0] == 0x0D:
+				break
+			name = desc[:11].split(b'\x00')[0].decode(self.encoding, self.encodingErrors).lstrip()
+			typ = chr(desc[11])
+			size, deci = desc[16], desc[17]
+			self.fields.append([name, typ, size, deci])
+			self._fieldsPos[name] = pos
+			pos += size
+		nbRecords = (len(self.dbf) - self._dbfHdrLength) // self._recordLength
+		self._records = np.ndarray(shape=(min(self.numRecords, nbRecords), self._recordLength), dtype=np.uint8,
+			buffer=self.dbf, offset=self._dbfHdrLength)
+
+	@property
+	def fieldsNames(self):
+		return [f[0] for f in self.fields]
+
+	@property
+	def deleted(self):
+		'''boolean array flagging the deleted dbf records'''
+		return self._records[:, 0] == ord('*')
+
+	def _rawColumn(self, name, idx):
+		pos = self._fieldsPos[name]
+		size = self.fields[self.fieldsNames.index(name)][2]
+		raw = np.ascontiguousarray(self._records[idx, pos:pos+size])
+		return raw.view('S{}'.format(size)).ravel()
+
+	def readField(self, name, idx=None):
+		'''
+		Decode a dbf column into a typed numpy array, missing values are masked
+		N, F >> int64 or float64, L >> bool, D >> datetime64, others >> str
+		'''
+		if self.dbf is None:
+			raise IOError("No dbf file found")
+		if name not in self._fieldsPos:
+			raise KeyError("Unknown field {}".format(name))
+		_, typ, size, deci = self.fields[self.fieldsNames.index(name)]
+		idx = self._getIdx(idx) if idx is not None else slice(None)
+		raw = np.char.strip(np.char.strip(self._rawColumn(name, idx)), b'\x00')
+
+		if typ in ('N', 'F'):
+			missing = (raw == b'') | (np.char.replace(raw, b'*', b'') == b'')
+			values = np.where(missing, b'0', raw)
+			try:
+				if deci:
+					raise ValueError
+				values = values.astype(np.int64)
+			except (ValueError, OverflowError):
+				try:
+					values = values.astype(np.float64)
+				except ValueError:
+					#some values are not parseable, decode them one by one
+					values = np.array([self._toFloat(v) for v in values.tolist()])
+				missing |= np.isnan(values)
+			return np.ma.masked_array(values, missing)
+
+		elif typ == 'L':
+			upper = np.char.upper(raw)
+			values = np.isin(upper, [b'Y', b'T', b'1'])
+			missing = ~(values | np.isin(upper, [b'N', b'F', b'0']))
+			return np.ma.masked_array(values, missing)
+
+		elif typ == 'D':
+			missing = (np.char.replace(raw, b'0', b'') == b'') | (np.char.str_len(raw) != 8)
+			raw = np.where(missing, b'19700101', raw)
+			chars = np.frombuffer(raw.astype('S8').tobytes(), dtype='S1').reshape(-1, 8)
+			y, m, d = [np.ascontiguousarray(chars[:, a:b]).view('S{}'.format(b - a)).ravel() for a, b in ((0, 4), (4, 6), (6, 8))]
+			iso = np.char.add(np.char.add(np.char.add(np.char.add(y, b'-'), m), b'-'), d)
+			try:
+				values = iso.astype('datetime64[D]')
+			except ValueError:
+				values = np.array([self._toDate(v) for v in iso.tolist()], dtype='datetime64[D]')
+				missing |= np.isnat(values)
+			return np.ma.masked_array(values, missing)
+
+		else:
+			values = np.char.decode(raw, self.encoding, self.encodingErrors)
+			return np.ma.masked_array(values, np.zeros(len(values), dtype=bool))
+
+	@staticmethod
+	def _toFloat(v):
+		try:
+			return float(v)
+		except ValueError:
+			return np.nan
+
+	@staticmethod
+	def _toDate(v):
+		try:
+			return np.datetime64(v.decode('ascii'), 'D')
+		except ValueError:
+			return np.datetime64('NaT')
+
+	def readFields(self, names=None, idx=None):
+		'''Decode several dbf columns, return a dict name >> masked array'''
+		if names is None:
+			names = self.fieldsNames
+		return {name: self.readField(name, idx) for name in names}
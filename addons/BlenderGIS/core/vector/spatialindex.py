@@ -0,0 +1,257 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of BlenderGIS
+
+#  ***** GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#  All rights reserved.
+#  ***** GPL LICENSE BLOCK *****
+
+import os
+import math
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+from .shpreader import ShpArrayReader
+
+
+INDEX_EXT = '.rtree.npz'
+INDEX_VERSION = 1
+
+
+class PackedRTree():
+	'''
+	Static R-tree bulk loaded with the Sort-Tile-Recursive algorithm
+	Items are identified by their position in the bounds array used to build the tree,
+	an optional array of ids (like osm ids or shapefile records numbers) can be attached
+
+	>>> tree = PackedRTree(bounds)
+	>>> tree.query(bbox)
+	'''
+
+	def __init__(self, bounds, ids=None, nodeSize=16):
+		'''
+		bounds : (n,4) array of items bounds (xmin, ymin, xmax, ymax), items with nan bounds are ignored
+		ids : optional array of n items ids returned by queries instead of items positions
+		'''
+		bounds = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)
+		self.nodeSize = nodeSize
+		self.nbItems = len(bounds)
+		self.ids = None if ids is None else np.asarray(ids)
+
+		valid = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+		order = valid[self._strOrder(bounds[valid])]
+		#level 0 is the sorted items, each upper level groups nodeSize entries of the level below
+		self.order = order
+		self.levels = [bounds[order]]
+		while len(self.levels[-1]) > 1:
+			self.levels.append(self._groupBounds(self.levels[-1]))
+
+	def _strOrder(self, bounds):
+		'''Sort-Tile-Recursive ordering of boxes'''
+		n = len(bounds)
+		if n == 0:
+			return np.zeros(0, dtype=np.int64)
+		cx = (bounds[:,0] + bounds[:,2]) / 2
+		cy = (bounds[:,1] + bounds[:,3]) / 2
+		nbNodes = math.ceil(n / self.nodeSize)
+		nbSlices = math.ceil(math.sqrt(nbNodes))
+		sliceSize = nbSlices * self.nodeSize
+		byX = np.argsort(cx, kind='stable')
+		#sort by y inside each vertical slice
+		sliceIdx = np.arange(n) // sliceSize
+		return byX[np.lexsort((cy[byX], sliceIdx))]
+
+	def _groupBounds(self, bounds):
+		n = len(bounds)
+		starts = np.arange(0, n, self.nodeSize)
+		return np.column_stack((
+			np.minimum.reduceat(bounds[:,0], starts),
+			np.minimum.reduceat(bounds[:,1], starts),
+			np.maximum.reduceat(bounds[:,2], starts),
+			np.maximum.reduceat(bounds[:,3], starts)
+		))
+
+	def __len__(self):
+		return len(self.order)
+
+	@property
+	def bbox(self):
+		if not len(self):
+			return None
+		return tuple(self.levels[-1][0].tolist())
+
+	def _children(self, boxIdx, nodes, level):
+		'''expand (box, node) pairs to the (box, child) pairs of the level below'''
+		size = len(self.levels[level - 1])
+		first = nodes * self.nodeSize
+		counts = np.minimum(first + self.nodeSize, size) - first
+		offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		return np.repeat(boxIdx, counts), np.repeat(first, counts) + offsets
+
+	def _search(self, boxes):
+		'''
+		Traverse the tree top down for all boxes at once
+		return (boxesIdx, entries) arrays of the pairs of intersecting boxes and level 0 entries
+		'''
+		if not len(self) or not len(boxes):
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+		top = len(self.levels) - 1
+		nbTop = len(self.levels[top])
+		boxIdx = np.repeat(np.arange(len(boxes)), nbTop)
+		nodes = np.tile(np.arange(nbTop), len(boxes))
+		for level in range(top, -1, -1):
+			b = self.levels[level][nodes]
+			q = boxes[boxIdx]
+			hit = (b[:,0] <= q[:,2]) & (b[:,2] >= q[:,0]) & (b[:,1] <= q[:,3]) & (b[:,3] >= q[:,1])
+			boxIdx, nodes = boxIdx[hit], nodes[hit]
+			if level > 0:
+				boxIdx, nodes = self._children(boxIdx, nodes, level)
+		return boxIdx, nodes
+
+	def _toIds(self, items):
+		items = np.unique(items)
+		if self.ids is not None:
+			return self.ids[items]
+		return items
+
+	def query(self, bbox):
+		'''items intersecting a BBOX object or a (xmin, ymin, xmax, ymax) tuple'''
+		if hasattr(bbox, 'xmin'):
+			bbox = (bbox.xmin, bbox.ymin, bbox.xmax, bbox.ymax)
+		return self.queryMany([bbox])
+
+	def queryMany(self, boxes):
+		'''items intersecting at least one of the boxes of a (m,4) array'''
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		_, entries = self._search(boxes)
+		return self._toIds(self.order[entries])
+
+	def queryPairs(self, boxes):
+		'''
+		all the pairs of intersecting boxes and items, for queries that need to know which box hit which item
+		boxes : (m,4) array of boxes
+		return (boxesIdx, items) arrays, items are ids if any else positions in the bounds array
+		'''
+		boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+		boxIdx, entries = self._search(boxes)
+		items = self.order[entries]
+		if self.ids is not None:
+			items = self.ids[items]
+		return boxIdx, items
+
+	def queryNear(self, pts, distance):
+		'''
+		items whose bounds are closer than distance to a set of points
+		pts : (n,2+) array of points
+		'''
+		pts = np.asarray(pts, dtype=np.float64)[:, 0:2]
+		boxes = np.column_stack((pts - distance, pts + distance))
+		return self.queryMany(boxes)
+
+	def queryNearSegments(self, pts, distance, breaks=None):
+		'''
+		items whose bounds are closer than distance to polylines
+		pts : (n,2+) array of the polylines vertices
+		breaks : optional indices of the first point of each polyline, no segment is build accross a break
+		'''
+		pts = np.asarray(pts, dtype=np.float64)[:, 0:2]
+		a, b = pts[:-1], pts[1:]
+		if breaks is not None:
+			keep = np.ones(len(a), dtype=bool)
+			breaks = np.asarray(breaks, dtype=np.int64)
+			keep[breaks[(breaks > 0) & (breaks < len(pts))] - 1] = False
+			a, b = a[keep], b[keep]
+		boxes = np.column_stack((np.minimum(a, b) - distance, np.maximum(a, b) + distance))
+		return self.queryMany(boxes)
+
+	############################################
+	# Persistence
+	############################################
+
+	def save(self, path, signature=None):
+		'''Write the tree into a numpy npz archive, the file is written in a temp file then renamed'''
+		arrays = {'version': INDEX_VERSION, 'nodeSize': self.nodeSize, 'nbItems': self.nbItems, 'order': self.order}
+		for i, level in enumerate(self.levels):
+			arrays['level{}'.format(i)] = level
+		if self.ids is not None:
+			arrays['ids'] = self.ids
+		if signature is not None:
+			arrays['signature'] = np.array(signature, dtype=np.int64)
+		tmpPath = path + '.tmp.npz'
+		np.savez(tmpPath, **arrays)
+		os.replace(tmpPath, path)
+
+	@classmethod
+	def load(cls, path, signature=None):
+		'''Load a tree saved with save(), return None if the file is missing, outdated or corrupted'''
+		if not os.path.exists(path):
+			return None
+		try:
+			with np.load(path, allow_pickle=False) as data:
+				if int(data['version']) != INDEX_VERSION:
+					return None
+				if signature is not None:
+					if 'signature' not in data or data['signature'].tolist() != list(signature):
+						return None
+				tree = cls.__new__(cls)
+				tree.nodeSize = int(data['nodeSize'])
+				tree.nbItems = int(data['nbItems'])
+				tree.order = data['order']
+				nbLevels = len([k for k in data.files if k.startswith('level')])
+				tree.levels = [data['level{}'.format(i)] for i in range(nbLevels)]
+				tree.ids = data['ids'] if 'ids' in data else None
+		except Exception as e:
+			log.warning('Unable to read spatial index {} : {}'.format(path, e))
+			return None
+		return tree
+
+
+def fileSignature(path):
+	'''(size, modification time) of a file, used to detect outdated sidecar indexes'''
+	st = os.stat(path)
+	return (st.st_size, st.st_mtime_ns)
+
+def getIndexPath(path):
+	return path + INDEX_EXT
+
+def getCachedIndex(path, builder, nodeSize=16):
+	'''
+	Return the spatial index of a source file, loaded from its sidecar file if up to date,
+	else built with builder() which must return (bounds, ids) and saved next to the source
+	'''
+	indexPath = getIndexPath(path)
+	signature = fileSignature(path)
+	tree = PackedRTree.load(indexPath, signature)
+	if tree is not None:
+		return tree
+	bounds, ids = builder()
+	tree = PackedRTree(bounds, ids, nodeSize)
+	try:
+		tree.save(indexPath, signature)
+	except OSError as e:
+		log.warning('Unable to write spatial index {} : {}'.format(indexPath, e))
+	return tree
+
+
+def getShpIndex(path):
+	'''Spatial index of a shapefile records, ids are records numbers'''
+	def builder():
+		shp = ShpArrayReader(path)
+		return shp.recordsBounds(), None
+	return getCachedIndex(path, builder)
+
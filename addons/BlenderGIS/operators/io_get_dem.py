@@ -4,7 +4,6 @@ import time
 import logging
 log = logging.getLogger(__name__)
 
-from urllib.request import Request, urlopen
 from urllib.error import URLError, HTTPError
 
 import bpy
@@ -15,14 +14,11 @@ from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty,
 from ..geoscene import GeoScene
 from .utils import adjust3Dview, getBBOX, isTopView
 from ..core.proj import SRS, reprojBbox
-
-from ..core import settings
-USER_AGENT = settings.user_agent
+from ..core.basemaps import DemService
+from ..core.errors import OverlapError
 
 PKG, SUBPKG = __package__.split('.', maxsplit=1)
 
-TIMEOUT = 120
-
 class IMPORTGIS_OT_dem_query(Operator):
 	"""Import elevation data from a web service"""
 
@@ -93,39 +89,36 @@ class IMPORTGIS_OT_dem_query(Operator):
 		w = context.window
 		w.cursor_set('WAIT')
 
-		#url template
-		#http://opentopo.sdsc.edu/otr/getdem?demtype=SRTMGL3&west=-120.168457&south=36.738884&east=-118.465576&north=38.091337&outputFormat=GTiff
-		e = 0.002 #opentopo service does not always respect the entire bbox, so request for a little more
-		xmin, xmax = bbox.xmin - e, bbox.xmax + e
-		ymin, ymax = bbox.ymin - e, bbox.ymax + e
-
-		url = prefs.demServer.format(W=xmin, E=xmax, S=ymin, N=ymax)
-		log.debug(url)
-
-		# Download the file from url and save it locally
-		# opentopo return a geotiff object in wgs84
-		if bpy.data.is_saved:
-			filePath = os.path.join(os.path.dirname(bpy.data.filepath), 'srtm.tif')
-		else:
-			filePath = os.path.join(bpy.app.tempdir, 'srtm.tif')
-
-		#we can directly init NpImg from blob but if gdal is not used as image engine then georef will not be extracted
-		#Alternatively, we can save on disk, open with GeoRaster class (will use tyf if gdal not available)
-		rq = Request(url, headers={'User-Agent': USER_AGENT})
+		#Get the DEM through the tiles cache, a previous request over the same area will not be downloaded again
+		#opentopo return a geotiff object in wgs84
+		cacheFolder = prefs.cacheFolder
+		if cacheFolder == "" or not os.access(cacheFolder, os.X_OK | os.W_OK):
+			if bpy.data.is_saved:
+				cacheFolder = os.path.dirname(bpy.data.filepath)
+			else:
+				cacheFolder = bpy.app.tempdir
+
+		#if gdal is not used as image engine then georef will not be extracted from a blob,
+		#so the tiles are saved on disk and opened with GeoRaster class (will use tyf if gdal not available)
 		try:
-			with urlopen(rq, timeout=TIMEOUT) as response, open(filePath, 'wb') as outFile:
-				data = response.read() # a `bytes` object
-				outFile.write(data) #
+			filePath = DemService(prefs.demServer, cacheFolder).getDem(bbox)
 		except (URLError, HTTPError) as err:
-			log.error('Http request fails url:{}, code:{}, error:{}'.format(url, getattr(err, 'code', None), err.reason))
+			log.error('Http request fails, code:{}, error:{}'.format(getattr(err, 'code', None), getattr(err, 'reason', err)))
 			self.report({'ERROR'}, "Cannot reach OpenTopography web service, check logs for more infos")
 			return {'CANCELLED'}
-		except TimeoutError:
-			log.error('Http request does not respond. url:{}, code:{}, error:{}'.format(url, getattr(err, 'code', None), err.reason))
+		except TimeoutError as err:
+			log.error('Http request does not respond. error:{}'.format(err))
 			info = "Cannot reach SRTM web service provider, server can be down or overloaded. Please retry later"
 			log.info(info)
 			self.report({'ERROR'}, info)
 			return {'CANCELLED'}
+		except OverlapError:
+			self.report({'ERROR'}, "No elevation data available for this extent")
+			return {'CANCELLED'}
+		except IOError as err:
+			log.error('Unable to get elevation data : {}'.format(err))
+			self.report({'ERROR'}, "Unable to get elevation data, check logs for more infos")
+			return {'CANCELLED'}
 
 		if not onMesh:
 			bpy.ops.importgis.georaster(
@@ -8,13 +8,15 @@ log = logging.getLogger(__name__)
 
 import bpy
 import bmesh
+import numpy as np
 from bpy.types import Operator, Panel, AddonPreferences
 from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty, FloatVectorProperty
 
 from .lib.osm import overpy
+from .lib.osm.osmstream import OSMStreamReader, getOSMIndex
 
 from ..geoscene import GeoScene
-from .utils import adjust3Dview, getBBOX, DropToGround, isTopView
+from .utils import adjust3Dview, getBBOX, DropToGround, isTopView, meshFromArrays
 
 from ..core.proj import Reproj, reprojBbox, reprojPt, utm
 from ..core.utils import perf_clock
@@ -88,15 +90,99 @@ def queryBuilder(bbox, tags=['building', 'highway'], types=['node', 'way', 'rela
 
 
 ########################
-def joinBmesh(src_bm, dest_bm):
+def buildLayerMesh(name, type, pts, counts, heights=None, flatRoof=False):
 	'''
-	Hack to join a bmesh to another
-	TODO: replace this function by bmesh.ops.duplicate when 'dest' argument will be implemented
+	Build a single mesh from all the features of a layer
+	pts : (n,3) array of the points of all the features concatenated
+	counts : number of points of each feature
+	type : 'Nodes', 'Ways' (polylines) or 'Areas' (closed polygons without duplicate end point)
+	heights : extrusion height of each area, nan for no extrusion
+	flatRoof : if True, extruded areas get a flat top at their max z + height
+	return the mesh and the array of features index of each vertex
 	'''
-	buff = bpy.data.meshes.new(".temp")
-	src_bm.to_mesh(buff)
-	dest_bm.from_mesh(buff)
-	bpy.data.meshes.remove(buff)
+	pts = np.asarray(pts, dtype=np.float64)
+	counts = np.asarray(counts, dtype=np.int64)
+	nbPts = len(pts)
+	starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+	featIdx = np.repeat(np.arange(len(counts)), counts)
+	idx = np.arange(nbPts)
+	ends = starts + counts - 1
+
+	if type == 'Nodes':
+		return meshFromArrays(name, pts), featIdx
+
+	if type == 'Ways':
+		notLast = np.ones(nbPts, dtype=bool)
+		notLast[ends] = False
+		edges = np.column_stack((idx[notLast], idx[notLast] + 1))
+		return meshFromArrays(name, pts, edges=edges), featIdx
+
+	#Areas
+	#next vertex in each ring
+	nxt = idx + 1
+	nxt[ends] = starts
+	#ensure faces are up (anticlockwise order) because in OSM there is no particular order for closed ways
+	cross = pts[:, 0] * pts[nxt, 1] - pts[nxt, 0] * pts[:, 1]
+	area = np.bincount(featIdx, weights=cross, minlength=len(counts))
+	cw = (area < 0)[featIdx]
+	order = np.where(cw, starts[featIdx] + ends[featIdx] - idx, idx)
+	pts = pts[order]
+
+	if heights is None:
+		heights = np.full(len(counts), np.nan)
+	heights = np.asarray(heights, dtype=np.float64)
+	ext = ~np.isnan(heights)[featIdx]
+	nbTop = np.count_nonzero(ext)
+
+	#top rings of extruded areas
+	top = np.full(nbPts, -1)
+	top[ext] = nbPts + np.arange(nbTop)
+	topPts = pts[ext].copy()
+	if flatRoof:
+		maxZ = np.full(len(counts), -np.inf)
+		np.maximum.at(maxZ, featIdx, pts[:, 2])
+		topPts[:, 2] = (maxZ + heights)[featIdx[ext]]
+	else:
+		topPts[:, 2] += heights[featIdx[ext]]
+
+	#one face per area, the top face replace the base face of extruded areas
+	loops = np.where(ext, top, idx)
+	#side quads
+	b, bn = idx[ext], nxt[ext]
+	quads = np.column_stack((b, bn, top[bn], top[b])).ravel()
+	faceStarts = np.concatenate((starts, len(loops) + np.arange(len(b)) * 4))
+	loops = np.concatenate((loops, quads))
+
+	verts = np.concatenate((pts, topPts))
+	mesh = meshFromArrays(name, verts, faces=loops, faceStarts=faceStarts)
+	return mesh, np.concatenate((featIdx, featIdx[ext]))
+
+
+def setFeatureAttributes(mesh, vertFeat, ids, tags, relations):
+	'''
+	Store features properties without a dense attribute per distinct value (street names...)
+	* 'osm_feature' integer point attribute : index of the feature of each vertex
+	* 'osm_ids', 'osm_tags' and 'osm_relations' mesh properties : json lookup tables indexed by feature
+	* one boolean point attribute per tag key (except names), a small set compared to the tag values
+	vertFeat : feature index of each vertex
+	ids, tags, relations : lists of the id, tags dict and relations names of each feature
+	'''
+	attr = mesh.attributes.new('osm_feature', 'INT', 'POINT')
+	attr.data.foreach_set('value', vertFeat.astype(np.int32))
+	mesh['osm_ids'] = json.dumps(ids)
+	mesh['osm_tags'] = json.dumps(tags)
+	mesh['osm_relations'] = json.dumps(relations)
+
+	keys = {}
+	for k, featTags in enumerate(tags):
+		for key in featTags:
+			if not key.startswith('name'):
+				keys.setdefault(key, []).append(k)
+	for key in sorted(keys.keys()):
+		flags = np.zeros(len(tags), dtype=bool)
+		flags[keys[key]] = True
+		attr = mesh.attributes.new('Tag:'+key, 'BOOLEAN', 'POINT')
+		attr.data.foreach_set('value', flags[vertFeat])
 
 
 
@@ -177,6 +263,41 @@ class OSM_IMPORT():
 		layout.prop(self, 'separate')
 
 
+	def getExtrusionHeight(self, tags):
+		'''Compute buildings extrusion height from osm tags'''
+		offset = None
+		if "height" in tags:
+				htag = tags["height"]
+				htag.replace(',', '.')
+				try:
+					offset = int(htag)
+				except:
+					try:
+						offset = float(htag)
+					except:
+						for i, c in enumerate(htag):
+							if not c.isdigit():
+								try:
+									offset, unit = float(htag[:i]), htag[i:].strip()
+									#todo : parse unit  25, 25m, 25 ft, etc.
+								except:
+									offset = None
+		elif "building:levels" in tags:
+			try:
+				offset = int(tags["building:levels"]) * self.levelHeight
+			except ValueError as e:
+				offset = None
+
+		if offset is None:
+			minH = self.defaultHeight - self.randomHeightThreshold
+			if minH < 0 :
+				minH = 0
+			maxH = self.defaultHeight + self.randomHeightThreshold
+			offset = random.randint(minH, maxH)
+
+		return offset
+
+
 	def build(self, context, result, dstCRS):
 		prefs = context.preferences.addons[PKG].preferences
 		scn = context.scene
@@ -199,222 +320,35 @@ class OSM_IMPORT():
 			elevObj = scn.objects[int(self.objElevLst)]
 			rayCaster = DropToGround(scn, elevObj)
 
-		bmeshes = {}
-		vgroupsObj = {}
-
 		#######
-		def seed(id, tags, pts):
-			'''
-			Sub funtion :
-				1. create a bmesh from [pts]
-				2. seed a global bmesh or create a new object
-			'''
+		# 1. Collect all features into flat arrays
+		#######
+
+		features = [] #list of (id, tags, extags, type, closed)
+		coords = [] #flat list of lon, lat
+		counts = [] #number of points of each feature
+
+		def collect(id, tags, extags, pts):
 			if len(pts) > 1:
-				if pts[0] == pts[-1] and any(tag in closedWaysArePolygons for tag in tags):
+				if len(pts) > 3 and pts[0] == pts[-1] and any(tag in closedWaysArePolygons for tag in tags):
 					type = 'Areas'
 					closed = True
-					pts.pop() #exclude last duplicate node
+					pts = pts[:-1] #exclude last duplicate node
 				else:
 					type = 'Ways'
 					closed = False
 			else:
 				type = 'Nodes'
 				closed = False
-
-			#reproj and shift coords
-			pts = rprj.pts(pts)
-			dx, dy = geoscn.crsx, geoscn.crsy
-
-			if self.useElevObj:
-				#pts = [rayCaster.rayCast(v[0]-dx, v[1]-dy).loc for v in pts]
-				pts = [rayCaster.rayCast(v[0]-dx, v[1]-dy) for v in pts]
-				hits = [pt.hit for pt in pts]
-				if not all(hits) and any(hits):
-					zs = [p.loc.z for p in pts if p.hit]
-					meanZ = sum(zs) / len(zs)
-					for v in pts:
-						if not v.hit:
-							v.loc.z = meanZ
-				pts = [pt.loc for pt in pts]
-			else:
-				pts = [ (v[0]-dx, v[1]-dy, 0) for v in pts]
-
-			#Create a new bmesh
-			#>using an intermediate bmesh object allows some extra operation like extrusion
-			bm = bmesh.new()
-
-			if len(pts) == 1:
-				verts = [bm.verts.new(pt) for pt in pts]
-
-			elif closed: #faces
-				verts = [bm.verts.new(pt) for pt in pts]
-				face = bm.faces.new(verts)
-				#ensure face is up (anticlockwise order)
-				#because in OSM there is no particular order for closed ways
-				face.normal_update()
-				if face.normal.z < 0:
-					face.normal_flip()
-
-				if self.buildingsExtrusion and any(tag in closedWaysAreExtruded for tag in tags):
-					offset = None
-					if "height" in tags:
-							htag = tags["height"]
-							htag.replace(',', '.')
-							try:
-								offset = int(htag)
-							except:
-								try:
-									offset = float(htag)
-								except:
-									for i, c in enumerate(htag):
-										if not c.isdigit():
-											try:
-												offset, unit = float(htag[:i]), htag[i:].strip()
-												#todo : parse unit  25, 25m, 25 ft, etc.
-											except:
-												offset = None
-					elif "building:levels" in tags:
-						try:
-							offset = int(tags["building:levels"]) * self.levelHeight
-						except ValueError as e:
-							offset = None
-
-					if offset is None:
-						minH = self.defaultHeight - self.randomHeightThreshold
-						if minH < 0 :
-							minH = 0
-						maxH = self.defaultHeight + self.randomHeightThreshold
-						offset = random.randint(minH, maxH)
-
-					#Extrude
-					"""
-					if self.extrusionAxis == 'NORMAL':
-						normal = face.normal
-						vect = normal * offset
-					elif self.extrusionAxis == 'Z':
-					"""
-					vect = (0, 0, offset)
-					faces = bmesh.ops.extrude_discrete_faces(bm, faces=[face]) #return {'faces': [BMFace]}
-					verts = faces['faces'][0].verts
-					if self.useElevObj:
-						#Making flat roof
-						z = max([v.co.z for v in verts]) + offset #get max z coord
-						for v in verts:
-							v.co.z = z
-					else:
-						bmesh.ops.translate(bm, verts=verts, vec=vect)
-
-
-			elif len(pts) > 1: #edge
-				verts = [bm.verts.new(pt) for pt in pts]
-				for i in range(len(pts)-1):
-					edge = bm.edges.new( [verts[i], verts[i+1] ])
-
-
-			if self.separate:
-
-				name = tags.get('name', str(id))
-
-				mesh = bpy.data.meshes.new(name)
-				bm.to_mesh(mesh)
-				mesh.update()
-				mesh.validate()
-
-				obj = bpy.data.objects.new(name, mesh)
-
-				#Assign tags to custom props
-				obj['id'] = str(id) #cast to str to avoid overflow error "Python int too large to convert to C int"
-				for key in tags.keys():
-					obj[key] = tags[key]
-
-				#Put object in right collection
-				if self.filterTags:
-					tagsList = self.filterTags
-				else:
-					tagsList = OSMTAGS
-				if any(tag in tagsList for tag in tags):
-					for k in tagsList:
-						if k in tags:
-							try:
-								tagCollec = layer.children[k]
-							except KeyError:
-								tagCollec = bpy.data.collections.new(k)
-								layer.children.link(tagCollec)
-							tagCollec.objects.link(obj)
-							break
-				else:
-					layer.objects.link(obj)
-
-				obj.select_set(True)
-
-
-			else:
-				#Grouping
-
-				bm.verts.index_update()
-				#bm.edges.index_update()
-				#bm.faces.index_update()
-
-				if self.filterTags:
-
-					#group by tags (there could be some duplicates)
-					for k in self.filterTags:
-
-						if k in extags: #
-							objName = type + ':' + k
-							kbm = bmeshes.setdefault(objName, bmesh.new())
-							offset = len(kbm.verts)
-							joinBmesh(bm, kbm)
-
-				else:
-					#group all into one unique mesh
-					objName = type
-					_bm = bmeshes.setdefault(objName, bmesh.new())
-					offset = len(_bm.verts)
-					joinBmesh(bm, _bm)
-
-
-				#vertex group
-				name = tags.get('name', None)
-				vidx = [v.index + offset for v in bm.verts]
-				vgroups = vgroupsObj.setdefault(objName, {})
-
-				for tag in extags:
-					#if tag in osmTags:#filter
-					if not tag.startswith('name'):
-						vgroup = vgroups.setdefault('Tag:'+tag, [])
-						vgroup.extend(vidx)
-
-				if name is not None:
-					#vgroup['Name:'+name] = [vidx]
-					vgroup = vgroups.setdefault('Name:'+name, [])
-					vgroup.extend(vidx)
-
-				if 'relation' in self.featureType:
-					for rel in result.relations:
-						name = rel.tags.get('name', str(rel.id))
-						for member in rel.members:
-							#todo: remove duplicate members
-							if id == member.ref:
-								vgroup = vgroups.setdefault('Relation:'+name, [])
-								vgroup.extend(vidx)
-
-
-
-			bm.free()
-
-
-		######
-
-		if self.separate:
-			layer = bpy.data.collections.new('OSM')
-			context.scene.collection.children.link(layer)
-
-		#Build mesh
-		waysNodesId = [node.id for way in result.ways for node in way.nodes]
+			features.append( (id, tags, extags, type, closed) )
+			for pt in pts:
+				coords.extend(pt)
+			counts.append(len(pts))
 
 		if 'node' in self.featureType:
 
+			waysNodesId = set(node.id for way in result.ways for node in way.nodes)
+
 			for node in result.nodes:
 
 				#extended tags list
@@ -427,7 +361,7 @@ class OSM_IMPORT():
 					continue
 
 				pt = (float(node.lon), float(node.lat))
-				seed(node.id, node.tags, [pt])
+				collect(node.id, node.tags, extags, [pt])
 
 
 		if 'way' in self.featureType:
@@ -440,35 +374,124 @@ class OSM_IMPORT():
 					continue
 
 				pts = [(float(node.lon), float(node.lat)) for node in way.nodes]
-				seed(way.id, way.tags, pts)
+				collect(way.id, way.tags, extags, pts)
+
+		if not features:
+			return
+
+		#######
+		# 2. Reproj, shift and drape all the points at once
+		#######
+
+		counts = np.array(counts, dtype=np.int64)
+		starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+		featIdx = np.repeat(np.arange(len(features)), counts)
+
+		pts = rprj.pts_array(np.array(coords, dtype=np.float64).reshape(-1, 2))
+		xy = pts[:, 0:2] - (geoscn.crsx, geoscn.crsy)
+
+		if self.useElevObj:
+			zs, hits, _ = rayCaster.rayCastArray(xy)
+			#points that miss the ground get the mean elevation of their feature
+			nbHits = np.bincount(featIdx, weights=hits, minlength=len(features))
+			sumZ = np.bincount(featIdx, weights=np.where(hits, zs, 0), minlength=len(features))
+			meanZ = np.divide(sumZ, nbHits, out=np.zeros(len(features)), where=nbHits > 0)
+			zs = np.where(hits, zs, meanZ[featIdx])
+		else:
+			zs = np.zeros(len(xy))
+
+		pts = np.column_stack((xy, zs))
+
+		#######
+		# 3. Build
+		#######
+
+		if self.separate:
+
+			layer = bpy.data.collections.new('OSM')
+			context.scene.collection.children.link(layer)
+
+			if self.filterTags:
+				tagsList = self.filterTags
+			else:
+				tagsList = OSMTAGS
+
+			for i, (id, tags, extags, type, closed) in enumerate(features):
+				featPts = pts[starts[i]:starts[i]+counts[i]].tolist()
+				obj = self.buildObject(id, tags, featPts, closed)
+
+				#Put object in right collection
+				if any(tag in tagsList for tag in tags):
+					for k in tagsList:
+						if k in tags:
+							try:
+								tagCollec = layer.children[k]
+							except KeyError:
+								tagCollec = bpy.data.collections.new(k)
+								layer.children.link(tagCollec)
+							tagCollec.objects.link(obj)
+							break
+				else:
+					layer.objects.link(obj)
 
+				obj.select_set(True)
 
+		else:
 
-		if not self.separate:
+			#group features by layer, a feature can belong to several layers when filtering by tags
+			layers = {}
+			for i, (id, tags, extags, type, closed) in enumerate(features):
+				if self.filterTags:
+					for k in self.filterTags:
+						if k in extags:
+							layers.setdefault(type + ':' + k, []).append(i)
+				else:
+					layers.setdefault(type, []).append(i)
+
+			#relations membership
+			relations = {}
+			if 'relation' in self.featureType:
+				for rel in result.relations:
+					name = rel.tags.get('name', str(rel.id))
+					for member in rel.members:
+						relations.setdefault(member.ref, set()).add(name)
+
+			#extrusion heights (nan means no extrusion)
+			heights = np.full(len(features), np.nan)
+			if self.buildingsExtrusion:
+				for i, (id, tags, extags, type, closed) in enumerate(features):
+					if closed and any(tag in closedWaysAreExtruded for tag in tags):
+						heights[i] = self.getExtrusionHeight(tags)
+
+			for name in sorted(layers.keys()):
+				idx = np.array(layers[name])
+				type = features[idx[0]][3]
+				#gather the points of the features of this layer
+				layerCounts = counts[idx]
+				shift = starts[idx] - np.concatenate(([0], np.cumsum(layerCounts)[:-1]))
+				vIdx = np.arange(layerCounts.sum()) + np.repeat(shift, layerCounts)
+				mesh, vertFeat = buildLayerMesh(name, type, pts[vIdx], layerCounts, heights[idx], flatRoof=self.useElevObj)
+
+				#feature index point attribute and lookup tables
+				ids = [features[i][0] for i in idx]
+				setFeatureAttributes(mesh, vertFeat, ids,
+					[dict(features[i][1]) for i in idx],
+					[sorted(relations.get(id, [])) for id in ids])
 
-			for name, bm in bmeshes.items():
 				if prefs.mergeDoubles:
+					bm = bmesh.new()
+					bm.from_mesh(mesh)
 					bmesh.ops.remove_doubles(bm, verts=bm.verts, dist=0.0001)
-				mesh = bpy.data.meshes.new(name)
-				bm.to_mesh(mesh)
-				bm.free()
+					bm.to_mesh(mesh)
+					bm.free()
 
-				mesh.update()#calc_edges=True)
 				mesh.validate()
 				obj = bpy.data.objects.new(name, mesh)
 				scn.collection.objects.link(obj)
 				obj.select_set(True)
 
-				vgroups = vgroupsObj.get(name, None)
-				if vgroups is not None:
-					#for vgroupName, vgroupIdx in vgroups.items():
-					for vgroupName in sorted(vgroups.keys()):
-						vgroupIdx = vgroups[vgroupName]
-						g = obj.vertex_groups.new(name=vgroupName)
-						g.add(vgroupIdx, weight=1, type='ADD')
 
-
-		elif 'relation' in self.featureType:
+		if self.separate and 'relation' in self.featureType:
 
 			relations = bpy.data.collections.new('Relations')
 			bpy.data.collections['OSM'].children.link(relations)
@@ -504,6 +527,59 @@ class OSM_IMPORT():
 					bpy.data.collections.remove(relation)
 
 
+	def buildObject(self, id, tags, pts, closed):
+		'''Create a new object for a single feature, pts are already reprojected'''
+
+		#using an intermediate bmesh object allows some extra operation like extrusion
+		bm = bmesh.new()
+
+		if len(pts) == 1:
+			verts = [bm.verts.new(pt) for pt in pts]
+
+		elif closed: #faces
+			verts = [bm.verts.new(pt) for pt in pts]
+			face = bm.faces.new(verts)
+			#ensure face is up (anticlockwise order)
+			#because in OSM there is no particular order for closed ways
+			face.normal_update()
+			if face.normal.z < 0:
+				face.normal_flip()
+
+			if self.buildingsExtrusion and any(tag in closedWaysAreExtruded for tag in tags):
+				offset = self.getExtrusionHeight(tags)
+				vect = (0, 0, offset)
+				faces = bmesh.ops.extrude_discrete_faces(bm, faces=[face]) #return {'faces': [BMFace]}
+				verts = faces['faces'][0].verts
+				if self.useElevObj:
+					#Making flat roof
+					z = max([v.co.z for v in verts]) + offset #get max z coord
+					for v in verts:
+						v.co.z = z
+				else:
+					bmesh.ops.translate(bm, verts=verts, vec=vect)
+
+		elif len(pts) > 1: #edge
+			verts = [bm.verts.new(pt) for pt in pts]
+			for i in range(len(pts)-1):
+				edge = bm.edges.new( [verts[i], verts[i+1] ])
+
+		name = tags.get('name', str(id))
+
+		mesh = bpy.data.meshes.new(name)
+		bm.to_mesh(mesh)
+		bm.free()
+		mesh.update()
+		mesh.validate()
+
+		obj = bpy.data.objects.new(name, mesh)
+
+		#Assign tags to custom props
+		obj['id'] = str(id) #cast to str to avoid overflow error "Python int too large to convert to C int"
+		for key in tags.keys():
+			obj[key] = tags[key]
+
+		return obj
+
 
 
 
@@ -529,6 +605,15 @@ class IMPORTGIS_OT_osm_file(Operator, OSM_IMPORT):
 			default = "*.osm",
 			options = {'HIDDEN'} )
 
+	sceneExtentOnly: BoolProperty(
+			name="Scene extent only",
+			description="Only import the features intersecting the extent of the georeferenced scene, a spatial index is cached next to the file",
+			default=False )
+
+	def draw(self, context):
+		OSM_IMPORT.draw(self, context)
+		self.layout.prop(self, 'sceneExtentOnly')
+
 	def invoke(self, context, event):
 		#workaround to enum callback bug (T48873, T38489)
 		global OSMTAGS
@@ -561,12 +646,23 @@ class IMPORTGIS_OT_osm_file(Operator, OSM_IMPORT):
 			self.report({'ERROR'}, "Scene georef is broken, please fix it beforehand")
 			return {'CANCELLED'}
 
+		#Select the features intersecting the scene extent with the file spatial index
+		ids = None
+		if self.sceneExtentOnly:
+			if not geoscn.isGeoref:
+				log.warning('Scene is not georef, scene extent filter is ignored')
+			else:
+				t0 = perf_clock()
+				bbox = getBBOX.fromScn(scn).toGeo(geoscn)
+				bbox = reprojBbox(geoscn.crs, 4326, bbox)
+				ids = getOSMIndex(self.filepath).query(bbox)
+				log.info('{} features in scene extent, found in {} seconds'.format(len(ids), round(perf_clock() - t0, 2)))
+
 		#Parse file
+		#the tags, types and extent filters are applied while streaming so ignored features are never loaded
 		t0 = perf_clock()
-		api = overpy.Overpass()
-		#with open(self.filepath, "r", encoding"utf-8") as f:
-		#	result = api.parse_xml(f.read()) #WARNING read() load all the file into memory
-		result = api.parse_xml(self.filepath)
+		reader = OSMStreamReader(tags=list(self.filterTags), types=list(self.featureType), ids=ids)
+		result = reader.parse(self.filepath)
 		t = perf_clock() - t0
 		log.info('File parsed in {} seconds'.format(round(t, 2)))
 
@@ -5,12 +5,14 @@ from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty
 from bpy.types import Operator
 import bmesh
 import math
+import numpy as np
 from mathutils import Vector
 
 import logging
 log = logging.getLogger(__name__)
 
 from ..core.lib.shapefile import Reader as shpReader
+from ..core.vector import ShpArrayReader, getShpIndex
 
 from ..geoscene import GeoScene, georefManagerLayout
 from ..prefs import PredefCRS
@@ -193,6 +195,12 @@ class IMPORTGIS_OT_shapefile_props_dialog(Operator):
 			description="Warning : can be very slow with lot of features",
 			default=False )
 
+	#Restrict to scene extent
+	sceneExtentOnly: BoolProperty(
+			name="Scene extent only",
+			description="Only import the features intersecting the extent of the georeferenced scene, a spatial index is cached next to the file",
+			default=False )
+
 	#Name objects from field
 	useFieldName: BoolProperty(
 			name="Object name from field",
@@ -232,6 +240,8 @@ class IMPORTGIS_OT_shapefile_props_dialog(Operator):
 			layout.prop(self, 'fieldObjName')
 		#
 		geoscn = GeoScene()
+		if geoscn.isGeoref:
+			layout.prop(self, 'sceneExtentOnly')
 		#geoscnPrefs = context.preferences.addons['geoscene'].preferences
 		if geoscn.isPartiallyGeoref:
 			layout.prop(self, 'reprojection')
@@ -287,7 +297,7 @@ class IMPORTGIS_OT_shapefile_props_dialog(Operator):
 		try:
 			bpy.ops.importgis.shapefile('INVOKE_DEFAULT', filepath=self.filepath, shpCRS=shpCRS, elevSource=self.vertsElevSource,
 				fieldElevName=elevField, objElevName=objElevName, fieldExtrudeName=extrudField, fieldObjName=nameField,
-				extrusionAxis=self.extrusionAxis, separateObjects=self.separateObjects)
+				extrusionAxis=self.extrusionAxis, separateObjects=self.separateObjects, sceneExtentOnly=self.sceneExtentOnly)
 		except Exception as e:
 			log.error('Shapefile import fails', exc_info=True)
 			self.report({'ERROR'}, 'Shapefile import fails, check logs.')
@@ -329,6 +339,12 @@ class IMPORTGIS_OT_shapefile(Operator):
 			description="Import to separate objects instead one large object",
 			default=False
 			)
+	#Only import features intersecting the scene extent
+	sceneExtentOnly: BoolProperty(
+			name="Scene extent only",
+			description="Only import the features intersecting the extent of the georeferenced scene",
+			default=False
+			)
 
 	@classmethod
 	def poll(cls, context):
@@ -354,7 +370,7 @@ class IMPORTGIS_OT_shapefile(Operator):
 		#Get shp reader
 		log.info("Read shapefile...")
 		try:
-			shp = shpReader(self.filepath)
+			shp = ShpArrayReader(self.filepath)
 		except Exception as e:
 			log.error("Unable to read shapefile", exc_info=True)
 			self.report({'ERROR'}, "Unable to read shapefile, check logs")
@@ -376,7 +392,7 @@ class IMPORTGIS_OT_shapefile(Operator):
 			rayCaster = DropToGround(scn, elevObj)
 
 		#Get fields
-		fields = [field for field in shp.fields if field[0] != 'DeletionFlag'] #ignore default DeletionFlag field
+		fields = shp.fields
 		fieldsNames = [field[0] for field in fields]
 		log.debug("DBF fields : "+str(fieldsNames))
 
@@ -453,6 +469,18 @@ class IMPORTGIS_OT_shapefile(Operator):
 		if geoscn.crs != shpCRS:
 			bbox = rprj.bbox(bbox)
 
+		#Select the records intersecting the scene extent with the shapefile spatial index
+		#only the bytes of these records will be decoded
+		records = None
+		if self.sceneExtentOnly and geoscn.isGeoref:
+			scnBbox = getBBOX.fromScn(context.scene).toGeo(geoscn)
+			if geoscn.crs != shpCRS:
+				scnBbox = Reproj(geoscn.crs, shpCRS).bbox(scnBbox)
+			records = getShpIndex(self.filepath).query(scnBbox)
+			if self.useDbf:
+				records = records[records < len(shp.deleted)]
+			log.info('{} features in scene extent'.format(len(records)))
+
 		#Get or set georef dx, dy
 		if not geoscn.isGeoref:
 			dx, dy = bbox.center
@@ -460,16 +488,41 @@ class IMPORTGIS_OT_shapefile(Operator):
 		else:
 			dx, dy = geoscn.getOriginPrj()
 
-		#Get reader iterator (using iterator avoids loading all data in memory)
-		#warn, shp with zero field will return an empty shapeRecords() iterator
-		#to prevent this issue, iter only on shapes if there is no field required
-		if self.useDbf:
-			#Note: using shapeRecord solve the issue where number of shapes does not match number of table records
-			#because it iter only on features with geom and record
-			shpIter = shp.iterShapeRecords()
+		#Decode all geometries at once into numpy arrays
+		geoms = shp.readGeoms(records)
+		nbFeats = len(geoms)
+		coords = geoms.coords
+
+		#Reproj all points in one batch
+		if geoscn.crs != shpCRS:
+			coords = rprj.pts_array(coords)[:, 0:2]
+
+		#Shift coords
+		coords = coords - (dx, dy)
+
+		#Elevations of all points
+		if self.elevSource == 'OBJ':
+			zs, _, _ = rayCaster.rayCastArray(coords) #will be automatically set to zero if not hit
+		elif shpType[-1] == 'Z' and self.elevSource == 'GEOM':
+			zs = geoms.z
 		else:
-			shpIter = shp.iterShapes()
-		nbFeats = shp.numRecords
+			zs = np.zeros(len(coords))
+
+		#Decode the required dbf columns into typed arrays
+		#warn, geometries without matching dbf record are skipped
+		if self.useDbf:
+			columns = shp.readFields(idx=records)
+			deleted = shp.deleted
+			if records is not None:
+				deleted = deleted[records]
+			nbFeats = min(nbFeats, len(deleted))
+
+		def getValue(fieldName, i):
+			'''Return a python value from a dbf column or None if missing'''
+			col = columns[fieldName]
+			if col.mask[i]:
+				return None
+			return col.data[i].item()
 
 		#Create an empty BMesh
 		bm = bmesh.new()
@@ -485,13 +538,10 @@ class IMPORTGIS_OT_shapefile(Operator):
 			context.scene.collection.children.link(layer)
 
 		#Main iteration over features
-		for i, feat in enumerate(shpIter):
+		for i in range(nbFeats):
 
-			if self.useDbf:
-				shape = feat.shape
-				record = feat.record
-			else:
-				shape = feat
+			if self.useDbf and deleted[i]:
+				continue
 
 			#Progress infos
 			pourcent = round(((i+1)*100)/nbFeats)
@@ -504,45 +554,38 @@ class IMPORTGIS_OT_shapefile(Operator):
 				sys.stdout.flush() #we need to flush or it won't print anything until after the loop has finished
 
 			#Deal with multipart features
-			#If the shape record has multiple parts, the 'parts' attribute will contains the index of
-			#the first point of each part. If there is only one part then a list containing 0 is returned
-			if (shpType == 'PointZ' or shpType == 'Point'): #point layer has no attribute 'parts'
-				partsIdx = [0]
-			else:
-				try: #prevent "_shape object has no attribute parts" error
-					partsIdx = shape.parts
-				except Exception as e:
-					log.warning('Cannot access "parts" attribute for feature {} : {}'.format(i, e))
-					partsIdx = [0]
+			#partsIdx contains the index of the first point of each part relative to the feature first point
+			start, end, partsIdx = geoms.featRange(i)
 			nbParts = len(partsIdx)
-
-			#Get list of shape's points
-			pts = shape.points
-			nbPts = len(pts)
+			nbPts = end - start
 
 			#Skip null geom
 			if nbPts == 0:
 				continue #go to next iteration of the loop
 
-			#Reproj geom
-			if geoscn.crs != shpCRS:
-				pts = rprj.pts(pts)
-
 			#Get extrusion offset
 			if self.fieldExtrudeName:
-				try:
-					offset = float(record[extrudeFieldIdx])
-				except Exception as e:
-					log.warning('Cannot extract extrusion value for feature {} : {}'.format(i, e))
+				offset = getValue(self.fieldExtrudeName, i)
+				if offset is None:
+					log.warning('Cannot extract extrusion value for feature {}'.format(i))
 					offset = 0 #null values will be set to zero
+				offset = float(offset)
+
+			#Get elevation from field
+			if self.elevSource == 'FIELD':
+				z = getValue(self.fieldElevName, i)
+				if z is None:
+					log.warning('Cannot extract elevation value for feature {}'.format(i))
+					z = 0 #null values will be set to zero
+				featZs = np.full(nbPts, float(z))
+			else:
+				featZs = zs[start:end]
+
+			pts = np.column_stack((coords[start:end], featZs)).tolist()
 
 			#Iter over parts
 			for j in range(nbParts):
 
-				# EXTRACT 3D GEOM
-
-				geom = [] #will contains a list of 3d points
-
 				#Find first and last part index
 				idx1 = partsIdx[j]
 				if j+1 == nbParts:
@@ -550,30 +593,7 @@ class IMPORTGIS_OT_shapefile(Operator):
 				else:
 					idx2 = partsIdx[j+1]
 
-				#Build 3d geom
-				for k, pt in enumerate(pts[idx1:idx2]):
-
-					if self.elevSource == 'OBJ':
-						rcHit = rayCaster.rayCast(x=pt[0]-dx, y=pt[1]-dy)
-						z = rcHit.loc.z #will be automatically set to zero if not rcHit.hit
-
-					elif self.elevSource == 'FIELD':
-						try:
-							z = float(record[zFieldIdx])
-						except Exception as e:
-							log.warning('Cannot extract elevation value for feature {} : {}'.format(i, e))
-							z = 0 #null values will be set to zero
-
-					elif shpType[-1] == 'Z' and self.elevSource == 'GEOM':
-						z = shape.z[idx1:idx2][k]
-
-					else:
-						z = 0
-
-					geom.append((pt[0], pt[1], z))
-
-				#Shift coords
-				geom = [(pt[0]-dx, pt[1]-dy, pt[2]) for pt in geom]
+				geom = pts[idx1:idx2]
 
 
 				# BUILD BMESH
@@ -592,8 +612,8 @@ class IMPORTGIS_OT_shapefile(Operator):
 				if (shpType == 'PolyLine' or shpType == 'PolyLineZ'):
 					verts = [bm.verts.new(pt) for pt in geom]
 					edges = []
-					for i in range(len(geom)-1):
-						edge = bm.edges.new( [verts[i], verts[i+1] ])
+					for k in range(len(geom)-1):
+						edge = bm.edges.new( [verts[k], verts[k+1] ])
 						edges.append(edge)
 					#Extrusion
 					if self.fieldExtrudeName and offset > 0:
@@ -639,13 +659,9 @@ class IMPORTGIS_OT_shapefile(Operator):
 			if self.separateObjects:
 
 				if self.fieldObjName:
-					try:
-						name = record[nameFieldIdx]
-					except Exception as e:
-						log.warning('Cannot extract name value for feature {} : {}'.format(i, e))
-						name = ''
-					# null values will return a bytes object containing a blank string of length equal to fields length definition
-					if isinstance(name, bytes):
+					name = getValue(self.fieldObjName, i)
+					if name is None:
+						log.warning('Cannot extract name value for feature {}'.format(i))
 						name = ''
 					else:
 						name = str(name)
@@ -683,16 +699,17 @@ class IMPORTGIS_OT_shapefile(Operator):
 				##bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY')
 
 				#write attributes data
-				for i, field in enumerate(shp.fields):
-					fieldName, fieldType, fieldLength, fieldDecLength = field
-					if fieldName != 'DeletionFlag':
-						if fieldType in ('N', 'F'):
-							v = record[i-1]
-							if v is not None:
-								#cast to float to avoid overflow error when affecting custom property
-								obj[fieldName] = float(record[i-1])
-						else:
-							obj[fieldName] = record[i-1]
+				for fieldName, fieldType, fieldLength, fieldDecLength in fields:
+					v = getValue(fieldName, i)
+					if fieldType in ('N', 'F'):
+						if v is not None:
+							#cast to float to avoid overflow error when affecting custom property
+							obj[fieldName] = float(v)
+					elif fieldType == 'D':
+						if v is not None:
+							obj[fieldName] = str(v)
+					elif v is not None:
+						obj[fieldName] = v
 
 			elif self.fieldExtrudeName:
 				#Join to final bmesh (use from_mesh method hack)
@@ -0,0 +1,358 @@
+'''
+Memory friendly OSM reader
+
+Unlike overpy, which builds a Python object for every element of the document,
+this reader streams the elements and only keeps :
+    * the coordinates of all nodes in a compact array backed index (id >> lon, lat)
+    * the tagged nodes that pass the tags filter and are not part of a way
+    * the ways that pass the tags filter, ways only keep an array of node ids
+    * the relations
+Ignored features are never materialized. The returned OSMStreamResult exposes
+the same nodes / ways / relations / bounds interface as overpy.Result
+
+A persistent spatial index of the file features can be built with getOSMIndex,
+its query results can be passed to the reader to only keep the features of an area
+'''
+
+import os
+import io
+import json
+from collections import namedtuple
+import xml.etree.ElementTree as ET
+
+import logging
+log = logging.getLogger(__name__)
+
+import numpy as np
+
+from ....core.vector.spatialindex import getCachedIndex
+
+NodeRef = namedtuple('NodeRef', ['id', 'lon', 'lat'])
+RelationMember = namedtuple('RelationMember', ['ref', 'type', 'role'])
+
+
+class NodeIndex():
+    '''Growable array backed index of nodes coordinates, lookup by binary search once frozen'''
+
+    def __init__(self, capacity=1024):
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.coords = np.empty((capacity, 2), dtype=np.float64)
+        self.size = 0
+        self.sorted = True
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, n):
+        capacity = max(len(self.ids) * 2, self.size + n)
+        self.ids = np.resize(self.ids, capacity)
+        self.coords = np.resize(self.coords, (capacity, 2))
+
+    def append(self, ids, lons, lats):
+        '''append a chunk of nodes'''
+        n = len(ids)
+        if self.size + n > len(self.ids):
+            self._grow(n)
+        s = slice(self.size, self.size + n)
+        self.ids[s] = ids
+        self.coords[s, 0] = lons
+        self.coords[s, 1] = lats
+        if self.size > 0 and n > 0 and self.ids[self.size] < self.ids[self.size - 1]:
+            self.sorted = False
+        self.size += n
+        if n > 1 and self.sorted:
+            self.sorted = bool(np.all(np.diff(self.ids[s]) > 0))
+
+    def freeze(self):
+        '''trim the buffers and sort by id'''
+        self.ids = self.ids[:self.size]
+        self.coords = self.coords[:self.size]
+        if not self.sorted:
+            order = np.argsort(self.ids, kind='stable')
+            self.ids = self.ids[order]
+            self.coords = self.coords[order]
+            self.sorted = True
+
+    def lookup(self, ids):
+        '''return (coords, found) arrays for an array of node ids'''
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.size == 0:
+            return np.zeros((len(ids), 2)), np.zeros(len(ids), dtype=bool)
+        pos = np.searchsorted(self.ids, ids)
+        pos = np.minimum(pos, self.size - 1)
+        found = self.ids[pos] == ids
+        return self.coords[pos], found
+
+    @property
+    def bounds(self):
+        lons, lats = self.coords[:self.size, 0], self.coords[:self.size, 1]
+        return {'minlon': float(lons.min()), 'maxlon': float(lons.max()),
+                'minlat': float(lats.min()), 'maxlat': float(lats.max())}
+
+
+class StreamNode():
+
+    def __init__(self, id, lon, lat, tags):
+        self.id = id
+        self.lon = lon
+        self.lat = lat
+        self.tags = tags
+
+    def __repr__(self):
+        return "<StreamNode id={} lat={} lon={}>".format(self.id, self.lat, self.lon)
+
+
+class StreamWay():
+
+    def __init__(self, id, nodeIds, tags, coords=None):
+        self.id = id
+        self.nodeIds = nodeIds
+        self.tags = tags
+        self.coords = coords #(n,2) array of lon, lat set when the way is resolved
+
+    def __repr__(self):
+        return "<StreamWay id={} nodes={}>".format(self.id, len(self.nodeIds))
+
+    @property
+    def nodes(self):
+        return [NodeRef(int(id), lon, lat) for id, (lon, lat) in zip(self.nodeIds, self.coords.tolist())]
+
+
+class StreamRelation():
+
+    def __init__(self, id, members, tags):
+        self.id = id
+        self.members = members
+        self.tags = tags
+
+    def __repr__(self):
+        return "<StreamRelation id={} members={}>".format(self.id, len(self.members))
+
+
+class OSMStreamResult():
+
+    def __init__(self, chunkSize=10000):
+        self.index = NodeIndex()
+        self._nodes = []
+        self._ways = []
+        self._relations = []
+        self._bounds = {}
+        self.chunkSize = chunkSize
+
+    @property
+    def nodes(self):
+        return self._nodes
+
+    @property
+    def relations(self):
+        return self._relations
+
+    @property
+    def ways(self):
+        '''iterate over the ways, node references are resolved by chunks with a vectorized lookup'''
+        for i in range(0, len(self._ways), self.chunkSize):
+            chunk = self._ways[i:i+self.chunkSize]
+            unresolved = [way for way in chunk if way.coords is None]
+            if unresolved:
+                counts = [len(way.nodeIds) for way in unresolved]
+                coords, found = self.index.lookup(np.concatenate([way.nodeIds for way in unresolved]))
+                if not found.all():
+                    log.warning('{} way nodes references are missing in the data'.format(np.count_nonzero(~found)))
+                start = 0
+                for way, n in zip(unresolved, counts):
+                    s = slice(start, start + n)
+                    way.nodeIds, way.coords = way.nodeIds[found[s]], coords[s][found[s]]
+                    start += n
+            yield from chunk
+
+    @property
+    def bounds(self):
+        if not self._bounds:
+            self._bounds = self.index.bounds
+        return self._bounds
+
+
+class OSMStreamReader():
+    '''
+    Incremental OSM reader
+    tags : list of tags used to filter nodes and ways, a tag can be a key ('building')
+        or a key=value pair ('highway=primary'). Elements are kept if one of their tags match.
+        None or empty list means no filter
+    types : list of elements types to keep in ['node', 'way', 'relation']
+    chunkSize : number of elements processed at once
+    ids : optional array of the nodes and ways to keep, as returned by a getOSMIndex query
+        (ways ids are negative). Elements outside this selection are skipped without being decoded
+    '''
+
+    def __init__(self, tags=None, types=None, chunkSize=10000, ids=None):
+        self.tags = set(tags) if tags else None
+        self.types = set(types) if types else {'node', 'way', 'relation'}
+        self.chunkSize = chunkSize
+        if ids is None:
+            self.nodeIds = self.wayIds = None
+        else:
+            ids = np.asarray(ids, dtype=np.int64)
+            self.nodeIds = set(ids[ids > 0].tolist())
+            self.wayIds = set((-ids[ids < 0]).tolist())
+
+    def selected(self, id, ids):
+        return ids is None or id in ids
+
+    def match(self, tags):
+        if self.tags is None:
+            return True
+        if not tags:
+            return False
+        return any(k in self.tags or k + '=' + v in self.tags for k, v in tags.items())
+
+    def parse(self, data):
+        '''
+        Parse an osm xml or overpass json document
+        data : file path, bytes, string or file object
+        '''
+        if isinstance(data, str) and os.path.exists(data):
+            with open(data, 'rb') as f:
+                head = f.read(1024).lstrip()
+            isJson = head.startswith(b'{')
+            src = data
+        else:
+            if isinstance(data, str):
+                data = data.encode('utf-8')
+            if isinstance(data, bytes):
+                isJson = data.lstrip().startswith(b'{')
+                src = io.BytesIO(data)
+            else:
+                src = data
+                isJson = False
+        if isJson:
+            return self.parseJson(src)
+        return self.parseXml(src)
+
+    def parseXml(self, src):
+        result = OSMStreamResult(self.chunkSize)
+        ids, lons, lats = [], [], []
+
+        def flushNodes():
+            result.index.append(ids, lons, lats)
+            ids.clear()
+            lons.clear()
+            lats.clear()
+
+        tags, refs, members = {}, [], []
+        waysNodes = [] #node ids of all the ways, including the filtered ones
+        context = ET.iterparse(src, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            tag = elem.tag
+            if event == 'start':
+                if tag in ('node', 'way', 'relation'):
+                    tags, refs, members = {}, [], []
+                elif tag == 'bounds':
+                    result._bounds = {k:float(v) for k, v in elem.attrib.items() if k in ('minlon', 'maxlon', 'minlat', 'maxlat')}
+                continue
+
+            if tag == 'tag':
+                tags[elem.attrib['k']] = elem.attrib['v']
+            elif tag == 'nd':
+                refs.append(elem.attrib['ref'])
+            elif tag == 'member':
+                a = elem.attrib
+                members.append(RelationMember(int(a['ref']), a.get('type'), a.get('role')))
+            elif tag == 'node':
+                a = elem.attrib
+                id, lon, lat = int(a['id']), float(a['lon']), float(a['lat'])
+                ids.append(id)
+                lons.append(lon)
+                lats.append(lat)
+                if len(ids) >= self.chunkSize:
+                    flushNodes()
+                if tags and 'node' in self.types and self.selected(id, self.nodeIds) and self.match(tags):
+                    result._nodes.append(StreamNode(id, lon, lat, tags))
+            elif tag == 'way':
+                nodeIds = np.array(refs, dtype=np.int64)
+                id = int(elem.attrib['id'])
+                if 'way' in self.types and self.selected(id, self.wayIds) and self.match(tags):
+                    result._ways.append(StreamWay(id, nodeIds, tags))
+                waysNodes.append(nodeIds)
+            elif tag == 'relation':
+                if 'relation' in self.types:
+                    result._relations.append(StreamRelation(int(elem.attrib['id']), members, tags))
+
+            if tag in ('node', 'way', 'relation'):
+                #free memory of processed elements
+                elem.clear()
+                root.clear()
+
+        flushNodes()
+        result.index.freeze()
+        result._nodes = self._standaloneNodes(result._nodes, waysNodes)
+        return result
+
+    @staticmethod
+    def _standaloneNodes(nodes, waysNodes):
+        '''discard the nodes that are vertices of a way'''
+        if not nodes or not waysNodes:
+            return nodes
+        inWays = np.isin([node.id for node in nodes], np.concatenate(waysNodes))
+        return [node for node, skip in zip(nodes, inWays) if not skip]
+
+    def parseJson(self, src):
+        '''
+        Overpass json output, the standard library cannot stream json so the document is loaded at once
+        but elements are converted to the compact structures right away
+        '''
+        if isinstance(src, str):
+            with open(src, 'r', encoding='utf-8') as f:
+                doc = json.load(f)
+        else:
+            doc = json.load(src)
+        result = OSMStreamResult(self.chunkSize)
+        elements = doc.get('elements', [])
+        nodes = [e for e in elements if e.get('type') == 'node']
+        for i in range(0, len(nodes), self.chunkSize):
+            chunk = nodes[i:i+self.chunkSize]
+            result.index.append([e['id'] for e in chunk], [e['lon'] for e in chunk], [e['lat'] for e in chunk])
+        result.index.freeze()
+        waysNodes = []
+        for e in elements:
+            type, tags = e.get('type'), e.get('tags', {})
+            if type == 'way':
+                waysNodes.append(np.array(e.get('nodes', []), dtype=np.int64))
+            if type not in self.types:
+                continue
+            if type == 'node':
+                if tags and self.selected(e['id'], self.nodeIds) and self.match(tags):
+                    result._nodes.append(StreamNode(e['id'], e['lon'], e['lat'], tags))
+            elif type == 'way':
+                if self.selected(e['id'], self.wayIds) and self.match(tags):
+                    result._ways.append(StreamWay(e['id'], waysNodes[-1], tags))
+            elif type == 'relation':
+                members = [RelationMember(m['ref'], m.get('type'), m.get('role')) for m in e.get('members', [])]
+                result._relations.append(StreamRelation(e['id'], members, tags))
+        result._nodes = self._standaloneNodes(result._nodes, waysNodes)
+        if 'bounds' in doc:
+            result._bounds = {k:float(v) for k, v in doc['bounds'].items() if k in ('minlon', 'maxlon', 'minlat', 'maxlat')}
+        return result
+
+
+def getOSMIndex(path):
+    '''
+    Spatial index (PackedRTree) of the tagged nodes and the ways of an osm file, cached next to the file
+    Coordinates are longitude / latitude, queries return osm ids with ways ids stored as negative values
+    '''
+    def builder():
+        result = OSMStreamReader(types=['node', 'way']).parse(path)
+        nodes = result.nodes
+        ways = list(result.ways)
+        bounds = np.full((len(nodes) + len(ways), 4), np.nan)
+        ids = np.zeros(len(bounds), dtype=np.int64)
+        for i, node in enumerate(nodes):
+            bounds[i] = (node.lon, node.lat, node.lon, node.lat)
+            ids[i] = node.id
+        for i, way in enumerate(ways, start=len(nodes)):
+            if len(way.coords):
+                bounds[i, 0:2] = way.coords.min(axis=0)
+                bounds[i, 2:4] = way.coords.max(axis=0)
+            ids[i] = -way.id
+        return bounds, ids
+    return getCachedIndex(path, builder)
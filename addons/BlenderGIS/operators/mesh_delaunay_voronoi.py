@@ -2,7 +2,9 @@
 #import DelaunayVoronoi
 import bpy
 import time
-from .utils import computeVoronoiDiagram, computeDelaunayTriangulation
+import numpy as np
+from .utils import voronoiArrays, delaunayArrays, meshFromArrays
+from .utils.delaunay_voronoi import HAS_SCIPY
 from ..core.utils import perf_clock
 
 try:
@@ -15,31 +17,25 @@ else:
 import logging
 log = logging.getLogger(__name__)
 
-class Point:
-	def __init__(self, x, y, z):
-		self.x, self.y, self.z = x, y, z
-
-def unique(L):
-	"""Return a list of unhashable elements in s, but without duplicates.
-	[[1, 2], [2, 3], [1, 2]] >>> [[1, 2], [2, 3]]"""
-	#For unhashable objects, you can sort the sequence and then scan from the end of the list, deleting duplicates as you go
-	nDupli=0
-	nZcolinear=0
-	L.sort()#sort() brings the equal elements together; then duplicates are easy to weed out in a single pass.
-	last = L[-1]
-	for i in range(len(L)-2, -1, -1):
-		if last[:2] == L[i][:2]:#XY coordinates compararison
-			if last[2] == L[i][2]:#Z coordinates compararison
-				nDupli+=1#duplicates vertices
-			else:#Z colinear
-				nZcolinear+=1
-			del L[i]
-		else:
-			last = L[i]
-	return (nDupli, nZcolinear)#list data type is mutable, input list will automatically update and doesn't need to be returned
+def getVerts(mesh):
+	'''(n,3) array of the mesh vertices coordinates'''
+	verts = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+	mesh.vertices.foreach_get('co', verts)
+	return verts.reshape(-1, 3)
+
+def unique(verts):
+	"""Remove duplicates vertices and vertices sharing the same XY coordinates (the highest one is kept)
+	return the filtered vertices array, the number of duplicates and the number of z colinear vertices"""
+	uniqueXYZ = np.unique(verts, axis=0)
+	#unique return the first occurence of sorted values, reverse the array to keep the highest z
+	_, idx = np.unique(uniqueXYZ[::-1, 0:2], axis=0, return_index=True)
+	uniqueXY = uniqueXYZ[::-1][idx]
+	nDupli = len(verts) - len(uniqueXYZ)
+	nZcolinear = len(uniqueXYZ) - len(uniqueXY)
+	return uniqueXY, nDupli, nZcolinear
 
-def checkEqual(lst):
-	return lst[1:] == lst[:-1]
+def isColinear(verts):
+	return np.ptp(verts[:,0]) == 0 or np.ptp(verts[:,1]) == 0
 
 
 class OBJECT_OT_tesselation_delaunay(bpy.types.Operator):
@@ -67,7 +63,26 @@ class OBJECT_OT_tesselation_delaunay(bpy.types.Operator):
 		s = obj.scale
 		mesh = obj.data
 
-		if NATIVE:
+		if HAS_SCIPY or not NATIVE:
+			#Qhull triangulation through scipy, or pure python fallback
+			verts, nDupli, nZcolinear = unique(getVerts(mesh))
+			nVerts = len(verts)
+			log.info("{} duplicates points ignored".format(nDupli))
+			log.info("{} z colinear points excluded".format(nZcolinear))
+			if nVerts < 3:
+				self.report({'ERROR'}, "Not enough points")
+				return {'CANCELLED'}
+			if isColinear(verts):
+				self.report({'ERROR'}, "Points are colinear")
+				return {'CANCELLED'}
+			#Triangulate
+			log.info("Triangulate {} points...".format(nVerts))
+			faces = delaunayArrays(verts) #all triangles are anticlockwise so all faces up
+			log.info("Getting {} triangles".format(len(faces)))
+			#Create new mesh structure
+			log.info("Create mesh...")
+			tinMesh = meshFromArrays("TIN", verts, faces)
+		else:
 			'''
 			Use native Delaunay triangulation function : delaunay_2d_cdt(verts, edges, faces, output_type, epsilon) >> [verts, edges, faces, orig_verts, orig_edges, orig_faces]
 			The three returned orig lists give, for each of verts, edges, and faces, the list of input element indices corresponding to the positionally same output element. For edges, the orig indices start with the input edges and then continue with the edges implied by each of the faces (n of them for an n-gon).
@@ -85,34 +100,6 @@ class OBJECT_OT_tesselation_delaunay(bpy.types.Operator):
 			tinMesh = bpy.data.meshes.new("TIN")
 			tinMesh.from_pydata(verts, edges, faces)
 			tinMesh.update()
-		else:
-			vertsPts = [vertex.co for vertex in mesh.vertices]
-			#Remove duplicate
-			verts = [[vert.x, vert.y, vert.z] for vert in vertsPts]
-			nDupli, nZcolinear = unique(verts)
-			nVerts = len(verts)
-			log.info("{} duplicates points ignored".format(nDupli))
-			log.info("{} z colinear points excluded".format(nZcolinear))
-			if nVerts < 3:
-				self.report({'ERROR'}, "Not enough points")
-				return {'CANCELLED'}
-			#Check colinear
-			xValues = [pt[0] for pt in verts]
-			yValues = [pt[1] for pt in verts]
-			if checkEqual(xValues) or checkEqual(yValues):
-				self.report({'ERROR'}, "Points are colinear")
-				return {'CANCELLED'}
-			#Triangulate
-			log.info("Triangulate {} points...".format(nVerts))
-			vertsPts = [Point(vert[0], vert[1], vert[2]) for vert in verts]
-			faces = computeDelaunayTriangulation(vertsPts)
-			faces = [tuple(reversed(tri)) for tri in faces]#reverse point order --> if all triangles are specified anticlockwise then all faces up
-			log.info("Getting {} triangles".format(len(faces)))
-			#Create new mesh structure
-			log.info("Create mesh...")
-			tinMesh = bpy.data.meshes.new("TIN") #create a new mesh
-			tinMesh.from_pydata(verts, [], faces) #Fill the mesh with triangles
-			tinMesh.update(calc_edges=True) #Update mesh with new data
 
 		#Create an object with that mesh
 		tinObj = bpy.data.objects.new("TIN", tinMesh)
@@ -165,10 +152,7 @@ class OBJECT_OT_tesselation_voronoi(bpy.types.Operator):
 		r = obj.rotation_euler
 		s = obj.scale
 		mesh = obj.data
-		vertsPts = [vertex.co for vertex in mesh.vertices]
-		#Remove duplicate
-		verts = [[vert.x, vert.y, vert.z] for vert in vertsPts]
-		nDupli, nZcolinear = unique(verts)
+		verts, nDupli, nZcolinear = unique(getVerts(mesh))
 		nVerts = len(verts)
 		log.info("{} duplicates points ignored".format(nDupli))
 		log.info("{} z colinear points excluded".format(nZcolinear))
@@ -176,30 +160,25 @@ class OBJECT_OT_tesselation_voronoi(bpy.types.Operator):
 			self.report({'ERROR'}, "Not enough points")
 			return {'CANCELLED'}
 		#Check colinear
-		xValues = [pt[0] for pt in verts]
-		yValues = [pt[1] for pt in verts]
-		if checkEqual(xValues) or checkEqual(yValues):
+		if isColinear(verts):
 			self.report({'ERROR'}, "Points are colinear")
 			return {'CANCELLED'}
 		#Create diagram
 		log.info("Tesselation... ({} points)".format(nVerts))
 		xbuff, ybuff = 5, 5 # %
 		zPosition = 0
-		vertsPts = [Point(vert[0], vert[1], vert[2]) for vert in verts]
 		if self.meshType == "Edges":
-			pts, edgesIdx = computeVoronoiDiagram(vertsPts, xbuff, ybuff, polygonsOutput=False, formatOutput=True)
+			pts, edgesIdx = voronoiArrays(verts, xbuff, ybuff, polygonsOutput=False)
 		else:
-			pts, polyIdx = computeVoronoiDiagram(vertsPts, xbuff, ybuff, polygonsOutput=True, formatOutput=True, closePoly=False)
+			pts, polyIdx, polyStarts, sites = voronoiArrays(verts, xbuff, ybuff, polygonsOutput=True, closePoly=False)
 		#
-		pts = [[pt[0], pt[1], zPosition] for pt in pts]
+		pts = np.column_stack((pts, np.full(len(pts), zPosition)))
 		#Create new mesh structure
 		log.info("Create mesh...")
-		voronoiDiagram = bpy.data.meshes.new("VoronoiDiagram") #create a new mesh
 		if self.meshType == "Edges":
-			voronoiDiagram.from_pydata(pts, edgesIdx, []) #Fill the mesh with triangles
+			voronoiDiagram = meshFromArrays("VoronoiDiagram", pts, edges=edgesIdx)
 		else:
-			voronoiDiagram.from_pydata(pts, [], list(polyIdx.values())) #Fill the mesh with triangles
-		voronoiDiagram.update(calc_edges=True) #Update mesh with new data
+			voronoiDiagram = meshFromArrays("VoronoiDiagram", pts, polyIdx, polyStarts)
 		#create an object with that mesh
 		voronoiObj = bpy.data.objects.new("VoronoiDiagram", voronoiDiagram)
 		#place object
@@ -216,7 +195,7 @@ class OBJECT_OT_tesselation_voronoi(bpy.types.Operator):
 		if self.meshType == "Edges":
 			self.report({'INFO'}, "{} edges created in {} seconds".format(len(edgesIdx), t))
 		else:
-			self.report({'INFO'}, "{} polygons created in {} seconds".format(len(polyIdx), t))
+			self.report({'INFO'}, "{} polygons created in {} seconds".format(len(polyStarts), t))
 		return {'FINISHED'}
 
 classes = [
@@ -2,12 +2,15 @@ import bpy
 from bpy.types import Operator
 from bpy.props import IntProperty
 
-from math import cos, sin, radians, sqrt
+from math import cos, sin, radians
 from mathutils import Vector
+import numpy as np
 
 import logging
 log = logging.getLogger(__name__)
 
+from .utils import getMeshCoords, setMeshCoords
+
 
 def lonlat2xyz(R, lon, lat):
 	lon, lat = radians(lon), radians(lat)
@@ -16,6 +19,17 @@ def lonlat2xyz(R, lon, lat):
 	z = R *sin(lat)
 	return Vector((x, y, z))
 
+def lonlat2xyzArray(R, lon, lat):
+	'''Same as lonlat2xyz for arrays of longitudes and latitudes, return a (n,3) array'''
+	lon, lat = np.radians(lon), np.radians(lat)
+	cosLat = np.cos(lat)
+	return np.column_stack((R * cosLat * np.cos(lon), R * cosLat * np.sin(lon), R * np.sin(lat)))
+
+def earthSphere(obj, radius=100):
+	'''Transform a mesh object whose world xy coordinates are longitudes and latitudes to a sphere'''
+	co = getMeshCoords(obj)
+	setMeshCoords(obj, lonlat2xyzArray(radius, co[:,0], co[:,1]))
+
 
 class OBJECT_OT_earth_sphere(Operator):
 	bl_idname = "earth.sphere"
@@ -46,20 +60,23 @@ class OBJECT_OT_earth_sphere(Operator):
 				log.warning("Latitude of object {} exceed 180°".format(obj.name))
 				continue
 
-			mesh = obj.data
-			m = obj.matrix_world
-			for vertex in mesh.vertices:
-				co = m @ vertex.co
-				lon, lat = co.x, co.y
-				vertex.co = m.inverted() @ lonlat2xyz(self.radius, lon, lat)
+			earthSphere(obj, self.radius)
 
 		return {'FINISHED'}
 
 EARTH_RADIUS = 6378137 #meters
 def getZDelta(d):
-	'''delta value for adjusting z across earth curvature
+	'''delta value for adjusting z across earth curvature, d can be a numpy array of distances
 	http://webhelp.infovista.com/Planet/62/Subsystems/Raster/Content/help/analysis/viewshedanalysis.html'''
-	return sqrt(EARTH_RADIUS**2 + d**2) - EARTH_RADIUS
+	#sqrt(R**2 + d**2) - R rewritten to avoid the loss of precision of subtracting two close large numbers
+	return d**2 / (np.sqrt(EARTH_RADIUS**2 + d**2) + EARTH_RADIUS)
+
+def earthCurvature(obj, viewpoint=(0, 0)):
+	'''Lower the vertices of a mesh object according to their horizontal distance (in world space) from the viewpoint'''
+	co = getMeshCoords(obj)
+	d = np.hypot(co[:,0] - viewpoint[0], co[:,1] - viewpoint[1])
+	co[:,2] -= getZDelta(d)
+	setMeshCoords(obj, co)
 
 
 class OBJECT_OT_earth_curvature(Operator):
@@ -80,12 +97,7 @@ class OBJECT_OT_earth_curvature(Operator):
 			self.report({'INFO'}, "Selection isn't a mesh")
 			return {'CANCELLED'}
 
-		mesh = obj.data
-		viewpt = scn.cursor.location
-
-		for vertex in mesh.vertices:
-			d = (viewpt.xy - vertex.co.xy).length
-			vertex.co.z = vertex.co.z - getZDelta(d)
+		earthCurvature(obj, scn.cursor.location.xy)
 
 		return {'FINISHED'}
 
@@ -2,9 +2,9 @@
 
 import os
 import math
+import numpy as np
 
 import bpy
-from mathutils import Vector
 
 from bpy.props import StringProperty, IntProperty, FloatProperty, BoolProperty, EnumProperty, CollectionProperty, FloatVectorProperty
 from bpy.types import PropertyGroup, UIList, Panel, Operator
@@ -18,7 +18,7 @@ from .utils import getBBOX
 from ..core.utils.gradient import Color, Stop, Gradient
 
 from ..core.maths.interpo import scale
-from ..core.maths.kmeans1D import kmeans1d, getBreaks
+from ..core.maths.kmeans1D import getNaturalBreaks
 #from ..core.maths.jenks_caspall import jenksCaspall
 
 #Folder containing SVG gradients
@@ -429,7 +429,7 @@ def clearRamp(stops, startColor=(0,0,0,1), endColor=(1,1,1,1), startPos=0, endPo
 	return (first, last)
 
 def getValues():
-	'''Return mesh data values (z, slope or az) for classification'''
+	'''Return a sorted numpy array of mesh data values (z, slope or az) for classification'''
 	scn = bpy.context.scene
 	obj = bpy.context.view_layer.objects.active
 	#make a temp mesh with modifiers apply
@@ -438,30 +438,28 @@ def getValues():
 	#
 	mode = scn.analysisMode
 	if mode == 'HEIGHT':
-		values = [vertex.co.z for vertex in mesh.vertices]
-	elif mode == 'SLOPE':
-		z = Vector((0,0,1))
-		m = obj.matrix_world
-		values =  [math.degrees(z.angle(m * face.normal)) for face in mesh.polygons]
-	elif mode == 'ASPECT':
-		y = Vector((0,1,0))
-		m = obj.matrix_world
-		#values =  [math.degrees(y.angle(m * face.normal)) for face in mesh.polygons]
-		values = []
-		for face in mesh.polygons:
-			normal = face.normal.copy()
-			normal.z = 0 #project vector into XY plane
-			try:
-				a = math.degrees(y.angle(m * normal))
-			except ValueError:
-				pass#zero length vector as no angle
-			else:
-				#returned angle is between 0° (north) to 180° (south)
-				#we must correct it to get angle between 0 to 360°
-				if normal.x <0:
-					a = 360 - a
-				values.append(a)
-	values.sort()
+		co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+		mesh.vertices.foreach_get('co', co)
+		values = co[2::3]
+	else:
+		#world space normals since the mesh has been transformed
+		normals = np.empty(len(mesh.polygons) * 3, dtype=np.float64)
+		mesh.polygons.foreach_get('normal', normals)
+		nx, ny, nz = normals.reshape(-1, 3).T
+		if mode == 'SLOPE':
+			#angle between the normal and the z axis
+			length = np.sqrt(nx**2 + ny**2 + nz**2)
+			values = np.degrees(np.arccos(np.clip(nz / length, -1, 1)))
+		elif mode == 'ASPECT':
+			#angle between the normal projected into XY plane and the y axis
+			length = np.hypot(nx, ny)
+			valid = length > 0 #zero length vector as no angle
+			nx, ny, length = nx[valid], ny[valid], length[valid]
+			values = np.degrees(np.arccos(np.clip(ny / length, -1, 1)))
+			#returned angle is between 0° (north) to 180° (south)
+			#we must correct it to get angle between 0 to 360°
+			values = np.where(nx < 0, 360 - values, values)
+	values = np.sort(values)
 	#remove temp mesh
 	obj.to_mesh_clear()
 
@@ -482,6 +480,7 @@ class RECLASS_OT_auto(Operator):
 			('TARGET_STEP', 'Target interval value', "Define target step value that stops will match"),
 			('QUANTILE', 'Quantile', 'Assigns the same number of data values to each class.'),
 			('1DKMEANS', 'Natural breaks', 'kmeans clustering optimized for one dimensional data'),
+			('JENKS', 'Natural breaks (Jenks)', 'Jenks optimization computed over an histogram of the values'),
 			('ASPECT', 'Aspect reclassification', "Value define the number of azimuth")]
 			)
 	color1: FloatVectorProperty(name="Start color", subtype='COLOR', min=0, max=1, size=4)
@@ -605,7 +604,7 @@ class RECLASS_OT_auto(Operator):
 					previousVal = val
 				cumulative_q += q
 
-		if self.autoReclassMode == '1DKMEANS':
+		if self.autoReclassMode in ['1DKMEANS', 'JENKS']:
 			nbClasses = self.value
 			values = getValues()
 			if nbClasses >= 32:
@@ -618,8 +617,11 @@ class RECLASS_OT_auto(Operator):
 			#compute clusters
 			#clusters = jenksCaspall(values, nbClasses, 4)
 			#for val in clusters.breaks:
-			clusters = kmeans1d(values, nbClasses)
-			for val in getBreaks(values, clusters):
+			if self.autoReclassMode == '1DKMEANS':
+				breaks = getNaturalBreaks(values, nbClasses, method='KMEANS')
+			else:
+				breaks = getNaturalBreaks(values, nbClasses, method='JENKS')
+			for val in breaks:
 				position = scale(val, inMin, inMax, 0, 1)
 				stop = stops.new(position)
 
@@ -743,8 +745,9 @@ class RECLASS_OT_quick_gradient(Operator):
 			minPos, maxPos = stops[0].position, stops[-1].position
 			colorRamp.rescale(minPos, maxPos)
 		#update colors
-		for stop in stops:
-			stop.color = colorRamp.evaluate(stop.position, self.colorSpace, self.method).rgba
+		colors = colorRamp.evaluate_array(np.array([stop.position for stop in stops]), self.colorSpace, self.method)
+		for stop, color in zip(stops, colors.tolist()):
+			stop.color = color
 		#
 		if self.colorSpace == 'HSV':
 			cr.color_mode = 'HSV'
@@ -860,8 +863,9 @@ class RECLASS_OT_svg_gradient(Operator):
 			minPos, maxPos = stops[0].position, stops[-1].position
 			colorRamp.rescale(minPos, maxPos)
 		#update colors
-		for stop in stops:
-			stop.color = colorRamp.evaluate(stop.position, self.colorSpace, self.method).rgba
+		colors = colorRamp.evaluate_array(np.array([stop.position for stop in stops]), self.colorSpace, self.method)
+		for stop, color in zip(stops, colors.tolist()):
+			stop.color = color
 		#
 		if self.colorSpace == 'HSV':
 			cr.color_mode = 'HSV'
@@ -22,9 +22,9 @@ import logging
 log = logging.getLogger(__name__)
 
 import bpy
-import bmesh
+import numpy as np
 
-from .utils import DropToGround, getBBOX
+from .utils import DropToGround, getMeshCoords
 
 from mathutils import Vector, Matrix
 from bpy.types import Operator
@@ -41,21 +41,73 @@ def get_align_matrix(location, normal):
     return mat_align
 
 def get_lowest_world_co(ob, mat_parent=None):
-    bme = bmesh.new()
-    bme.from_mesh(ob.data)
+    """Lowest world space point of a mesh object, or of its bounding box for other types of objects"""
     mat_to_world = ob.matrix_world.copy()
     if mat_parent:
         mat_to_world = mat_parent @ mat_to_world
-    lowest = None
-    for v in bme.verts:
-        if not lowest:
-            lowest = v
-        if (mat_to_world @ v.co).z < (mat_to_world @ lowest.co).z:
-            lowest = v
-    lowest_co = mat_to_world @ lowest.co
-    bme.free()
-
-    return lowest_co
+    mat_to_world = np.array([list(row) for row in mat_to_world], dtype=np.float64)
+    if ob.type == 'MESH' and len(ob.data.vertices):
+        co = getMeshCoords(ob, world=False)
+    else:
+        co = np.array([list(corner) for corner in ob.bound_box], dtype=np.float64)
+    co = co @ mat_to_world[:3, :3].T + mat_to_world[:3, 3]
+    return Vector(co[np.argmin(co[:, 2])])
+
+
+def drop_objects(obs, ground, scn, useOrigin=False, align=False, axisAlign='N'):
+    """
+    Drop many objects on the ground object at once.
+    All the drop points are raycasted in one batch against the cached BVH of the ground,
+    then the transforms are applied in a single pass.
+    Return the list of objects that did not hit the ground
+    """
+    rayCaster = DropToGround(scn, ground)
+
+    if useOrigin:
+        minLocs = np.array([list(ob.matrix_world.translation) for ob in obs], dtype=np.float64).reshape(-1, 3)
+    else:
+        minLocs = np.array([list(get_lowest_world_co(ob)) for ob in obs], dtype=np.float64).reshape(-1, 3)
+
+    z, hits, normals = rayCaster.rayCastArray(minLocs[:, 0:2])
+    downs = z - minLocs[:, 2]
+
+    missed = []
+    for ob, minLoc, down, hit, normal in zip(obs, minLocs, downs, hits, normals):
+        if not hit:
+            log.info(ob.name + " did not hit the Active Object")
+            missed.append(ob)
+            continue
+
+        # simple drop down
+        ob.location.z += down
+
+        # drop with align to hit normal
+        if align:
+            hitLoc = Vector((minLoc[0], minLoc[1], minLoc[2] + down))
+            vect = ob.location - hitLoc
+            # rotate object to align with face normal
+            normal = get_align_matrix(hitLoc, Vector(normal))
+            rot = normal.to_euler()
+            if axisAlign == "X":
+                rot.y = 0
+                rot.z = 0
+            elif axisAlign == "Y":
+                rot.x = 0
+                rot.z = 0
+            elif axisAlign == "Z":
+                rot.x = 0
+                rot.y = 0
+            matrix = ob.matrix_world.copy().to_3x3()
+            matrix.rotate(rot)
+            matrix = matrix.to_4x4()
+            ob.matrix_world = matrix
+            # move_object to hit_location
+            ob.location = hitLoc
+            # move object above surface again
+            vect.rotate(rot)
+            ob.location += vect
+
+    return missed
 
 
 class OBJECT_OT_drop_to_ground(Operator):
@@ -106,58 +158,8 @@ class OBJECT_OT_drop_to_ground(Operator):
         if ground in obs:
             obs.remove(ground)
         scn = context.scene
-        rayCaster = DropToGround(scn, ground)
-
-        for ob in obs:
-            if self.useOrigin:
-                minLoc = ob.location
-            else:
-                minLoc = get_lowest_world_co(ob)
-                #minLoc = min([(ob.matrix_world * v.co).z for v in ob.data.vertices])
-                #getBBOX.fromObj(ob).zmin #what xy coords ???
-
-            if not minLoc:
-                msg = "Object {} is of type {} works only with Use Center option " \
-                          "checked".format(ob.name, ob.type)
-                log.info(msg)
-
-            x, y = minLoc.x, minLoc.y
-            hit = rayCaster.rayCast(x, y)
-
-            if not hit.hit:
-                log.info(ob.name + " did not hit the Active Object")
-                continue
-
-            # simple drop down
-            down = hit.loc - minLoc
-            ob.location += down
-            #ob.location = hit.loc
-
-            # drop with align to hit normal
-            if self.align:
-                vect = ob.location - hit.loc
-                # rotate object to align with face normal
-                normal = get_align_matrix(hit.loc, hit.normal)
-                rot = normal.to_euler()
-                if self.axisAlign == "X":
-                    rot.y = 0
-                    rot.z = 0
-                elif self.axisAlign == "Y":
-                    rot.x = 0
-                    rot.z = 0
-                elif self.axisAlign == "Z":
-                    rot.x = 0
-                    rot.y = 0
-                matrix = ob.matrix_world.copy().to_3x3()
-                matrix.rotate(rot)
-                matrix = matrix.to_4x4()
-                ob.matrix_world = matrix
-                # move_object to hit_location
-                ob.location = hit.loc
-                # move object above surface again
-                vect.rotate(rot)
-                ob.location += vect
 
+        drop_objects(obs, ground, scn, useOrigin=self.useOrigin, align=self.align, axisAlign=self.axisAlign)
 
         return {'FINISHED'}
 
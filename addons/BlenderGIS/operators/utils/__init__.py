@@ -1,3 +1,3 @@
-from .bgis_utils import placeObj, adjust3Dview, showTextures, addTexture, getBBOX, DropToGround, mouseTo3d, isTopView
+from .bgis_utils import meshFromArrays, getMeshCoords, setMeshCoords, placeObj, adjust3Dview, showTextures, addTexture, getBBOX, DropToGround, mouseTo3d, isTopView
 from .georaster_utils import rasterExtentToMesh, geoRastUVmap, setDisplacer, bpyGeoRaster, exportAsMesh
-from .delaunay_voronoi import computeVoronoiDiagram, computeDelaunayTriangulation
+from .delaunay_voronoi import computeVoronoiDiagram, computeDelaunayTriangulation, voronoiArrays, delaunayArrays
@@ -1,5 +1,8 @@
 
+import hashlib
+
 import bpy
+import numpy as np
 from mathutils import Vector, Matrix
 from mathutils.bvhtree import BVHTree
 from bpy_extras.view3d_utils import region_2d_to_location_3d, region_2d_to_vector_3d
@@ -25,46 +28,276 @@ def mouseTo3d(context, x, y):
 	return loc
 
 
+class RayCastHit():
+	'''Result of a single ray cast'''
+	def __init__(self, hit, loc, normal=None):
+		self.hit = hit
+		self.loc = loc
+		self.normal = normal
+
+
+def _matrixToArray(m):
+	return np.array([list(row) for row in m], dtype=np.float64)
+
+def _transformPts(m, pts):
+	'''Apply a 4x4 matrix (numpy array) to a (n,3) array of points'''
+	return pts @ m[:3, :3].T + m[:3, 3]
+
+
+class GridTriangles():
+	'''
+	A regular grid mesh (ie a DEM) seen as the triangles Blender renders it with, heights and normals
+	are computed on the triangle under each point so they are the same than a ray cast on the mesh
+	'''
+
+	def __init__(self, x0, y0, dx, dy, z, diag):
+		'''
+		x0, y0 : coords of the lower left vertex
+		dx, dy : grid spacing (positives values)
+		z : 2D array of heights [row, col] with rows ordered from bottom to top
+		diag : 2D boolean array [row, col] of the cells, True if the cell is splitted along
+			its lower left to upper right diagonal, False if splitted along the other one
+		'''
+		self.x0, self.y0, self.dx, self.dy = x0, y0, dx, dy
+		self.z = np.asarray(z, dtype=np.float64)
+		self.diag = np.asarray(diag, dtype=bool)
+
+	@classmethod
+	def fromMesh(cls, co, tris):
+		'''
+		If the vertices form a regular grid and the triangles split each of its cells in two
+		then return a GridTriangles, else return None
+		co : (n,3) vertices coordinates, tris : (m,3) vertices indices of the loop triangles
+		'''
+		if len(co) < 4 or len(tris) == 0:
+			return None
+		xs, ys = np.unique(co[:, 0]), np.unique(co[:, 1])
+		nx, ny = len(xs), len(ys)
+		if nx < 2 or ny < 2 or nx * ny != len(co) or len(tris) != 2 * (nx - 1) * (ny - 1):
+			return None
+		dxs, dys = np.diff(xs), np.diff(ys)
+		if not (np.allclose(dxs, dxs[0], rtol=1e-4) and np.allclose(dys, dys[0], rtol=1e-4)):
+			return None
+		#grid indices of each vertex, all the vertices must be on a different node
+		cols, rows = np.searchsorted(xs, co[:, 0]), np.searchsorted(ys, co[:, 1])
+		z = np.full((ny, nx), np.nan)
+		z[rows, cols] = co[:, 2]
+		if np.isnan(z).any():
+			return None
+		#each triangle must lie in one cell, and the 2 triangles of a cell share the same diagonal
+		tc, tr = cols[tris], rows[tris]
+		c0, r0 = tc.min(axis=1), tr.min(axis=1)
+		if np.any(tc.max(axis=1) - c0 != 1) or np.any(tr.max(axis=1) - r0 != 1):
+			return None
+		hasLowerLeft = np.any((tc == c0[:, None]) & (tr == r0[:, None]), axis=1)
+		hasUpperRight = np.any((tc == c0[:, None] + 1) & (tr == r0[:, None] + 1), axis=1)
+		cells = r0 * (nx - 1) + c0
+		nbCells = (nx - 1) * (ny - 1)
+		nbTris = np.bincount(cells, minlength=nbCells)
+		nbDiag = np.bincount(cells, weights=hasLowerLeft & hasUpperRight, minlength=nbCells)
+		if np.any(nbTris != 2) or np.any((nbDiag != 0) & (nbDiag != 2)):
+			return None
+		diag = (nbDiag == 2).reshape(ny - 1, nx - 1)
+		return cls(float(xs[0]), float(ys[0]), float(xs[-1] - xs[0]) / (nx - 1), float(ys[-1] - ys[0]) / (ny - 1), z, diag)
+
+	def lookup(self, x, y):
+		'''
+		Heights and unit normals of the triangles under x, y arrays of coordinates
+		return (z, hits, normals), z is nan and normal is zero for the points outside the grid
+		'''
+		ny, nx = self.z.shape
+		col, row = (x - self.x0) / self.dx, (y - self.y0) / self.dy
+		hits = (col >= 0) & (col <= nx - 1) & (row >= 0) & (row <= ny - 1)
+		i = np.clip(np.floor(col), 0, nx - 2).astype(int)
+		j = np.clip(np.floor(row), 0, ny - 2).astype(int)
+		u, v = col - i, row - j
+		z00, z10 = self.z[j, i], self.z[j, i+1]
+		z01, z11 = self.z[j+1, i], self.z[j+1, i+1]
+		diag = self.diag[j, i]
+		#lower left to upper right diagonal : triangles (00, 10, 11) and (00, 11, 01)
+		#other diagonal : triangles (00, 10, 01) and (10, 11, 01)
+		lower = np.where(diag, u >= v, u + v <= 1)
+		#slopes along columns and rows of the triangle
+		dzdu = np.where(lower, z10 - z00, z11 - z01)
+		dzdv = np.where(lower == diag, z11 - z10, z01 - z00)
+		#the triangle contains the 00 corner, or the 11 corner for the upper triangle of the other diagonal
+		fromOrigin = diag | lower
+		z = np.where(fromOrigin, z00 + u * dzdu + v * dzdv, z11 - (1 - u) * dzdu - (1 - v) * dzdv)
+		z[~hits] = np.nan
+		normals = np.column_stack((-dzdu / self.dx, -dzdv / self.dy, np.ones(len(z))))
+		normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+		normals[~hits] = 0
+		return z, hits, normals
+
+
 class DropToGround():
-	'''A class to perform raycasting accross z axis'''
+	'''
+	A class to perform raycasting accross z axis
+	method :
+	* 'BVH' (default) use a BVH tree cached at class level and rebuilt only if the ground mesh changes,
+	if the ground mesh is a regular grid (ie a DEM) then heights are directly computed on its triangles
+	* 'OBJ' use Object.ray_cast()
+	'''
 
-	def __init__(self, scn, ground, method='OBJ'):
+	#ground object name >> (mesh signature, bvh tree, grid triangles)
+	_cache = {}
+
+	def __init__(self, scn, ground, method='BVH'):
 		self.method = method # 'BVH' or 'OBJ'
 		self.scn = scn
 		self.ground = ground
 		self.bbox = getBBOX.fromObj(ground, applyTransform=True)
 		self.mw = self.ground.matrix_world
 		self.mwi = self.mw.inverted()
+		self._mw = _matrixToArray(self.mw)
+		self._mwi = _matrixToArray(self.mwi)
+		#matrix used to transform normals to world space
+		self._mwn = np.linalg.inv(self._mw[:3, :3]).T
+		self.grid = None
 		if self.method == 'BVH':
-			self.bvh = BVHTree.FromObject(self.ground, bpy.context.evaluated_depsgraph_get(), deform=True)
+			self._initBVH()
+
+	def _initBVH(self):
+		depsgraph = bpy.context.evaluated_depsgraph_get()
+		mesh = self.ground.evaluated_get(depsgraph).data
+		nbVerts = len(mesh.vertices)
+		co = np.empty(nbVerts * 3, dtype=np.float32)
+		mesh.vertices.foreach_get('co', co)
+		mesh.calc_loop_triangles()
+		tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+		mesh.loop_triangles.foreach_get('vertices', tris)
+		#hashing the data is cheap compared to a BVH rebuild
+		md5 = hashlib.md5(co.tobytes())
+		md5.update(tris.tobytes())
+		signature = (mesh.name_full, nbVerts, len(mesh.polygons), md5.hexdigest())
+
+		#forget the grounds that have been deleted
+		names = {obj.name_full for obj in bpy.data.objects}
+		for name in [name for name in self._cache if name not in names]:
+			del self._cache[name]
+
+		cached = self._cache.get(self.ground.name_full)
+		if cached is not None and cached[0] == signature:
+			_, self.bvh, self.grid = cached
+		else:
+			self.bvh = BVHTree.FromObject(self.ground, depsgraph, deform=True)
+			self.grid = GridTriangles.fromMesh(co.reshape(-1, 3), tris.reshape(-1, 3))
+			self._cache[self.ground.name_full] = (signature, self.bvh, self.grid)
+
+		#grid lookup is along local z axis, so it's only valid if there is no rotation
+		m = self._mw[:3, :3]
+		if self.grid is not None and np.count_nonzero(m - np.diag(np.diag(m))) == 0 and m[2, 2] > 0:
+			self.method = 'GRID'
+
+	def _gridLookup(self, pts):
+		'''Heights on the grid triangles, pts in object space, return (z, hits, normals) in object space'''
+		z, hits, normals = self.grid.lookup(pts[:, 0], pts[:, 1])
+		return np.nan_to_num(z), hits, normals
+
+	def rayCastArray(self, pts):
+		'''
+		Batched ray casting
+		pts : (n,2) array like of xy world coordinates
+		return (z, hits, normals) numpy arrays of shapes (n,), (n,) and (n,3) in world space
+		z is set to zero for points that don't hit the ground
+		'''
+		pts = np.asarray(pts, dtype=np.float64).reshape(-1, 2)
+		n = len(pts)
+		#ray origins in object space
+		orgs = np.column_stack((pts, np.full(n, self.bbox.zmax + 100)))
+		orgs = _transformPts(self._mwi, orgs)
+
+		if self.method == 'GRID':
+			z, hits, normals = self._gridLookup(orgs)
+			locs = orgs.copy()
+			locs[:, 2] = z
+		else:
+			locs = np.zeros((n, 3))
+			normals = np.zeros((n, 3))
+			hits = np.zeros(n, dtype=bool)
+			direction = Vector((0,0,-1)) #down
+			for k, org in enumerate(orgs.tolist()):
+				if self.method == 'OBJ':
+					hit, loc, normal, faceIdx = self.ground.ray_cast(org, direction)
+				else:
+					loc, normal, faceIdx, dst = self.bvh.ray_cast(Vector(org), direction)
+					hit = loc is not None
+				if hit:
+					hits[k] = True
+					locs[k] = loc
+					normals[k] = normal
+
+		#back to world space
+		z = np.where(hits, _transformPts(self._mw, locs)[:, 2], 0)
+		normals = normals @ self._mwn.T
+		lengths = np.linalg.norm(normals, axis=1)
+		normals[hits] /= lengths[hits, np.newaxis]
+		normals[~hits] = (0, 0, 1)
+		return z, hits, normals
 
 	def rayCast(self, x, y):
-		#Hit vector
-		offset = 100
-		orgWldSpace = Vector((x, y, self.bbox.zmax + offset))
-		orgObjSpace = self.mwi @ orgWldSpace
-		direction = Vector((0,0,-1)) #down
-		#build ray cast hit namespace object
-		class RayCastHit(): pass
-		rcHit = RayCastHit()
-		#raycast
-		if self.method == 'OBJ':
-			rcHit.hit, rcHit.loc, rcHit.normal, rcHit.faceIdx = self.ground.ray_cast(orgObjSpace, direction)
-		elif self.method == 'BVH':
-			rcHit.loc, rcHit.normal, rcHit.faceIdx, rcHit.dst = self.bvh.ray_cast(orgObjSpace, direction)
-			if not rcHit.loc:
-				rcHit.hit = False
-			else:
-				rcHit.hit = True
-		#adjust values
-		if not rcHit.hit:
-			#return same original 2d point with z=0
-			rcHit.loc = Vector((orgWldSpace.x, orgWldSpace.y, 0)) #elseZero
+		z, hits, normals = self.rayCastArray([(x, y)])
+		return RayCastHit(bool(hits[0]), Vector((x, y, z[0])), Vector(normals[0]))
+
+
+def getMeshCoords(obj, world=True):
+	'''Get the vertices coordinates of a mesh object as a (n,3) float64 array, in world space or object space'''
+	mesh = obj.data
+	co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+	mesh.vertices.foreach_get('co', co)
+	co = co.reshape(-1, 3)
+	if world:
+		co = _transformPts(_matrixToArray(obj.matrix_world), co)
+	return co
+
+def setMeshCoords(obj, co, world=True):
+	'''Write a (n,3) array of vertices coordinates, given in world space or object space, to a mesh object'''
+	mesh = obj.data
+	co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+	if world:
+		co = _transformPts(np.linalg.inv(_matrixToArray(obj.matrix_world)), co)
+	mesh.vertices.foreach_set('co', co.astype(np.float32).ravel())
+	mesh.update()
+
+
+def meshFromArrays(name, verts, faces=None, faceStarts=None, edges=None):
+	'''
+	Build a new mesh from numpy arrays through foreach_set (much faster than from_pydata with large meshes)
+	verts : (n,3) array of vertices coordinates
+	faces : (m,k) array of vertices indices of polygons with the same number of vertices
+		or 1D array of vertices indices of all the polygons concatenated, in this case faceStarts
+		must be submited and give the index of the first vertex of each polygon
+	edges : (e,2) array of vertices indices of loose edges
+	'''
+	mesh = bpy.data.meshes.new(name)
+
+	verts = np.asarray(verts, dtype=np.float32).reshape(-1, 3)
+	mesh.vertices.add(len(verts))
+	mesh.vertices.foreach_set('co', verts.ravel())
+
+	if edges is not None and len(edges) > 0:
+		edges = np.asarray(edges, dtype=np.int32).reshape(-1, 2)
+		mesh.edges.add(len(edges))
+		mesh.edges.foreach_set('vertices', edges.ravel())
+
+	if faces is not None and len(faces) > 0:
+		faces = np.asarray(faces, dtype=np.int32)
+		loops = faces.ravel()
+		if faceStarts is None:
+			nbFaces, size = faces.shape
+			starts = np.arange(0, nbFaces * size, size, dtype=np.int32)
 		else:
-			rcHit.hit = True
+			starts = np.asarray(faceStarts, dtype=np.int32)
+		totals = np.diff(np.append(starts, len(loops))).astype(np.int32)
+		mesh.loops.add(len(loops))
+		mesh.loops.foreach_set('vertex_index', loops)
+		mesh.polygons.add(len(starts))
+		mesh.polygons.foreach_set('loop_start', starts)
+		mesh.polygons.foreach_set('loop_total', totals)
+
+	mesh.update(calc_edges=True)
+	return mesh
 
-		rcHit.loc = self.mw @ rcHit.loc
-		return rcHit
 
 def placeObj(mesh, objName):
 	'''Build and add a new object from a given mesh'''
@@ -60,10 +60,30 @@
 #		Takes a list of point objects (which must have x and y fields).
 #		Returns a list of 3-tuples: the indices of the points that form a Delaunay triangle.
 #
+# Array based equivalents, backed by scipy (Qhull) when available with this module
+# as fallback, are more suited to large points clouds :
+#
+#	voronoiArrays(points, xBuff, yBuff, polygonsOutput=False, closePoly=True)
+#	delaunayArrays(points)
+#
+# Run this file as a script to benchmark the backends across points counts.
+#
 #############################################################################
 import math
 import sys
 import getopt
+import time
+from collections import namedtuple
+
+import numpy as np
+
+try:
+	from scipy.spatial import Delaunay, Voronoi
+except ImportError:
+	HAS_SCIPY = False
+else:
+	HAS_SCIPY = True
+
 TOLERANCE = 1e-9
 BIG_FLOAT = 1e38
 
@@ -964,5 +984,184 @@ def computeDelaunayTriangulation(points):
 	voronoi(siteList,context)
 	return context.triangles
 
+#------------------------------------------------------------------
+# Array based API
+
+_Point = namedtuple('_Point', ['x', 'y'])
+
+def _toArray(points):
+	'''(n,2) float array from an array like or a list of point objects with x and y fields'''
+	if len(points) and hasattr(points[0], 'x'):
+		return np.array([(pt.x, pt.y) for pt in points], dtype=np.float64)
+	return np.asarray(points, dtype=np.float64).reshape(len(points), -1)[:, 0:2]
+
+def _useScipy(backend):
+	if backend == 'SCIPY' and not HAS_SCIPY:
+		raise ImportError("Scipy is not available")
+	return backend == 'SCIPY' or (backend == 'AUTO' and HAS_SCIPY)
+
+def _ccw(tris, pts):
+	'''flip the triangles that are not counterclockwise so all faces point up'''
+	a, b, c = pts[tris[:,0]], pts[tris[:,1]], pts[tris[:,2]]
+	cross = (b[:,0] - a[:,0]) * (c[:,1] - a[:,1]) - (b[:,1] - a[:,1]) * (c[:,0] - a[:,0])
+	flip = cross < 0
+	tris[flip] = tris[flip][:, ::-1]
+	return tris
+
+def _polygonsArea(verts, polys, starts):
+	'''signed area of polygons given as concatenated vertices indices'''
+	counts = np.diff(np.append(starts, len(polys)))
+	nxt = np.arange(len(polys)) + 1
+	ends = starts + counts
+	nxt[ends - 1] = starts #last vertex of each polygon is linked to the first one
+	p, q = verts[polys], verts[polys[nxt]]
+	cross = p[:,0] * q[:,1] - q[:,0] * p[:,1]
+	return np.add.reduceat(cross, starts) / 2 if len(starts) else np.zeros(0)
+
+def _closePolygons(polys, starts):
+	'''repeat the first vertex index at the end of each polygon'''
+	n = len(starts)
+	counts = np.diff(np.append(starts, len(polys)))
+	out = np.empty(len(polys) + n, dtype=polys.dtype)
+	out[np.arange(len(polys)) + np.repeat(np.arange(n), counts)] = polys
+	newStarts = starts + np.arange(n)
+	out[newStarts + counts] = polys[starts]
+	return out, newStarts
+
+def delaunayArrays(points, backend='AUTO'):
+	'''
+	Delaunay triangulation of a set of 2D points
+	points : (n,2+) array or list of point objects with x and y fields
+	backend : 'AUTO' (scipy if available), 'SCIPY' or 'PYTHON'
+	return a (t,3) int array of counterclockwise triangles vertices indices
+	'''
+	pts = _toArray(points)
+	if _useScipy(backend):
+		tris = Delaunay(pts).simplices.astype(np.int64)
+	else:
+		tris = np.array(computeDelaunayTriangulation([_Point(x, y) for x, y in pts.tolist()]), dtype=np.int64).reshape(-1, 3)
+	return _ccw(tris, pts)
+
+def voronoiArrays(points, xBuff=0, yBuff=0, polygonsOutput=False, closePoly=True, backend='AUTO'):
+	'''
+	Voronoi diagram of a set of 2D points clipped to the points extent expanded by x and y buffers (percentages)
+	points : (n,2+) array or list of point objects with x and y fields
+	backend : 'AUTO' (scipy if available), 'SCIPY' or 'PYTHON'
+	Returns :
+		- if polygonsOutput is False : (verts, edges) a (m,2) array of vertices coordinates and
+		  a (k,2) array of the vertices indices of each edge
+		- if polygonsOutput is True : (verts, polys, polyStarts, sites) with polys the concatenated
+		  vertices indices of all the counterclockwise polygons, polyStarts the index of the first vertex
+		  of each polygon and sites the index of the input point of each polygon.
+		  if closePoly is True, the first vertex of a polygon is repeated at its end
+	'''
+	pts = _toArray(points)
+	if _useScipy(backend):
+		return _scipyVoronoi(pts, xBuff, yBuff, polygonsOutput, closePoly)
+
+	pyPts = [_Point(x, y) for x, y in pts.tolist()]
+	if not polygonsOutput:
+		verts, edgesIdx = computeVoronoiDiagram(pyPts, xBuff, yBuff, polygonsOutput=False, formatOutput=True)
+		return np.array(verts, dtype=np.float64).reshape(-1, 2), np.array(edgesIdx, dtype=np.int64).reshape(-1, 2)
+	verts, polyIdx = computeVoronoiDiagram(pyPts, xBuff, yBuff, polygonsOutput=True, formatOutput=True, closePoly=False)
+	verts = np.array(verts, dtype=np.float64).reshape(-1, 2)
+	sites = np.array(list(polyIdx.keys()), dtype=np.int64)
+	counts = np.array([len(poly) for poly in polyIdx.values()], dtype=np.int64)
+	polys = np.fromiter((i for poly in polyIdx.values() for i in poly), dtype=np.int64, count=counts.sum())
+	starts = np.cumsum(counts) - counts
+	return _finalizePolygons(verts, polys, starts, sites, closePoly)
+
+def _finalizePolygons(verts, polys, starts, sites, closePoly):
+	cw = _polygonsArea(verts, polys, starts) < 0
+	if cw.any():
+		#reverse the vertices order of clockwise polygons
+		counts = np.diff(np.append(starts, len(polys)))
+		featIdx = np.repeat(np.arange(len(starts)), counts)
+		rank = np.arange(len(polys)) - starts[featIdx]
+		rev = np.where(cw[featIdx], starts[featIdx] + counts[featIdx] - 1 - rank, np.arange(len(polys)))
+		polys = polys[rev]
+	if closePoly:
+		polys, starts = _closePolygons(polys, starts)
+	return verts, polys, starts, sites
+
+def _scipyVoronoi(pts, xBuff, yBuff, polygonsOutput, closePoly):
+	'''
+	Bounded Voronoi diagram : the points near the clip extent are mirrored accross its sides
+	so the cells of the input points are exactly closed by the extent borders.
+	Inside the extent a mirrored point is never closer than its original, so mirroring only
+	a band of points is enough as long as all the cells end up inside the extent. The band is
+	widened until this is the case, in the worst case all the points are mirrored
+	'''
+	n = len(pts)
+	xmin, ymin = pts.min(axis=0)
+	xmax, ymax = pts.max(axis=0)
+	w, h = xmax - xmin, ymax - ymin
+	xmin, xmax = xmin - w * xBuff / 100, xmax + w * xBuff / 100
+	ymin, ymax = ymin - h * yBuff / 100, ymax + h * yBuff / 100
+	size = max(xmax - xmin, ymax - ymin)
+	#points lying on the extent would be mirrored on themselves, mirror them accross a slightly larger extent
+	eps = size * 1e-9
+	tol = size * 1e-7
+	x, y = pts[:,0], pts[:,1]
+	dist = np.column_stack((x - xmin, xmax - x, y - ymin, ymax - y)) #distance to each side
+	band = max(w * xBuff, h * yBuff) / 100 + 4 * math.sqrt((xmax - xmin) * (ymax - ymin) / n)
+
+	while True:
+		sel = dist <= band
+		mirrors = [
+			np.column_stack((2 * (xmin - eps) - x[sel[:,0]], y[sel[:,0]])),
+			np.column_stack((2 * (xmax + eps) - x[sel[:,1]], y[sel[:,1]])),
+			np.column_stack((x[sel[:,2]], 2 * (ymin - eps) - y[sel[:,2]])),
+			np.column_stack((x[sel[:,3]], 2 * (ymax + eps) - y[sel[:,3]]))
+		]
+		vor = Voronoi(np.vstack([pts] + mirrors))
+		regions = [vor.regions[r] for r in vor.point_region[:n].tolist()]
+		counts = np.fromiter((len(r) for r in regions), dtype=np.int64, count=n)
+		polys = np.fromiter((i for r in regions for i in r), dtype=np.int64, count=counts.sum())
+		if sel.all():
+			break
+		if not (polys < 0).any():
+			v = vor.vertices[polys]
+			if v[:,0].min() >= xmin - tol and v[:,0].max() <= xmax + tol and v[:,1].min() >= ymin - tol and v[:,1].max() <= ymax + tol:
+				break
+		band *= 2
+
+	if not polygonsOutput:
+		ridgePts = vor.ridge_points
+		inner = (ridgePts[:,0] < n) & (ridgePts[:,1] < n)
+		edges = np.asarray(vor.ridge_vertices, dtype=np.int64)[inner]
+		used, edges = np.unique(edges, return_inverse=True)
+		verts = vor.vertices[used]
+		np.clip(verts[:,0], xmin, xmax, out=verts[:,0])
+		np.clip(verts[:,1], ymin, ymax, out=verts[:,1])
+		return verts, edges.reshape(-1, 2)
+
+	starts = np.cumsum(counts) - counts
+	used, polys = np.unique(polys, return_inverse=True)
+	verts = vor.vertices[used]
+	np.clip(verts[:,0], xmin, xmax, out=verts[:,0])
+	np.clip(verts[:,1], ymin, ymax, out=verts[:,1])
+	return _finalizePolygons(verts, polys.ravel(), starts, np.arange(n), closePoly)
+
+
 #-----------------------------------------------------------------------------
-#if __name__=="__main__":
+def benchmark(counts=(100, 1000, 10000, 100000), pythonMaxCount=10000):
+	'''Compare the scipy and pure python backends on random points clouds'''
+	rng = np.random.default_rng(0)
+	backends = ['PYTHON'] + (['SCIPY'] if HAS_SCIPY else [])
+	print('{:>10} {:>8} {:>12} {:>12} {:>12}'.format('points', 'backend', 'delaunay', 'voronoi', 'polygons'))
+	for count in counts:
+		pts = rng.uniform(0, 1000, (count, 2))
+		for backend in backends:
+			if backend == 'PYTHON' and count > pythonMaxCount:
+				continue
+			times = []
+			for func, kwargs in ((delaunayArrays, {}), (voronoiArrays, {'xBuff':5, 'yBuff':5}), (voronoiArrays, {'xBuff':5, 'yBuff':5, 'polygonsOutput':True})):
+				t0 = time.perf_counter()
+				func(pts, backend=backend, **kwargs)
+				times.append(time.perf_counter() - t0)
+			print('{:>10} {:>8} {:>11.3f}s {:>11.3f}s {:>11.3f}s'.format(count, backend, *times))
+
+
+if __name__ == "__main__":
+	benchmark()
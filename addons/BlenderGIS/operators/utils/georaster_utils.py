@@ -20,6 +20,8 @@
 #  ***** GPL LICENSE BLOCK *****
 
 import os
+import json
+import hashlib
 import numpy as np
 import bpy, bmesh
 import math
@@ -28,11 +30,18 @@ import logging
 log = logging.getLogger(__name__)
 
 from ...core.georaster import GeoRaster
+from ...core.checkdeps import HAS_GDAL
+from ...core import settings
+from .bgis_utils import meshFromArrays
 
 
-def _exportAsMesh(georaster, dx=0, dy=0, step=1, buildFaces=True, flat=False, subset=False, reproj=None):
-	'''Numpy test'''
-
+def exportAsMesh(georaster, dx=0, dy=0, step=1, buildFaces=True, subset=False, reproj=None, flat=False):
+	'''
+	Build a mesh from the raster grid, one vertex per pixel center (every step pixels)
+	All the computations are done with numpy arrays: vertices coordinates are built with a meshgrid and
+	reprojected in one batch, nodata pixels are filtered with a mask and faces indices are
+	computed with array slicing. The mesh is then filled through foreach_set
+	'''
 	if subset and georaster.subBoxGeo is None:
 		subset = False
 
@@ -45,96 +54,55 @@ def _exportAsMesh(georaster, dx=0, dy=0, step=1, buildFaces=True, flat=False, su
 	pxSizeX, pxSizeY = georef.pxSize.x, georef.pxSize.y
 	w, h = georef.rSize.x, georef.rSize.y
 
-	#adjust against step
-	w, h = math.ceil(w/step), math.ceil(h/step)
-	pxSizeX, pxSizeY = pxSizeX * step, pxSizeY * step
+	#pixels used as vertices
+	cols = np.arange(0, w, step)
+	rows = np.arange(0, h, step)
+	nx, ny = len(cols), len(rows)
 
-	x = np.array([(x0 + (pxSizeX * i)) - dx for i in range(0, w)])
-	y = np.array([(y0 + (pxSizeY * i)) - dy for i in range(0, h)])
-	xx, yy = np.meshgrid(x, y)
-	#TODO reproj
-
-	if flat:
-		zz = np.zeros((h, w))
-	else:
-		zz = georaster.readAsNpArray(subset=subset).data[::step,::step] #TODO raise error if multiband
-
-	verts = np.column_stack((xx.ravel(), yy.ravel(), zz.ravel()))
-	if buildFaces:
-		faces = [(x+y*w, x+y*w+1, x+y*w+1+w, x+y*w+w) for x in range(0, w-1) for y in range(0, h-1)]
-	else:
-		faces = []
-	mesh = bpy.data.meshes.new("DEM")
-	mesh.from_pydata(verts, [], faces)
-	mesh.update()
-	return mesh
+	xx, yy = np.meshgrid(x0 + pxSizeX * cols, y0 + pxSizeY * rows)
+	pts = np.column_stack((xx.ravel(), yy.ravel()))
 
+	if reproj is not None:
+		pts = reproj.pts_array(pts)
 
-def exportAsMesh(georaster, dx=0, dy=0, step=1, buildFaces=True, subset=False, reproj=None, flat=False):
-	if subset and georaster.subBoxGeo is None:
-		subset = False
+	#shift
+	pts[:,0] -= dx
+	pts[:,1] -= dy
 
-	if not subset:
-		georef = georaster.georef
+	if flat:
+		zz = np.zeros(nx * ny)
+		valid = np.ones(nx * ny, dtype=bool)
 	else:
-		georef = georaster.getSubBoxGeoRef()
-
-	if not flat:
 		img = georaster.readAsNpArray(subset=subset)
 		#TODO raise error if multiband
-		data = img.data
-
-	x0, y0 = georef.origin #pxcenter
-	pxSizeX, pxSizeY = georef.pxSize.x, georef.pxSize.y
-	w, h = georef.rSize.x, georef.rSize.y
-
-	#Build the mesh (Note : avoid using bmesh because it's very slow with large mesh, use from_pydata instead)
-	verts = []
-	faces = []
-	nodata = []
-	idxMap = {}
-	for py in range(0, h, step):
-		for px in range(0, w, step):
-			x = x0 + (pxSizeX * px)
-			y = y0 + (pxSizeY * py)
-
-			if reproj is not None:
-				x, y = reproj.pt(x, y)
-
-			#shift
-			x -= dx
-			y -= dy
-
-			if flat:
-				z = 0
-			else:
-				z = data[py, px]
-
-			#vertex index
-			v1 = px + py * w #bottom right
+		data = img.data[::step, ::step]
+		zz = np.ma.getdata(data).ravel()
+		#Filter nodata
+		valid = ~np.ma.getmaskarray(data).ravel()
+		if georaster.noData is not None:
+			valid &= zz != georaster.noData
+
+	verts = np.column_stack((pts, zz))[valid]
+
+	#map grid index to vertex index (-1 for nodata)
+	idxMap = np.full(nx * ny, -1, dtype=np.int64)
+	idxMap[valid] = np.arange(len(verts))
+	idxMap = idxMap.reshape(ny, nx)
+
+	if buildFaces and nx > 1 and ny > 1:
+		#faces from topright to bottomright, anticlockwise --> face up
+		faces = np.stack((
+			idxMap[:-1, 1:], #topright
+			idxMap[:-1, :-1], #topleft
+			idxMap[1:, :-1], #bottomleft
+			idxMap[1:, 1:] #bottomright
+			), axis=-1).reshape(-1, 4)
+		#keep only faces without nodata vertex
+		faces = faces[np.all(faces >= 0, axis=1)]
+	else:
+		faces = None
 
-			#Filter nodata
-			if z == georaster.noData:
-				nodata.append(v1)
-			else:
-				verts.append((x, y, z))
-				idxMap[v1] = len(verts) - 1
-
-				#build face from bottomright to topright (using only points already created)
-				if buildFaces and px > 0 and py > 0: #filter first row and column
-					v2 = v1 - step #bottom left
-					v3 = v2 - w * step #topleft
-					v4 = v3 + step #topright
-					f = [v4, v3, v2, v1] #anticlockwise --> face up
-					if not any(v in f for v in nodata): #TODO too slow ?
-						f = [idxMap[v] for v in f]
-						faces.append(f)
-
-	mesh = bpy.data.meshes.new("DEM")
-	mesh.from_pydata(verts, [], faces)
-	mesh.update()
-
-	return mesh
+	return meshFromArrays("DEM", verts, faces)
 
 
 def rasterExtentToMesh(name, rast, dx, dy, pxLoc='CORNER', reproj=None, subdivise=False):
@@ -215,6 +183,9 @@ def setDisplacer(obj, rast, uvTxtLayer, mid=0, interpolation=False):
 
 #########################################
 
+#bump this version to invalidate derived rasters written by previous processing code
+DERIVED_VERSION = 1
+
 class bpyGeoRaster(GeoRaster):
 
 	def __init__(self, path, subBoxGeo=None, useGDAL=False, clip=False, fillNodata=False, raw=False):
@@ -232,23 +203,29 @@ class bpyGeoRaster(GeoRaster):
 		or fillNodata \
 		or self.ddtype == 'int16':
 
-			#Open the raster as numpy array (read only a subset if we want to clip it)
-			if clip:
-				img = self.readAsNpArray(subset=True)
+			#the derived file name is keyed on the source and the processing options
+			#so a previous import of the same raster can be reused as is
+			filepath = self._getDerivedPath(clip, fillNodata)
+
+			if os.path.isfile(filepath):
+				log.info('Reuse derived raster {}'.format(filepath))
 			else:
-				img = self.readAsNpArray()
+				#Open the raster as numpy array (read only a subset if we want to clip it)
+				if clip:
+					img = self.readAsNpArray(subset=True)
+				else:
+					img = self.readAsNpArray()
 
-			#always cast to float because it's the more convenient datatype for displace texture
-			#(will not be normalized from 0.0 to 1.0 in Blender)
-			img.cast2float()
+				#always cast to float because it's the more convenient datatype for displace texture
+				#(will not be normalized from 0.0 to 1.0 in Blender)
+				img.cast2float()
 
-			#replace nodata with interpolated values
-			if fillNodata:
-				img.fillNodata()
+				#replace nodata with interpolated values
+				if fillNodata:
+					img.fillNodata()
 
-			#save to a new tiff file on disk
-			filepath = os.path.splitext(self.path)[0] + '_bgis.tif'
-			img.save(filepath)
+				#save to a new tiff file on disk
+				self._saveDerived(img, filepath)
 
 			#reinit the parent class
 			GeoRaster.__init__(self, filepath, useGDAL=useGDAL)
@@ -259,6 +236,43 @@ class bpyGeoRaster(GeoRaster):
 		self._load()
 
 
+	def _getDerivedPath(self, clip, fillNodata):
+		'''
+		Path of the float tiff derived from the source raster, named after a hash of
+		the source file signature (path, size, modification time) and the processing options
+		'''
+		st = os.stat(self.path)
+		if clip and self.subBoxGeo is not None:
+			subBox = [self.subBoxPx.xmin, self.subBoxPx.ymin, self.subBoxPx.xmax, self.subBoxPx.ymax]
+		else:
+			subBox = None
+		if fillNodata:
+			#GDAL and numpy inpainting does not give the same result
+			fillMethod = 'GDAL' if HAS_GDAL and settings.img_engine in ['AUTO', 'GDAL'] else 'INPAINT'
+		else:
+			fillMethod = None
+		key = {
+			'version': DERIVED_VERSION,
+			'source': [os.path.abspath(self.path), st.st_size, st.st_mtime_ns],
+			'subBox': subBox,
+			'fillNodata': fillMethod,
+			'dtype': [self.ddtype, 'float32'],
+			'noData': self.noData
+		}
+		key = hashlib.md5(json.dumps(key, sort_keys=True).encode()).hexdigest()[:16]
+		return os.path.splitext(self.path)[0] + '_bgis_' + key + '.tif'
+
+	@staticmethod
+	def _saveDerived(img, filepath):
+		'''Write the image in a temporary file then rename it, a partially written file is never seen as a valid cache'''
+		base = os.path.splitext(filepath)[0]
+		tmpBase = '{}.{}.tmp'.format(base, os.getpid())
+		img.save(tmpBase + '.tif')
+		#NpImage.save() writes the georef in a .wld worldfile, the tif is renamed last because its presence flags a cache hit
+		if os.path.isfile(tmpBase + '.wld'):
+			os.replace(tmpBase + '.wld', base + '.wld')
+		os.replace(tmpBase + '.tif', filepath)
+
 	def _load(self, pack=False):
 		'''Load the georaster in Blender'''
 		try:
@@ -296,8 +310,10 @@ class bpyGeoRaster(GeoRaster):
 			return False
 
 	###############################################
-	# Old methods that use bpy.image.pixels and numpy, keeped here as history
-	# depreciated because bpy is too slow and we need to process the image before load it in Blender
+	# Pixels access through bpy.image.pixels
+	# the buffer is transfered with foreach_get/foreach_set in a single copy, there is no
+	# intermediate python list. Anyway most of the processing should be done before loading
+	# the image in Blender, using readAsNpArray()
 	###############################################
 
 	def toBitDepth(self, a):
@@ -314,6 +330,14 @@ class bpyGeoRaster(GeoRaster):
 		"""
 		return a / (2**self.depth - 1)
 
+	def _getPixelsBuffer(self):
+		'''Copy bpy pixels in a float32 (rows, cols, channels) array, origin is bottom left like in Blender'''
+		w, h = self.bpyImg.size
+		nbBands = self.bpyImg.channels #Blender will return 4 channels even with a one band tiff
+		buff = np.empty(w * h * nbBands, dtype=np.float32)
+		self.bpyImg.pixels.foreach_get(buff) #[r,g,b,a,r,g,b,a,r,g,b,a, ... ] counting from bottom to up and left to right
+		return buff.reshape(h, w, nbBands)
+
 	def getPixelsArray(self, bandIdx=None, subset=False):
 		'''
 		Use bpy to extract pixels values as numpy array
@@ -321,6 +345,8 @@ class bpyGeoRaster(GeoRaster):
 		so to get pixel value at a specified location be careful not confusing axes: data[row, column]
 		It's possible to swap axes if you prefere accessing values with [x,y] indices instead of [y,x]: data.swapaxes(0,1)
 		Array origin is top left
+		With a float raster the returned array is a view on the float32 pixels buffer, flipping the rows,
+		selecting a band or extracting the subset does not copy the data
 		'''
 		if not self.isLoaded:
 			raise IOError("Can read only image opened in Blender")
@@ -328,20 +354,17 @@ class bpyGeoRaster(GeoRaster):
 			raise IOError("Undefined data type")
 		if subset and self.subBoxGeo is None:
 			return None
-		nbBands = self.bpyImg.channels #Blender will return 4 channels even with a one band tiff
-		# Make a first Numpy array in one dimension
-		a = np.array(self.bpyImg.pixels[:])#[r,g,b,a,r,g,b,a,r,g,b,a, ... ] counting from bottom to up and left to right
-		# Regroup rgba values
-		a = a.reshape(len(a)/nbBands, nbBands)#[[r,g,b,a],[r,g,b,a],[r,g,b,a],[r,g,b,a]...]
-		# Build 2 dimensional array (In numpy first dimension represents rows (y) and second dimension represents cols (x))
-		a = a.reshape(self.size.y, self.size.x, nbBands)# [ [[rgba], [rgba]...], [lines2], [lines3]...]
+		a = self._getPixelsBuffer()
 		# Change origin to top left
-		a = np.flipud(a)
-		# Swap axes to access pixels with [x,y] indices instead of [y,x]
-		##a = a.swapaxes(0,1)
+		a = a[::-1]
 		# Extract the requested band
 		if bandIdx is not None:
 			a = a[:,:,bandIdx]
+		if subset:
+			# Get overlay extent (in pixels)
+			subBoxPx = self.subBoxPx
+			# Get subset data (min and max pixel number are both include)
+			a = a[subBoxPx.ymin:subBoxPx.ymax+1, subBoxPx.xmin:subBoxPx.xmax+1] #topleft to bottomright
 		# In blender, non float raster pixels values are normalized from 0.0 to 1.0
 		if not self.isFloat:
 			# Multiply by 2**depth - 1 to get raw values
@@ -349,24 +372,7 @@ class bpyGeoRaster(GeoRaster):
 			# Round the result to nearest int and cast to orginal data type
 			# when cast signed 16 bits dataset, the negatives values are correctly interpreted by numpy
 			a = np.rint(a).astype(self.ddtype)
-			# Get the negatives values from signed int16 raster
-			# This part is no longer needed because previous numpy's cast already did the job
-			'''
-			if self.ddtype == 'int16':
-				#16 bits allows coding values from 0 to 65535 (with 65535 == 2**depth / 2 - 1 )
-				#positives value are coded from 0 to 32767 (from 0.0 to 0.5 in Blender)
-				#negatives values are coded in reverse order from 65535 to 32768 (1.0 to 0.5 in Blender)
-				#corresponding to a range from -1 to -32768
-				a = np.where(a > 32767, -(65536-a), a)
-			'''
-		if not subset:
-			return a
-		else:
-			# Get overlay extent (in pixels)
-			subBoxPx = self.subBoxPx
-			# Get subset data (min and max pixel number are both include)
-			a = a[subBoxPx.ymin:subBoxPx.ymax+1, subBoxPx.xmin:subBoxPx.xmax+1] #topleft to bottomright
-			return a
+		return a
 
 
 	def flattenPixelsArray(self, px):
@@ -375,15 +381,26 @@ class bpyGeoRaster(GeoRaster):
 		[ [[rgba], [rgba]...], [lines2], [lines3]...] >> [r,g,b,a,r,g,b,a,r,g,b,a, ... ]
 		If the submited array contains only one band, then the band will be duplicate
 		and an alpha band will be added to get all rgba values.
+		The result is a float32 array filled in one pass, ready for foreach_set
 		'''
-		shape = px.shape
-		if len(shape) == 2:
-			px = np.expand_dims(px, axis=2)
-			px = np.repeat(px, 3, axis=2)
-			alpha = np.ones(shape)
-			alpha = np.expand_dims(alpha, axis=2)
-			px = np.append(px, alpha, axis=2)
-		#px = px.swapaxes(0,1)
-		px = np.flipud(px)
-		px = px.flatten()
-		return px
+		px = np.asarray(px)
+		if px.ndim == 2:
+			out = np.empty(px.shape + (4,), dtype=np.float32)
+			#write through a flipped view to change origin to bottom left
+			dst = out[::-1]
+			dst[:,:,0:3] = px[:,:,None]
+			dst[:,:,3] = 1
+		else:
+			out = np.empty(px.shape, dtype=np.float32)
+			out[::-1] = px
+		return out.ravel()
+
+	def setPixelsArray(self, px):
+		'''Write a (rows, cols) or (rows, cols, channels) array, origin top left, into the Blender image pixels'''
+		if not self.isLoaded:
+			raise IOError("Can write only image opened in Blender")
+		buff = self.flattenPixelsArray(px)
+		if len(buff) != len(self.bpyImg.pixels):
+			raise ValueError("Pixels array does not match the image size")
+		self.bpyImg.pixels.foreach_set(buff)
+		self.bpyImg.update()
@@ -0,0 +1,259 @@
+import logging
+import importlib
+
+import bpy
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# size in meters of a web mercator pixel at zoom 0, halved at each zoom level
+WEB_MERCATOR_PIXEL_SIZE = 156543.03392804097
+
+
+def lod_steps(zooms):
+    """Size of the cells of each zoom level, in cells of the finest level.
+    Levels are nested grids, each zoom level halves the cell size so a level
+    is `2 ** (zoom difference)` times coarser than the finest one.
+    """
+    top = max(zooms)
+    return [2 ** (top - zoom) for zoom in zooms]
+
+
+def snap_extents(extents, steps):
+    """Snap the (xmin, ymin, xmax, ymax) extents of nested levels, given from
+    the coarsest to the finest and in cells of the finest level, on integer
+    grids so each level exactly covers a block of cells of the level around it.
+
+    Each extent is shrunk to the grid of the enclosing level (which is also a
+    grid of its own level since steps are nested) and clipped to it, keeping
+    at least one cell of the enclosing level on every side. A level then only
+    borders the level around it, whose ring is stitched with its step, never
+    a coarser one which would leave T-junctions.
+    Returns the snapped extents as int tuples, None for levels left empty.
+    """
+    snapped = []
+    outer = None
+    grid = steps[0]
+    for extent, step in zip(extents, steps):
+        xmin, ymin = (int(np.ceil(v / grid)) * grid for v in extent[0:2])
+        xmax, ymax = (int(np.floor(v / grid)) * grid for v in extent[2:4])
+        if outer is not None:
+            xmin, ymin = max(xmin, outer[0] + grid), max(ymin, outer[1] + grid)
+            xmax, ymax = min(xmax, outer[2] - grid), min(ymax, outer[3] - grid)
+        if xmax <= xmin or ymax <= ymin:
+            snapped.append(None)
+            continue
+        outer = (xmin, ymin, xmax, ymax)
+        grid = step
+        snapped.append(outer)
+    return snapped
+
+
+def ring_polygons(extent, step, hole=None, hole_step=None):
+    """Polygons of the grid covering extent with cells of `step`, minus the
+    cells of the hole, everything in integer units of the finest level.
+
+    The cells along the hole border get the vertices of the finer level
+    inserted on their shared edge, so both meshes have exactly the same
+    border vertices and no crack nor T-junction appear between levels.
+
+    Returns (keys, faces, face_starts): the (n, 2) integer coordinates of the
+    vertices, then the polygons as concatenated indices into keys. They are
+    empty when the hole covers the whole extent.
+    """
+    x0, y0, x1, y1 = extent
+    nx, ny = (x1 - x0) // step, (y1 - y0) // step
+    cx, cy = np.meshgrid(np.arange(nx), np.arange(ny))
+    cx, cy = cx.ravel(), cy.ravel()
+    keep = np.ones(len(cx), dtype=bool)
+    polys = []
+
+    if hole is not None:
+        hx0, hy0 = (hole[0] - x0) // step, (hole[1] - y0) // step
+        hx1, hy1 = (hole[2] - x0) // step, (hole[3] - y0) // step
+        in_x = (cx >= hx0) & (cx < hx1)
+        in_y = (cy >= hy0) & (cy < hy1)
+        keep &= ~(in_x & in_y)
+
+        # fine offsets of the vertices inserted along a coarse edge
+        f = step // hole_step
+        inner = np.arange(1, f) * hole_step
+
+        # for each side of the hole: cells touching it, corner after which
+        # the fine vertices go to keep the polygon counter clockwise, and the
+        # coordinates of these vertices along the shared edge
+        sides = [
+            (in_x & (cy == hy0 - 1), 2, lambda i, j: (i + step - inner, np.full(f - 1, j + step))),
+            (in_x & (cy == hy1), 0, lambda i, j: (i + inner, np.full(f - 1, j))),
+            (in_y & (cx == hx0 - 1), 1, lambda i, j: (np.full(f - 1, i + step), j + inner)),
+            (in_y & (cx == hx1), 3, lambda i, j: (np.full(f - 1, i), j + step - inner)),
+        ]
+        for mask, after, edge in sides:
+            if f < 2 or not mask.any():
+                continue
+            keep &= ~mask
+            for i, j in zip(cx[mask] * step + x0, cy[mask] * step + y0):
+                corners = _quad(i, j, step)
+                ex, ey = edge(i, j)
+                poly = np.concatenate((corners[:after + 1], np.column_stack((ex, ey)), corners[after + 1:]))
+                polys.append(poly)
+
+    quads = _quad(cx[keep] * step + x0, cy[keep] * step + y0, step)
+    sizes = np.array([4] * int(keep.sum()) + [len(p) for p in polys], dtype=np.int64)
+    co = np.concatenate([quads.reshape(-1, 2)] + polys) if polys else quads.reshape(-1, 2)
+
+    # merge the corners shared by neighbour polygons into unique vertices
+    keys, faces = np.unique(co, axis=0, return_inverse=True)
+    face_starts = np.cumsum(sizes) - sizes
+    return keys, faces.ravel(), face_starts
+
+
+def _quad(i, j, step):
+    """Counter clockwise corners of the cells whose lower left corners are (i, j)"""
+    i, j = np.asarray(i), np.asarray(j)
+    return np.stack((
+        np.stack((i, j), axis=-1),
+        np.stack((i + step, j), axis=-1),
+        np.stack((i + step, j + step), axis=-1),
+        np.stack((i, j + step), axis=-1),
+    ), axis=-2)
+
+
+def texture_extent(obj):
+    """World (xmin, ymin, xmax, ymax) extent of the image mapped on a mesh
+    with a planar projection, fitted from the uv coordinates of its loops.
+    """
+    mesh = obj.data
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    co = op_utils.getMeshCoords(obj)
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_verts)
+    uv = np.empty(len(mesh.loops) * 2, dtype=np.float32)
+    mesh.uv_layers.active.data.foreach_get('uv', uv)
+    uv = uv.reshape(-1, 2)
+    extent = []
+    for axis in range(2):
+        # u = (x - xmin) / (xmax - xmin)
+        a, b = np.polyfit(co[loop_verts, axis], uv[:, axis], 1)
+        extent.append((-b / a, (1 - b) / a))
+    (xmin, xmax), (ymin, ymax) = extent
+    return xmin, ymin, xmax, ymax
+
+
+def height_sampler(objs):
+    """Return a function sampling the ground heights at (n, 2) world points,
+    objs are given from the finest to the coarsest and the first one hit by a
+    vertical ray gives the height, so finer data always takes precedence.
+    """
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    rays = [op_utils.DropToGround(bpy.context.scene, obj) for obj in objs]
+
+    def sample(pts):
+        z = np.zeros(len(pts))
+        todo = np.ones(len(pts), dtype=bool)
+        for ray in rays:
+            if not todo.any():
+                break
+            hz, hits, _ = ray.rayCastArray(pts[todo])
+            idx = np.flatnonzero(todo)[hits]
+            z[idx] = hz[hits]
+            todo[idx] = False
+        if todo.any():
+            log.warning('%s LOD vertices outside of the terrain', int(todo.sum()))
+        return z
+
+    return sample
+
+
+def build_lod_meshes(levels, sample, cell_size, name='terrain_lod'):
+    """Build the nested ring meshes of a multi resolution terrain.
+
+    levels : list of dicts from the coarsest to the finest zoom level with the
+        `zoom`, the world `extent` covered by the level and the world extent of
+        its texture `tex_extent`, used to compute planar uv coordinates
+    sample : function returning the heights of (n, 2) world points
+    cell_size : size in meters of the cells of the finest level, the grids
+        are aligned on the world origin
+
+    Returns a dict zoom -> mesh, levels that don't fit inside the coarser
+    ones or that are entirely covered by the finer ones are skipped. All the
+    arithmetic happens on integer cell indices so rings boundaries match
+    exactly whatever the zoom gaps between levels.
+    """
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    zooms = [level['zoom'] for level in levels]
+    steps = lod_steps(zooms)
+    extents = [np.asarray(level['extent'], dtype=np.float64) / cell_size for level in levels]
+    snapped = snap_extents(extents, steps)
+
+    kept = [k for k, extent in enumerate(snapped) if extent is not None]
+    for k in set(range(len(levels))) - set(kept):
+        log.warning('LOD level %s does not fit inside the coarser levels, skipping', zooms[k])
+
+    meshes = {}
+    for n, k in enumerate(kept):
+        level = levels[k]
+        hole = hole_step = None
+        if n + 1 < len(kept):
+            hole, hole_step = snapped[kept[n + 1]], steps[kept[n + 1]]
+        keys, faces, face_starts = ring_polygons(snapped[k], steps[k], hole, hole_step)
+        if len(face_starts) == 0:
+            log.warning('LOD level %s is entirely covered by the finer levels, skipping', level['zoom'])
+            continue
+
+        xy = keys * cell_size
+        verts = np.column_stack((xy, sample(xy)))
+        mesh = op_utils.meshFromArrays(f'{name}_{level["zoom"]}', verts, faces, face_starts)
+        log.info('LOD level %s: %s vertices, %s polygons', level['zoom'], len(verts), len(face_starts))
+
+        tex = level.get('tex_extent')
+        if tex is not None:
+            uv = (xy[faces] - tex[0:2]) / (np.asarray(tex[2:4]) - tex[0:2])
+            mesh.uv_layers.new(name='UVMap').data.foreach_set('uv', uv.astype(np.float32).ravel())
+        meshes[level['zoom']] = mesh
+    return meshes
+
+
+def object_extent(obj):
+    """World (xmin, ymin, xmax, ymax) extent of the vertices of a mesh object"""
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    co = op_utils.getMeshCoords(obj)
+    return (*co[:, 0:2].min(axis=0), *co[:, 0:2].max(axis=0))
+
+
+def build_sat_lod(objs, texels_per_cell=16):
+    """Replace the meshes of the sat objects of each zoom level by the nested
+    rings of a multi resolution terrain, heights are sampled from the original
+    meshes and the planar uv mapping of their textures is kept.
+
+    objs : dict zoom -> sat object
+    texels_per_cell : size of the grid cells in pixels of the sat images,
+        cells get twice bigger at each coarser zoom level like the pixels
+    """
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    zooms = sorted(objs)
+    cell_size = WEB_MERCATOR_PIXEL_SIZE / 2 ** max(zooms) * texels_per_cell
+    levels = [{
+        'zoom': zoom,
+        'extent': object_extent(objs[zoom]),
+        'tex_extent': texture_extent(objs[zoom]),
+    } for zoom in zooms]
+
+    # sample everything before any mesh gets replaced
+    sample = height_sampler([objs[zoom] for zoom in reversed(zooms)])
+    meshes = build_lod_meshes(levels, sample, cell_size)
+
+    for zoom, mesh in meshes.items():
+        obj = objs[zoom]
+        old = obj.data
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get('co', co)
+        for mat in old.materials:
+            mesh.materials.append(mat)
+        obj.data = mesh
+        # the ring was built in world space
+        op_utils.setMeshCoords(obj, co)
+        name = old.name
+        bpy.data.meshes.remove(old)
+        mesh.name = name
+    return meshes
@@ -0,0 +1,123 @@
+import os
+import hashlib
+import logging
+import importlib
+import multiprocessing
+
+import bpy
+import numpy as np
+
+from . import settings
+from .scatter_worker import save_npz, prune_cache, scatter_points
+
+log = logging.getLogger(__name__)
+
+SCATTER_CACHE_VERSION = 1
+
+# point attributes written by the set_proximity_vertex_groups geometry nodes, 1 = next to the feature
+PROXIMITY_ATTRIBUTES = ['roads_prox', 'rails_prox', 'buildings_prox']
+
+
+def _point_values(mesh, name):
+    """Per vertex values of a float point attribute of an evaluated mesh, 0
+    where the attribute is missing."""
+    values = np.zeros(len(mesh.vertices), dtype=np.float32)
+    attr = mesh.attributes.get(name)
+    if attr is not None and attr.domain == 'POINT' and attr.data_type == 'FLOAT':
+        attr.data.foreach_get('value', values)
+    else:
+        log.warning('%s: no %s point attribute', mesh.name, name)
+    return values
+
+
+def export_terrain_arrays(obj, cache_dir):
+    """Write the evaluated triangles of a terrain object, in world space, and
+    the proximity values of its vertices into a npz file read by the scatter
+    workers. The file is named after a hash of its content so a terrain that
+    didn't change reuses its cached scatter points, the files of previous
+    versions of the terrain are removed.
+    """
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    try:
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+        mesh.vertices.foreach_get('co', co)
+        m = np.array(obj_eval.matrix_world)
+        co = (co.reshape(-1, 3) @ m[:3, :3].T + m[:3, 3]).astype(np.float32)
+        mesh.calc_loop_triangles()
+        tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', tris)
+        tris = tris.reshape(-1, 3)
+        prox = np.column_stack([_point_values(mesh, name) for name in PROXIMITY_ATTRIBUTES])
+    finally:
+        obj_eval.to_mesh_clear()
+
+    md5 = hashlib.md5()
+    for arr in (co, tris, prox):
+        md5.update(arr.tobytes())
+    key = md5.hexdigest()[:16]
+    path = os.path.join(cache_dir, f'terrain_{obj.name}_{key}.npz')
+    if not os.path.isfile(path):
+        save_npz(path, co=co, tris=tris, prox=prox)
+        prune_cache(cache_dir, f'terrain_{obj.name}_', path)
+    return path, key
+
+
+def bake_scatter(terrains, tree_types, cache_dir=settings.SCATTER_CACHE_DIR,
+                 workers=settings.SCATTER_WORKERS, seed=666):
+    """Compute the scatter points of every (zoom, vegetation type) pair in
+    parallel worker processes, skipping the pairs already in the cache.
+    Workers are spawned rather than forked from Blender, with workers <= 1
+    everything runs in the current process.
+
+    terrains : dict zoom -> terrain object
+    tree_types : dict type name -> params with `id`, `dist_min`,
+        `density_max` and `density_factor`
+    Returns a dict (zoom, type name) -> path of the point cloud npz file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = {}
+    jobs = []
+    for zoom, obj in terrains.items():
+        terrain_path, terrain_key = export_terrain_arrays(obj, cache_dir)
+        for type_name, params in tree_types.items():
+            args = (params['dist_min'], params['density_max'], params['density_factor'],
+                    params['id'], [seed, zoom, params['id']])
+            key = hashlib.md5(repr((SCATTER_CACHE_VERSION, terrain_key, args)).encode()).hexdigest()[:16]
+            path = os.path.join(cache_dir, f'points_{zoom}_{type_name}_{key}.npz')
+            paths[zoom, type_name] = path
+            if not os.path.isfile(path):
+                jobs.append((terrain_path, path) + args)
+                prune_cache(cache_dir, f'points_{zoom}_{type_name}_', path)
+
+    log.info('scattering %s point clouds, %s cached', len(jobs), len(paths) - len(jobs))
+    if workers <= 1:
+        for job in jobs:
+            scatter_points(*job)
+    elif jobs:
+        with multiprocessing.get_context('spawn').Pool(min(workers, len(jobs))) as pool:
+            pool.starmap(scatter_points, jobs)
+    return paths
+
+
+def point_cloud_object(name, path, collection=None):
+    """Create a vertex only object from a cached point cloud, with the
+    scatter_point_normal, scatter_point_rot and scatter_point_ID point
+    attributes read by the SpawnInstances geometry nodes.
+    """
+    op_utils = importlib.import_module('BlenderGIS.operators.utils')
+    with np.load(path) as data:
+        points, normals = data['points'], data['normals']
+        rotations, ids = data['rotations'], data['ids']
+    mesh = op_utils.meshFromArrays(name, points)
+    for attr_name, data_type, prop, values in (
+        ('scatter_point_normal', 'FLOAT_VECTOR', 'vector', normals),
+        ('scatter_point_rot', 'FLOAT', 'value', rotations),
+        ('scatter_point_ID', 'FLOAT', 'value', ids),
+    ):
+        mesh.attributes.new(attr_name, data_type, 'POINT').data.foreach_set(prop, values.ravel())
+    obj = bpy.data.objects.new(name, mesh)
+    (collection or bpy.context.scene.collection).objects.link(obj)
+    log.info('%s: %s scattered points', name, len(points))
+    return obj
@@ -0,0 +1,101 @@
+"""Scatter computations run in worker processes, this module must only
+depend on numpy so spawned workers don't have to import bpy.
+"""
+import os
+import re
+
+import numpy as np
+
+
+def save_npz(path, **arrays):
+    # write then rename, so an interrupted run never leaves a partial file in the cache
+    tmp_path = f'{path}.{os.getpid()}.tmp.npz'
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def _poisson_disk_filter(xy, dist_min, rank):
+    """Indices of the points kept so no two points are closer than dist_min.
+    Points are binned in cells of dist_min, the lowest rank of each cell wins
+    and is then dropped if a winner of a neighbour cell with a lower rank is
+    too close, which is slightly sparser than a sequential elimination.
+    """
+    if len(xy) == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = np.floor(xy / dist_min).astype(np.int64)
+
+    def cell_keys(c):
+        return (c[:, 0] << 32) + (c[:, 1] + (1 << 31))
+
+    keys = cell_keys(cells)
+    order = np.lexsort((rank, keys))
+    first = np.append(True, keys[order][1:] != keys[order][:-1])
+    kept = order[first]
+    kept_keys = keys[kept]
+
+    drop = np.zeros(len(kept), dtype=bool)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            if dx == 0 and dy == 0:
+                continue
+            nkeys = cell_keys(cells[kept] + (dx, dy))
+            pos = np.minimum(np.searchsorted(kept_keys, nkeys), len(kept) - 1)
+            found = kept_keys[pos] == nkeys
+            other = kept[pos]
+            close = np.sum((xy[other] - xy[kept]) ** 2, axis=1) < dist_min ** 2
+            drop |= found & close & (rank[other] < rank[kept])
+    return kept[~drop]
+
+
+def scatter_points(terrain_path, out_path, dist_min, density_max, density_factor, type_id, seed):
+    """Scatter vegetation points on a terrain exported by export_terrain_arrays,
+    this only needs numpy so it runs in worker processes.
+
+    Candidates are spread uniformly on the triangles with `density_max *
+    density_factor` points per square meter, thinned by the clearance from
+    roads, rails and buildings (1 - highest proximity) interpolated at each
+    point, then spaced by at least dist_min meters.
+    """
+    rng = np.random.default_rng(seed)
+    with np.load(terrain_path) as data:
+        co, tris, prox = data['co'].astype(np.float64), data['tris'], data['prox']
+
+    a, b, c = co[tris[:, 0]], co[tris[:, 1]], co[tris[:, 2]]
+    cross = np.cross(b - a, c - a)
+    double_area = np.linalg.norm(cross, axis=1)
+    counts = rng.poisson(0.5 * double_area * density_max * density_factor)
+    idx = np.repeat(np.arange(len(tris)), counts)
+
+    # uniform barycentric coordinates
+    s = np.sqrt(rng.random(len(idx)))
+    r = rng.random(len(idx))
+    u, v, w = 1 - s, s * (1 - r), s * r
+    clearance = np.clip(1 - prox.max(axis=1), 0, 1)
+    clearance = u * clearance[tris[idx, 0]] + v * clearance[tris[idx, 1]] + w * clearance[tris[idx, 2]]
+    keep = rng.random(len(idx)) < clearance
+    idx, u, v, w = idx[keep], u[keep], v[keep], w[keep]
+    points = u[:, None] * a[idx] + v[:, None] * b[idx] + w[:, None] * c[idx]
+
+    kept = _poisson_disk_filter(points[:, 0:2], dist_min, rng.permutation(len(points)))
+    idx, points = idx[kept], points[kept]
+    with np.errstate(invalid='ignore'):
+        normals = np.nan_to_num(cross[idx] / double_area[idx, None])
+
+    save_npz(
+        out_path,
+        points=points.astype(np.float32),
+        normals=normals.astype(np.float32),
+        rotations=rng.uniform(0, 2 * np.pi, len(points)).astype(np.float32),
+        ids=np.full(len(points), type_id, dtype=np.float32),
+    )
+    return out_path
+
+
+def prune_cache(cache_dir, prefix, keep):
+    """Remove the files of the cache named `<prefix><key>.npz` other than
+    keep, left by previous versions of the same terrain or point cloud."""
+    pattern = re.compile(re.escape(prefix) + r'[0-9a-f]{16}\.npz')
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if pattern.fullmatch(name) and path != keep:
+            os.remove(path)
@@ -17,6 +17,22 @@ RENDER_TREES = True
 RENDER_CLOUDS = True
 RENDER_BUILDINGS = True
 
+# compute the vegetation scatter points of every zoom level in worker
+# processes and instance them from cached point clouds, instead of
+# duplicating the sat meshes to run the ScatterPoints geometry nodes
+PREBAKED_VEGETATION_SCATTER = False
+SCATTER_CACHE_DIR = 'output/scatter-cache'
+SCATTER_WORKERS = multiprocessing.cpu_count()
+
+# lower the sat terrain meshes by the earth curvature drop from the scene origin
+APPLY_EARTH_CURVATURE = False
+
+# build the sat zoom levels as nested rings of a multi resolution terrain
+# instead of boolean cuts, this also loads the zoom levels skipped otherwise
+BUILD_SAT_LOD = False
+# size of the terrain LOD grid cells, in pixels of the sat images
+SAT_LOD_TEXELS_PER_CELL = 16
+
 CAMERA_LENS = 33.3
 CAMERA_CLIP_START = 0.1
 CAMERA_CLIP_END = 70000
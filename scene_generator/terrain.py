@@ -14,8 +14,13 @@ from .utils import make_active_object
 from .utils import make_active_collection
 from .utils import import_object_from_file
 from .utils import cut_object
+from .utils import apply_modifiers
 from .utils import _decimate_dissolve
 from .utils import _triangulate_modifier
+from .utils import apply_earth_curvature
+from .scatter import bake_scatter
+from .scatter import point_cloud_object
+from .lod import build_sat_lod
 from . import settings
 
 
@@ -69,33 +74,14 @@ def load_buildings(scene, sat, apply_mod=False):
         # obj.hide_viewport = True
 
         if apply_mod:
-            bpy.ops.object.modifier_apply(modifier=g1.name)
+            apply_modifiers(obj, [g1])
     bpy.data.materials["BrickMaterial"].node_tree.nodes["Attribute"].attribute_name = "building__wall_uv"
     bpy.data.materials["BrickMaterial.001"].node_tree.nodes["Attribute"].attribute_name = "building__top_uv"
 
     return obj
 
 
-def make_sat(scene):
-    log.info('importing sattelite stuff...')
-    sat = {}
-    GOOGLE_SAT_OBJNAME = "EXPORT_GOOGLE_SAT_WM"
-    for zoom in range(15, 23):
-        if zoom in [16, 19, 20, 21, 22]:
-            log.warning('skipping zoom level %s because errors', zoom)
-            continue
-        newname = 'sat_' + str(zoom)
-        oldpath = pathlib.Path(f"models/predeal1/google/tren/{zoom}/google-{zoom}-tren.blend")
-        sat[zoom] = import_object_from_file(
-            scene, newname, oldpath, GOOGLE_SAT_OBJNAME,
-            convert_to_mesh=True, add_bbox=True,
-            # triangulate=True,
-            # bbox_scale_z=2, bbox_scale_xy=0.5,
-            # get_geo_extents=True,
-            segmentation_id=settings.SEGMENTATION_IDS['terrain'],
-        )
-    keys = sorted(sat.keys())
-
+def _cut_sat_levels(sat, keys):
     # cut the big sats in the middle
     for i in range(len(keys) - 1):
         big_obj = sat[keys[i]].name
@@ -123,7 +109,6 @@ def make_sat(scene):
                                         use_proportional_projected=False)
             bpy.ops.object.editmode_toggle()
 
-            # bpy.ops.earth.curvature()
             # bpy.ops.transform.translate(value=(-0, -0, transform_z), orient_axis_ortho='X',
             #                             orient_type='GLOBAL',
             #                             orient_matrix=((1, 0, 0), (0, 1, 0), (0, 0, 1)),
@@ -134,6 +119,37 @@ def make_sat(scene):
             #                             use_proportional_connected=False,
             #                             use_proportional_projected=False)
 
+
+def make_sat(scene):
+    log.info('importing sattelite stuff...')
+    sat = {}
+    GOOGLE_SAT_OBJNAME = "EXPORT_GOOGLE_SAT_WM"
+    for zoom in range(15, 23):
+        if zoom in [16, 19, 20, 21, 22] and not settings.BUILD_SAT_LOD:
+            log.warning('skipping zoom level %s because errors', zoom)
+            continue
+        newname = 'sat_' + str(zoom)
+        oldpath = pathlib.Path(f"models/predeal1/google/tren/{zoom}/google-{zoom}-tren.blend")
+        sat[zoom] = import_object_from_file(
+            scene, newname, oldpath, GOOGLE_SAT_OBJNAME,
+            convert_to_mesh=True, add_bbox=True,
+            # triangulate=True,
+            # bbox_scale_z=2, bbox_scale_xy=0.5,
+            # get_geo_extents=True,
+            segmentation_id=settings.SEGMENTATION_IDS['terrain'],
+        )
+    keys = sorted(sat.keys())
+
+    if settings.BUILD_SAT_LOD:
+        # nested rings stitched to each other, no cut nor lowered edge loops
+        build_sat_lod({key: bpy.data.objects[sat[key].name] for key in keys},
+                      texels_per_cell=settings.SAT_LOD_TEXELS_PER_CELL)
+    else:
+        _cut_sat_levels(sat, keys)
+
+    if settings.APPLY_EARTH_CURVATURE:
+        apply_earth_curvature([sat[key].name for key in keys])
+
     # set up sat shader
     for key in sat:
         with make_active_object(sat[key].name) as obj:
@@ -262,6 +278,38 @@ def load_lowpoly_vegetation(veg_type):
     return c
 
 
+def _scatter_points_modifier(obj, zoom, tree_type_params):
+    log.info('adding vegetation geometry modifier on zoom level %s...', zoom)
+    obj.vertex_groups.new(name='scatter_point_normal')
+    obj.vertex_groups.new(name='scatter_point_rot')
+    obj.vertex_groups.new(name='scatter_point_ID')
+    g1 = new_geometry_modifier(
+        obj.name,
+        'ScatterPoints',
+        'ScatterPoints',
+        {
+            "Input_4": 666,  # seed
+            "Input_6": tree_type_params['dist_min'],  # distance min
+            "Input_7": tree_type_params['density_max'],  # density max
+            "Input_8": tree_type_params['density_factor'],  # density factor
+            "Input_12": tree_type_params['id'],  # value
+            "Input_19_attribute_name": "roads_prox",
+            "Input_20_attribute_name": "rails_prox",
+            "Input_21_attribute_name": "buildings_prox",
+            "Output_10_attribute_name": 'scatter_point_normal',
+            "Output_11_attribute_name": 'scatter_point_rot',
+            "Output_13_attribute_name": 'scatter_point_ID',
+        },
+        toggle_inputs=[
+            "Input_19_use_attribute",
+            "Input_20_use_attribute",
+            "Input_21_use_attribute",
+        ],
+    )
+
+    apply_modifiers(obj)
+
+
 def make_trees(scene, camera_obj, sat, roads, rails, buildings, load_highpoly=False):
     log.info('making trees...')
 
@@ -299,18 +347,30 @@ def make_trees(scene, camera_obj, sat, roads, rails, buildings, load_highpoly=Fa
         },
     }
 
-    ret_list = []
+    zooms = []
     for zoom in sat:
         if zoom < 17:
             log.info('skipping zoom level = %s, too many trees', zoom)
             continue
+        zooms.append(zoom)
+
+    if settings.PREBAKED_VEGETATION_SCATTER:
+        # all the point clouds are computed at once in worker processes
+        point_clouds = bake_scatter({zoom: bpy.data.objects[sat[zoom].name] for zoom in zooms}, tree_types)
+
+    ret_list = []
+    for zoom in zooms:
         for tree_type_name, tree_type_params in tree_types.items():
-            sat_obj = bpy.data.objects[sat[zoom].name]
-            bpy.ops.object.duplicate(
-                {"object": sat_obj,
-                    "selected_objects": [sat_obj]},)
-            obj = bpy.data.objects[sat_obj.name + '.001']
-            obj.name = sat[zoom].name + '__vegetation__' + tree_type_name
+            name = sat[zoom].name + '__vegetation__' + tree_type_name
+            if settings.PREBAKED_VEGETATION_SCATTER:
+                obj = point_cloud_object(name, point_clouds[zoom, tree_type_name])
+            else:
+                sat_obj = bpy.data.objects[sat[zoom].name]
+                bpy.ops.object.duplicate(
+                    {"object": sat_obj,
+                        "selected_objects": [sat_obj]},)
+                obj = bpy.data.objects[sat_obj.name + '.001']
+                obj.name = name
             scene += BlenderObjectAsset(blender_object=obj, name=obj.name,
                                         position=obj.location.to_tuple(),
                                         quaternion=obj.rotation_quaternion[0:4],
@@ -321,41 +381,8 @@ def make_trees(scene, camera_obj, sat, roads, rails, buildings, load_highpoly=Fa
                 # obj.hide_render = True
                 # obj.hide_viewport = True
 
-                log.info('adding vegetation geometry modifier on zoom level %s...', zoom)
-                obj.vertex_groups.new(name='scatter_point_normal')
-                obj.vertex_groups.new(name='scatter_point_rot')
-                obj.vertex_groups.new(name='scatter_point_ID')
-                g1 = new_geometry_modifier(
-                    obj.name,
-                    'ScatterPoints',
-                    'ScatterPoints',
-                    {
-                        "Input_4": 666,  # seed
-                        "Input_6": tree_type_params['dist_min'],  # distance min
-                        "Input_7": tree_type_params['density_max'],  # density max
-                        "Input_8": tree_type_params['density_factor'],  # density factor
-                        "Input_12": tree_type_params['id'],  # value
-                        "Input_19_attribute_name": "roads_prox",
-                        "Input_20_attribute_name": "rails_prox",
-                        "Input_21_attribute_name": "buildings_prox",
-                        "Output_10_attribute_name": 'scatter_point_normal',
-                        "Output_11_attribute_name": 'scatter_point_rot',
-                        "Output_13_attribute_name": 'scatter_point_ID',
-                    },
-                    toggle_inputs=[
-                        "Input_19_use_attribute",
-                        "Input_20_use_attribute",
-                        "Input_21_use_attribute",
-                    ],
-                )
-
-                for mod in obj.modifiers:
-                    log.info(
-                        'applying modifier %s on object %s',
-                        mod.name.encode('ascii', 'backslashreplace').decode('ascii'),
-                        obj.name,
-                    )
-                    bpy.ops.object.modifier_apply(modifier=mod.name)
+                if not settings.PREBAKED_VEGETATION_SCATTER:
+                    _scatter_points_modifier(obj, zoom, tree_type_params)
                 g2 = new_geometry_modifier(
                     obj.name,
                     'SpawnInstances',
@@ -574,27 +601,17 @@ def make_terrain(scene, camera_obj, add_trees=False, add_buildings=False):
 
     # apply all the sat geo mods from above
     for zoom in sat:
-        with make_active_object(sat[zoom].name) as sat_obj:
-            for mod in sat_obj.modifiers:
-                log.info(
-                    'applying modifier %s on object %s',
-                    mod.name.encode('ascii', 'backslashreplace').decode('ascii'),
-                    sat_obj.name,
-                )
-                bpy.ops.object.modifier_apply(modifier=mod.name)
+        apply_modifiers(bpy.data.objects[sat[zoom].name])
     geo_mods = {}
 
-    # add geom modifiers to get prox to various things, output vertex group floats
+    # add geom modifiers to get prox to various things, output point float attributes
+    # (no vertex groups with these names, so the scatter can read them with foreach_get)
     # roads range 5m
     # rails range 4m
     # building range 3m
 
     for zoom in sat:
         with make_active_object(sat[zoom].name) as sat_obj:
-            sat_obj.vertex_groups.new(name='rails_prox')
-            sat_obj.vertex_groups.new(name='roads_prox')
-            # sat_obj.vertex_groups.new(name='roads_prox_small')
-            sat_obj.vertex_groups.new(name='buildings_prox')
             sat_obj.vertex_groups.new(name="map_UV_1m")
             new_geometry_modifier(
                 sat_obj.name,
@@ -5,6 +5,7 @@ import logging
 import contextlib
 
 import bpy
+import numpy as np
 import kubric as kb
 
 log = logging.getLogger(__name__)
@@ -149,23 +150,21 @@ def cut_object(target_id, cutout_id, exact=False, hole_tolerant=True,
                solidify=False, op='DIFFERENCE', apply=True):
     log.info('cutting %s out of %s', cutout_id, target_id)
 
-    # bpy.context.view_layer.objects.active = bpy.data.objects[target_id]
-    with make_active_object(target_id) as obj:
+    obj = bpy.data.objects[target_id]
+    mod = obj.modifiers.new('Boolean', 'BOOLEAN')
+    mod.operation = op
+    mod.object = bpy.data.objects[cutout_id]
 
-        bpy.ops.object.modifier_add(type='BOOLEAN')
-        bpy.context.object.modifiers["Boolean"].operation = op
-        bpy.context.object.modifiers["Boolean"].object = bpy.data.objects[cutout_id]
+    if exact:
+        mod.solver = 'EXACT'
+        mod.use_self = False
+        mod.use_hole_tolerant = hole_tolerant
+    else:
+        mod.solver = 'FAST'
+        mod.double_threshold = 0
 
-        if exact:
-            bpy.context.object.modifiers["Boolean"].solver = 'EXACT'
-            bpy.context.object.modifiers["Boolean"].use_self = False
-            bpy.context.object.modifiers["Boolean"].use_hole_tolerant = hole_tolerant
-        else:
-            bpy.context.object.modifiers["Boolean"].solver = 'FAST'
-            bpy.context.object.modifiers["Boolean"].double_threshold = 0
-
-        if apply:
-            bpy.ops.object.modifier_apply(modifier="Boolean")
+    if apply:
+        apply_modifiers(obj, [mod])
 
 
 def import_object_from_file(scene, new_name, orig_filename, orig_name,
@@ -209,15 +208,24 @@ def import_object_from_file(scene, new_name, orig_filename, orig_name,
         bpy.ops.object.convert(target='MESH')
         bpy.ops.object.origin_set(type='ORIGIN_GEOMETRY', center='BOUNDS')
 
+    # modifiers are stacked and applied together in a single evaluation
+    obj = bpy.data.objects[new_name]
+    modifiers = []
     if subsurf_levels:
-        _subsurf_modif(subsurf_levels)
+        modifiers.append(_subsurf_modif(obj, subsurf_levels))
 
     if convert_to_curve:
+        apply_modifiers(obj, modifiers)
+        modifiers = []
         log.info('%s: Convert into CURVE', bpy.context.object.name)
         bpy.ops.object.convert(target='CURVE')
+        obj = bpy.data.objects[new_name]
+
+    apply_modifiers(obj, modifiers)
 
     if shrinkwrap_to_planes:
-        _shrinkwrap_z(shrinkwrap_to_planes)
+        log.info('%s: Projecting onto %s', obj.name, shrinkwrap_to_planes)
+        get_terrain_projector(shrinkwrap_to_planes).project(obj)
 
     if add_bbox:
         log.info('%s: Adding BBOX', bpy.context.object.name)
@@ -267,27 +275,58 @@ def import_object_from_file(scene, new_name, orig_filename, orig_name,
     return cube
 
 
-def _shrinkwrap_z(plane_ids):
-    for plane_id in plane_ids:
-        log.info('%s: Applying SHRINKWRAP onto %s', bpy.context.object.name, plane_id)
-        bpy.ops.object.modifier_add(type='SHRINKWRAP')
-        bpy.context.object.modifiers["Shrinkwrap"].target = bpy.data.objects[plane_id]
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_mode = 'ABOVE_SURFACE'
-        bpy.context.object.modifiers["Shrinkwrap"].wrap_method = 'PROJECT'
-        bpy.context.object.modifiers["Shrinkwrap"].use_project_z = True
-        bpy.context.object.modifiers["Shrinkwrap"].use_negative_direction = True
-        bpy.context.object.modifiers["Shrinkwrap"].use_apply_on_spline = True
-        bpy.ops.object.modifier_apply(modifier="Shrinkwrap")
-
-
-def _subsurf_modif(levels):
-    log.info('%s: Applying SUBSURF levels= %s', bpy.context.object.name, levels)
-    bpy.ops.object.modifier_add(type='SUBSURF')
-    bpy.context.object.modifiers["Subdivision"].subdivision_type = 'CATMULL_CLARK'
-    bpy.context.object.modifiers["Subdivision"].levels = levels
-    bpy.context.object.modifiers["Subdivision"].render_levels = levels
-    bpy.context.object.modifiers["Subdivision"].show_only_control_edges = False
-    bpy.ops.object.modifier_apply(modifier="Subdivision")
+def apply_modifiers(obj, modifiers=None):
+    """Apply some modifiers of obj (all of them by default) with a single
+    evaluation of the stack through the depsgraph, instead of one
+    modifier_apply operator call (and depsgraph update) per modifier.
+    The other modifiers are disabled during the evaluation and kept.
+    """
+    if modifiers is None:
+        modifiers = list(obj.modifiers)
+    # like the operator, modifiers disabled in the viewport are skipped
+    names = [mod.name for mod in modifiers if mod.show_viewport]
+    if not names:
+        return obj
+    log.info('%s: Applying modifiers %s', obj.name,
+             [name.encode('ascii', 'backslashreplace').decode('ascii') for name in names])
+
+    if obj.type != 'MESH':
+        # the evaluated geometry of a curve is a mesh, the operator keeps the curve
+        for name in names:
+            bpy.ops.object.modifier_apply({'object': obj, 'active_object': obj}, modifier=name)
+        return obj
+
+    shown = {mod.name: mod.show_viewport for mod in obj.modifiers}
+    try:
+        for mod in obj.modifiers:
+            mod.show_viewport = mod.name in names
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        mesh = bpy.data.meshes.new_from_object(obj.evaluated_get(depsgraph),
+                                               preserve_all_data_layers=True,
+                                               depsgraph=depsgraph)
+    finally:
+        for mod in obj.modifiers:
+            mod.show_viewport = shown[mod.name]
+
+    for name in names:
+        obj.modifiers.remove(obj.modifiers[name])
+    old = obj.data
+    obj.data = mesh
+    if old.users == 0:
+        name = old.name
+        bpy.data.meshes.remove(old)
+        mesh.name = name
+    return obj
+
+
+def _subsurf_modif(obj, levels):
+    log.info('%s: Adding SUBSURF levels= %s', obj.name, levels)
+    mod = obj.modifiers.new('Subdivision', 'SUBSURF')
+    mod.subdivision_type = 'CATMULL_CLARK'
+    mod.levels = levels
+    mod.render_levels = levels
+    mod.show_only_control_edges = False
+    return mod
 
 
 def _decimate_dissolve(obj):
@@ -329,14 +368,233 @@ def _get_geo_extents():
     print(repr(geo_bbox))
 
 
+def _world_coords(obj, mesh):
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float64)
+    mesh.vertices.foreach_get('co', co)
+    co = co.reshape(-1, 3)
+    m = np.array(obj.matrix_world)
+    return co @ m[:3, :3].T + m[:3, 3]
+
+
+class TerrainProjector:
+    """Project points along Z onto several terrain objects at once, like a
+    stack of SHRINKWRAP modifiers projecting along Z onto each of them where
+    the last target hit wins, but in a single vectorized pass over one packed
+    R-tree of the triangles of all the targets.
+
+    Targets are given from the lowest to the highest priority, e.g. the sat
+    zoom levels from the coarsest to the finest, so each point lands on the
+    finest level covering it.
+    """
+
+    def __init__(self, target_names):
+        vector = importlib.import_module('BlenderGIS.core.vector')
+        self.target_names = list(target_names)
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        tris, levels = [], []
+        for level, name in enumerate(self.target_names):
+            obj_eval = bpy.data.objects[name].evaluated_get(depsgraph)
+            mesh = obj_eval.to_mesh()
+            try:
+                co = _world_coords(obj_eval, mesh)
+                mesh.calc_loop_triangles()
+                idx = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+                mesh.loop_triangles.foreach_get('vertices', idx)
+            finally:
+                obj_eval.to_mesh_clear()
+            tris.append(co[idx].reshape(-1, 3, 3))
+            levels.append(np.full(len(idx) // 3, level))
+        self.tris = np.concatenate(tris)
+        self.levels = np.concatenate(levels)
+        xy = self.tris[:, :, 0:2]
+        self.tree = vector.PackedRTree(np.column_stack((xy.min(axis=1), xy.max(axis=1))))
+        log.info('terrain projector: %s triangles from %s targets', len(self.tris), len(self.target_names))
+
+    def heights(self, pts):
+        """Heights of the targets under (n, 2+) world points, from the target
+        with the highest priority, nan for the points outside of all of them.
+        """
+        if len(pts) == 0:
+            return np.zeros(0)
+        pts = np.asarray(pts, dtype=np.float64).reshape(len(pts), -1)[:, 0:2]
+        pt_idx, tri_idx = self.tree.queryPairs(np.column_stack((pts, pts)))
+        a, b, c = (self.tris[tri_idx, k] for k in range(3))
+        p = pts[pt_idx]
+
+        # barycentric coordinates of the points in the xy projection of the triangles
+        v0, v1, v2 = b[:, 0:2] - a[:, 0:2], c[:, 0:2] - a[:, 0:2], p - a[:, 0:2]
+        den = v0[:, 0] * v1[:, 1] - v1[:, 0] * v0[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = (v2[:, 0] * v1[:, 1] - v1[:, 0] * v2[:, 1]) / den
+            v = (v0[:, 0] * v2[:, 1] - v2[:, 0] * v0[:, 1]) / den
+        eps = 1e-9
+        inside = (den != 0) & (u >= -eps) & (v >= -eps) & (u + v <= 1 + eps)
+        z = a[:, 2] + u * (b[:, 2] - a[:, 2]) + v * (c[:, 2] - a[:, 2])
+
+        # for each point keep the hit with the highest priority level
+        pt_idx, z, level = pt_idx[inside], z[inside], self.levels[tri_idx[inside]]
+        order = np.lexsort((level, pt_idx))
+        pt_idx, z = pt_idx[order], z[order]
+        last = np.append(pt_idx[1:] != pt_idx[:-1], True)
+        heights = np.full(len(pts), np.nan)
+        heights[pt_idx[last]] = z[last]
+        return heights
+
+    def project(self, obj):
+        """Move the vertices of a mesh, or the control points and handles of
+        a curve, onto the targets. Points outside of the targets don't move.
+        """
+        if obj.type == 'MESH':
+            op_utils = importlib.import_module('BlenderGIS.operators.utils')
+            co = op_utils.getMeshCoords(obj)
+            z = self.heights(co)
+            hits = ~np.isnan(z)
+            co[hits, 2] = z[hits]
+            op_utils.setMeshCoords(obj, co)
+            return int(hits.sum())
+
+        m = np.array(obj.matrix_world)
+        mi = np.linalg.inv(m)
+        nb_hits = 0
+        for spline in obj.data.splines:
+            if spline.type == 'BEZIER':
+                points, props, size = spline.bezier_points, ['co', 'handle_left', 'handle_right'], 3
+            else:
+                points, props, size = spline.points, ['co'], 4
+            for prop in props:
+                co = np.empty(len(points) * size, dtype=np.float64)
+                points.foreach_get(prop, co)
+                co = co.reshape(-1, size)
+                world = co[:, 0:3] @ m[:3, :3].T + m[:3, 3]
+                z = self.heights(world)
+                hits = ~np.isnan(z)
+                world[hits, 2] = z[hits]
+                co[:, 0:3] = world @ mi[:3, :3].T + mi[:3, 3]
+                points.foreach_set(prop, co.astype(np.float32).ravel())
+                nb_hits += int(hits.sum())
+        obj.data.update_tag()
+        return nb_hits
+
+
+_terrain_projectors = {}
+
+
+def _signature_value(value):
+    if isinstance(value, bpy.types.ID):
+        return value.name_full
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    try:
+        return tuple(_signature_value(v) for v in value)
+    except TypeError:
+        # other structs, their repr can change between calls
+        return type(value).__name__
+
+
+def _modifier_signature(mod):
+    """Settings of a modifier, with the inputs of geometry nodes modifiers
+    which are stored as ID properties (e.g. mod['Input_5'])."""
+    props = [(prop.identifier, getattr(mod, prop.identifier)) for prop in mod.bl_rna.properties
+             if prop.identifier != 'rna_type' and prop.type != 'COLLECTION']
+    inputs = [(key, mod[key]) for key in mod.keys()]
+    return tuple((key, _signature_value(value)) for key, value in props + inputs)
+
+
+def _targets_signature(target_names):
+    signature = []
+    for name in target_names:
+        obj = bpy.data.objects[name]
+        co = np.empty(len(obj.data.vertices) * 3, dtype=np.float32)
+        obj.data.vertices.foreach_get('co', co)
+        signature.append((
+            obj.data.name_full, len(co), len(obj.data.polygons), float(co.sum(dtype=np.float64)),
+            tuple(np.array(obj.matrix_world).ravel().tolist()),
+            tuple(_modifier_signature(mod) for mod in obj.modifiers),
+        ))
+    return signature
+
+
+def get_terrain_projector(target_names):
+    """Projector onto the target objects, shared by all the objects draped on
+    the same targets and only rebuilt when the target meshes change.
+    """
+    key = tuple(target_names)
+    signature = _targets_signature(key)
+    cached = _terrain_projectors.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    projector = TerrainProjector(key)
+    _terrain_projectors[key] = (signature, projector)
+    return projector
+
+
+def polygons_near(obj_name, ref_obj_name, distance, attribute_name=None):
+    """Return the indices of the polygons of obj_name whose bounds are
+    closer than distance to the edges of ref_obj_name (e.g. buildings near
+    the rails), using the BlenderGIS packed R-tree instead of booleans.
+    The selection is optionally stored as a boolean face attribute.
+    """
+    vector = importlib.import_module('BlenderGIS.core.vector')
+    obj = bpy.data.objects[obj_name]
+    ref = bpy.data.objects[ref_obj_name]
+
+    mesh = obj.data
+    co = _world_coords(obj, mesh)
+    nb_polys = len(mesh.polygons)
+    loop_start = np.empty(nb_polys, dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', loop_start)
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loop_verts)
+    loop_co = co[loop_verts]
+    bounds = np.column_stack((
+        np.minimum.reduceat(loop_co[:, 0:2], loop_start),
+        np.maximum.reduceat(loop_co[:, 0:2], loop_start),
+    ))
+    tree = vector.PackedRTree(bounds)
+
+    # the reference object can be a curve, read its evaluated mesh
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    ref_eval = ref.evaluated_get(depsgraph)
+    ref_mesh = ref_eval.to_mesh()
+    try:
+        ref_co = _world_coords(ref_eval, ref_mesh)[:, 0:2]
+        edges = np.empty(len(ref_mesh.edges) * 2, dtype=np.int32)
+        ref_mesh.edges.foreach_get('vertices', edges)
+    finally:
+        ref_eval.to_mesh_clear()
+    a, b = ref_co[edges[0::2]], ref_co[edges[1::2]]
+    boxes = np.column_stack((np.minimum(a, b) - distance, np.maximum(a, b) + distance))
+    selected = tree.queryMany(boxes)
+    log.info('%s polygons of %s near %s', len(selected), obj_name, ref_obj_name)
+
+    if attribute_name:
+        if attribute_name in mesh.attributes:
+            mesh.attributes.remove(mesh.attributes[attribute_name])
+        attr = mesh.attributes.new(attribute_name, 'BOOLEAN', 'FACE')
+        mask = np.zeros(nb_polys, dtype=bool)
+        mask[selected] = True
+        attr.data.foreach_set('value', mask)
+    return selected
+
+
+def apply_earth_curvature(obj_names, viewpoint=(0, 0)):
+    """Lower the vertices of each object by the earth curvature drop at their
+    distance from the viewpoint (scene origin by default), in one numpy pass
+    per object instead of the per vertex earth.curvature operator.
+    """
+    earth = importlib.import_module('BlenderGIS.operators.mesh_earth_sphere')
+    for name in obj_names:
+        log.info('applying earth curvature to %s', name)
+        earth.earthCurvature(bpy.data.objects[name], viewpoint)
+
+
 def enable_adaptive_subdivision(object_list):
     log.info('enabling adaptive subdivision for %s objects', len(object_list))
     for obj in object_list:
-        with make_active_object(obj.name):
-            bpy.ops.object.modifier_add(type='SUBSURF')
-            bpy.context.object.cycles.use_adaptive_subdivision = True
-            bpy.context.object.cycles.dicing_rate = 0.9
-            bpy.context.object.modifiers["Subdivision"].levels = 0
+        mod = obj.modifiers.new('Subdivision', 'SUBSURF')
+        mod.levels = 0
+        obj.cycles.use_adaptive_subdivision = True
+        obj.cycles.dicing_rate = 0.9
 
 
 def load_addons():